@@ -0,0 +1,172 @@
+"""
+#title           :benchmark.py
+#description     :Benchmark of the poll-decode-publish pipeline of main__Fusion using simulated Modbus devices
+#author          :Nicholas Putra Rihandoko, Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :python3 benchmark.py [--cycles N] [--realtime] [--sql-latency ms] [--adda] [--output result.json]
+#notes           :results are printed/saved as JSON, compare them between releases on the same hardware
+#python_version  :3.9.2
+#==============================================================================
+"""
+
+# Import library
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import types
+import query
+import main__Fusion as fusion
+
+# Stages measured inside each node library (method name: stage name)
+NODE_STAGES = {"count_address":"planning", "handle_sign":"decode", "save_read":"decode", "handle_extra_calculation":"derived"}
+CLIENT_STAGES = {"read_holding_registers":"bus_io", "read_input_registers":"bus_io"}
+
+class stopwatch:
+    def __init__(self):
+        self._cycle = {}    # accumulated time of each stage in the current cycle (in seconds)
+        self._samples = {}  # time of each stage for every cycle (in seconds)
+
+    def wrap(self,obj,method,stage):
+        # Replace the object's method with a timed one, the time is added to the stage
+        func = getattr(obj, method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try: return func(*args, **kwargs)
+            finally: self.record(stage, time.perf_counter() - start)
+        setattr(obj, method, timed)
+
+    def measure(self,stage,func,*args):
+        start = time.perf_counter()
+        try: return func(*args)
+        finally: self.record(stage, time.perf_counter() - start)
+
+    def record(self,stage,period):
+        self._cycle[stage] = self._cycle.get(stage, 0) + period
+
+    def next_cycle(self):
+        for stage, period in self._cycle.items(): self._samples.setdefault(stage, []).append(period)
+        self._cycle = {}
+
+    def summary(self):
+        # Statistics of each stage per cycle (in microseconds)
+        result = {}
+        for stage, samples in self._samples.items():
+            samples = sorted(samples)
+            result[stage] = {"count": len(samples),
+                             "total_s": round(sum(samples), 6),
+                             "mean_us": round(statistics.mean(samples)*1e6, 1),
+                             "p50_us": round(samples[len(samples)//2]*1e6, 1),
+                             "p95_us": round(samples[min(len(samples)-1, int(len(samples)*0.95))]*1e6, 1),
+                             "max_us": round(samples[-1]*1e6, 1)}
+        return result
+
+class sql_connection:
+    # Local stand-in of a PyMySQL connection, the latency emulates the round-trip to the database server
+    def __init__(self,latency=0,**kwargs):
+        self._latency = latency/1000
+        self.rows = 0
+
+    def __enter__(self):
+        time.sleep(self._latency)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def cursor(self):
+        return self
+
+    def execute(self,mysql_query,data=None):
+        time.sleep(self._latency)
+        self.rows += 1
+
+    def fetchall(self):
+        return ()
+
+    def commit(self):
+        time.sleep(self._latency)
+
+def setup_benchmark(realtime, sql_latency, log_dir, adda=False):
+    # Use the same node configuration as main__Fusion, but with simulated Modbus slaves (and ADDA board)
+    fusion.MOD_SIMULATE = True
+    fusion.MOD_PORT1 = fusion.MOD_PORT_ID1  # no USB adaptor to look for, the simulated port is named after its ID
+    server_modbus = fusion.setup_modbus()
+    for node in server_modbus:
+        node._client._realtime = realtime
+        # The latency between commands is bus time too, only wait for it in realtime mode
+        if not realtime: node._client_transmission_delay = 0
+    fusion.ADDA_SIMULATE = adda
+    server_AD, server_DA = fusion.setup_ADDA() if adda else ([], [])
+    # Keep the CSV log and SQL upload away from the real backup file and database
+    query.log_directory = log_dir
+    query.pymysql = types.SimpleNamespace(connect=lambda **kwargs: sql_connection(sql_latency, **kwargs))
+    timer = stopwatch()
+    for node in server_modbus:
+        for method, stage in NODE_STAGES.items(): timer.wrap(node, method, stage)
+    # Several nodes share the same port/client, wrap each client only once
+    for client in {id(node._client): node._client for node in server_modbus}.values():
+        for method, stage in CLIENT_STAGES.items(): timer.wrap(client, method, stage)
+    return server_modbus, server_AD, server_DA, timer
+
+def run_benchmark(cycles, realtime, sql_latency, adda=False):
+    with tempfile.TemporaryDirectory() as log_dir, open(os.devnull, 'w') as devnull:
+        # Messages of the setup (e.g. "ID Read success") go to stderr, stdout only carries the JSON result
+        with contextlib.redirect_stdout(sys.stderr):
+            server_modbus, server_AD, server_DA, timer = setup_benchmark(realtime, sql_latency, log_dir, adda)
+        server = server_modbus + server_AD
+        stdout = sys.stdout
+        for c in range(cycles):
+            # Console output of the libraries is discarded, only its formatting cost is measured
+            sys.stdout = devnull
+            try:
+                start = time.perf_counter()
+                timer.measure("read_modbus", fusion.read_modbus, server_modbus)
+                if adda:
+                    timer.measure("write_ADDA", fusion.write_ADDA, server_DA)
+                    timer.measure("read_ADDA", fusion.read_ADDA, server_AD)
+                now = datetime.datetime.now()
+                timer.measure("print_response", query.print_response, server, now)
+                title, data = timer.measure("data_processing", fusion.data_processing, server, now)
+                timer.measure("csv_log", query.log_in_csv, title, data, now, fusion.FILENAME_REALTIME)
+                timer.measure("sql_upload", query.update_SQL, title, data, now, fusion.FILENAME_RECAP, fusion.SQL_SERVER_REALTIME, now - datetime.timedelta(seconds=1), 0, fusion.DB_TIMEOUT)
+                timer.record("cycle", time.perf_counter() - start)
+            finally:
+                sys.stdout = stdout
+            timer.next_cycle()
+        bus = {node._client._port: dict(node._client._stats) for node in server_modbus}
+        with contextlib.redirect_stdout(sys.stderr):
+            for node in server_AD:
+                bus[node._name] = dict(node._SPI._backend.adc._stats, samples=node._samples, dropped=node._buffer.dropped if node._buffer else 0)
+                node.ADS1256_StopAcquisition()
+    return timer.summary(), bus
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the main__Fusion poll-decode-publish pipeline")
+    parser.add_argument("--cycles", type=int, default=200, help="number of measured communication loops")
+    parser.add_argument("--realtime", action="store_true", help="wait for the modelled serial bus time")
+    parser.add_argument("--sql-latency", type=float, default=0, help="round-trip time of the simulated database (in milliseconds)")
+    parser.add_argument("--adda", action="store_true", help="include the simulated ADDA board (SPI and DRDY timing)")
+    parser.add_argument("--output", default=None, help="save the JSON result to this file")
+    args = parser.parse_args()
+
+    stages, bus = run_benchmark(args.cycles, args.realtime, args.sql_latency, args.adda)
+    result = {"meta": {"timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                       "host": platform.node(), "machine": platform.machine(),
+                       "python": platform.python_version(), "cycles": args.cycles,
+                       "realtime": args.realtime, "sql_latency_ms": args.sql_latency, "adda": args.adda},
+              "stages": stages,
+              "bus": bus}
+    if args.output:
+        with open(args.output, 'w') as file: json.dump(result, file, indent=2)
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
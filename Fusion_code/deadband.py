@@ -0,0 +1,90 @@
+"""
+#title           :deadband.py
+#description     :report-by-exception of the rows for the uplinks, per-channel deadband and maximum silence
+#author          :Nicholas Putra Rihandoko, Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Energy Monitoring System, main__Fusion.py (DEADBAND parameters), one filter per uplink (MySQL, MQTT)
+#notes           :only the uplinks are filtered, the daily CSV file gets every checked row, the snapshot and hub get every row
+#python_version  :3.9.2
+#==============================================================================
+"""
+
+import fnmatch
+
+"""
+A row is reported when at least one channel:
+- moved by more than its deadband since the last reported row (a deadband of 0 reports any change),
+- changed between a value and None (e.g. a device went offline or came back),
+- was not reported for its maximum silence (in seconds), the row then works as a heartbeat.
+The whole row is reported (one SQL insert / one MQTT row), so the receiver always sees complete rows.
+Text values (e.g. the time) and the channels with a deadband of None are never compared.
+"""
+
+class deadband:
+    def __init__(self,channels=None,default=0,silence=300):
+        # channels: {name or pattern (e.g. 'ADC1_*'): (deadband, silence)}, silence None uses the default
+        self._channels = channels or {}
+        self._default = default
+        self._silence = silence
+        self._title = None
+        self._limits = []           # (column, deadband) of the compared channels
+        self._heartbeat = silence   # shortest silence of the row
+        self._reported = None       # values of the last reported row
+        self._stamp = None          # time of the last reported row
+        self.stats = {"reported": 0, "suppressed": 0}
+
+    def get_setting(self,name):
+        # (deadband, silence) of a channel, the exact name first then the first matching pattern
+        setting = self._channels.get(name)
+        if setting is None:
+            for pattern, value in self._channels.items():
+                if fnmatch.fnmatchcase(name, pattern):
+                    setting = value
+                    break
+        if setting is None: return self._default, self._silence
+        limit, silence = setting
+        return limit, self._silence if silence is None else silence
+
+    def compile(self,title,data):
+        # Settings of every column, done again only when the title changes (e.g. an ADDA module is added)
+        self._title = list(title)
+        self._limits = []
+        silences = []
+        for column, (name, value) in enumerate(zip(title, data)):
+            limit, silence = self.get_setting(name)
+            if limit is None or isinstance(value, str): continue
+            self._limits.append((column, limit))
+            silences.append(silence)
+        # The whole row is sent, so the channel with the shortest silence sets the heartbeat
+        silences = [s for s in silences if s is not None]
+        self._heartbeat = min(silences) if silences else self._silence
+        self._reported = None
+
+    def check(self,title,data,stamp):
+        # True if the row has to be sent to the uplink (stamp: time in seconds, e.g. time.monotonic())
+        if title != self._title: self.compile(title, data)
+        if self.is_significant(data, stamp):
+            self._reported = list(data)
+            self._stamp = stamp
+            self.stats["reported"] += 1
+            return True
+        self.stats["suppressed"] += 1
+        return False
+
+    def is_significant(self,data,stamp):
+        if self._reported is None: return True
+        if self._heartbeat is not None and stamp - self._stamp >= self._heartbeat: return True
+        reported = self._reported
+        for column, limit in self._limits:
+            value, last = data[column], reported[column]
+            if value is None or last is None:
+                if value is not last: return True
+                continue
+            try:
+                if abs(value - last) > limit or (limit == 0 and value != last): return True
+            except TypeError:
+                if value != last: return True
+        return False
+
+### END OF FILE ###
@@ -0,0 +1,155 @@
+"""
+#title           :hub.py
+#description     :local publish/subscribe hub of the live data, many subscribers with bounded queues
+#author          :Nicholas Putra Rihandoko, Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Energy Monitoring System, started by main__Fusion.py, or python3 hub.py [--path /tmp/nepower_hub] [--tcp 0.0.0.0:9001]
+#notes           :the frames follow ipc.py, a producer sends SCHEMA/DATA frames (e.g. socket_client_thread), a subscriber sends SUBSCRIBE first
+#python_version  :3.9.2
+#==============================================================================
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import ipc
+
+PATH = '/tmp/nepower_hub'   # AF_UNIX socket of the hub
+QUEUE = 50                  # rows waiting for each subscriber, the oldest is dropped when it does not keep up
+TIMEOUT = 10                # a subscriber that does not take a row for this long (in seconds) is disconnected
+
+class hub:
+    def __init__(self,path=PATH,tcp=None,queue=QUEUE,timeout=TIMEOUT):
+        self._path = path
+        self._tcp = tcp             # None, or (host, port) of the optional TCP listener (e.g. remote dashboards)
+        self._queue = queue
+        self._timeout = timeout
+        self._subscribers = set()
+        self._encoder = ipc.encoder()
+        self._schema = None         # SCHEMA frame of the latest row, sent to a subscriber before its first row
+        self._latest = None         # latest (SCHEMA frame, DATA frame), sent right away to a new subscriber
+        self._loop = None
+        self._ready = threading.Event()
+        self.stats = {"published": 0, "dropped": 0, "subscribers": 0, "slow_disconnected": 0}
+
+    def publish(self,title,data):
+        # Encode the row once and queue it for every subscriber, never waits (call from the event loop)
+        schema, frame = self._encoder.encode_frames(title, data)
+        if schema is not None: self._schema = schema
+        item = self._latest = (self._schema, frame)
+        self.stats["published"] += 1
+        for queue in self._subscribers:
+            if queue.full():
+                # Slow subscriber, forget its oldest row instead of waiting
+                queue.get_nowait()
+                self.stats["dropped"] += 1
+            queue.put_nowait(item)
+
+    def publish_threadsafe(self,title,data):
+        # Publish from another thread (e.g. the communication loop of main__Fusion.py)
+        # The row is counted as dropped while the hub is not serving (e.g. its socket could not be bound)
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self.stats["dropped"] += 1
+            return
+        try:
+            loop.call_soon_threadsafe(self.publish, title, list(data))
+        except RuntimeError:
+            # The loop was closed in the meantime
+            self.stats["dropped"] += 1
+
+    async def handle_client(self,reader,writer):
+        try:
+            header = await reader.readexactly(ipc.HEADER.size)
+            magic, version, kind, length = ipc.HEADER.unpack(header)
+            if magic != ipc.MAGIC or version != ipc.VERSION or length > ipc.MAX_PAYLOAD:
+                raise ValueError("invalid IPC frame header (magic {}, version {})".format(magic, version))
+            payload = await reader.readexactly(length)
+            if kind == ipc.SUBSCRIBE: await self.handle_subscriber(writer)
+            else: await self.handle_producer(reader, header + payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logging.error("(hub) client error: %s", e)
+        finally:
+            writer.close()
+
+    async def handle_producer(self,reader,data):
+        # Rows of another process (e.g. the socket_client_thread of the modbus_code mains), republished to the subscribers
+        decoder = ipc.decoder()
+        while data:
+            for row in decoder.feed(data): self.publish(decoder.title, row)
+            data = await reader.read(65536)
+
+    async def handle_subscriber(self,writer):
+        queue = asyncio.Queue(self._queue)
+        if self._latest is not None: queue.put_nowait(self._latest)
+        self._subscribers.add(queue)
+        self.stats["subscribers"] = len(self._subscribers)
+        sent = None
+        try:
+            while True:
+                schema, frame = await queue.get()
+                if schema is not sent:
+                    writer.write(schema)
+                    sent = schema
+                writer.write(frame)
+                await asyncio.wait_for(writer.drain(), self._timeout)
+        except asyncio.TimeoutError:
+            self.stats["slow_disconnected"] += 1
+            logging.warning("(hub) subscriber is too slow, disconnected")
+        finally:
+            self._subscribers.discard(queue)
+            self.stats["subscribers"] = len(self._subscribers)
+
+    async def serve(self):
+        servers = []
+        try:
+            if os.path.exists(self._path): os.remove(self._path)
+            servers.append(await asyncio.start_unix_server(self.handle_client, self._path))
+            if self._tcp: servers.append(await asyncio.start_server(self.handle_client, *self._tcp))
+        except OSError as e:
+            # e.g. the TCP port is in use, the rows published meanwhile are dropped
+            logging.error("(hub) cannot listen on %s%s: %s", self._path, " and {}:{}".format(*self._tcp) if self._tcp else "", e)
+            for server in servers: server.close()
+            self._ready.set()
+            return
+        # Only accept rows once the hub is listening
+        self._loop = asyncio.get_running_loop()
+        self._ready.set()
+        logging.info("(hub) serving on %s%s", self._path, " and {}:{}".format(*self._tcp) if self._tcp else "")
+        try:
+            await asyncio.gather(*(server.serve_forever() for server in servers))
+        finally:
+            self._loop = None
+
+    def start(self):
+        # Run the hub in a background thread with its own event loop
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="hub", daemon=True)
+        thread.start()
+        self._ready.wait(5)
+        return thread
+
+def main():
+    parser = argparse.ArgumentParser(description="Local publish/subscribe hub of the live data")
+    parser.add_argument("--path", default=PATH, help="AF_UNIX socket of the hub")
+    parser.add_argument("--tcp", default=None, help="also listen on HOST:PORT, e.g. 0.0.0.0:9001")
+    parser.add_argument("--queue", type=int, default=QUEUE, help="rows waiting for each subscriber")
+    args = parser.parse_args()
+    tcp = None
+    if args.tcp:
+        host, port = args.tcp.rsplit(':', 1)
+        tcp = (host, int(port))
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(hub(args.path, tcp, args.queue).serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
+
+### END OF FILE ###
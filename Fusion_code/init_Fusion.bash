@@ -58,12 +58,14 @@ sudo apt install python3-pymodbus -y
 sudo apt install python3-can -y
 sudo apt install python3-rpi.gpio -y
 sudo apt install python3-spidev -y
+sudo apt install python3-numpy -y
+sudo apt install python3-paho-mqtt -y
 
 
 # For Virtual Environment
 #python3 -m venv myenv
 #source myenv/bin/activate
-#pip3 install pymysql pymodbus python-can  RPi.GPIO spidev
+#pip3 install pymysql pymodbus python-can  RPi.GPIO spidev numpy
 #deactivate
 
 # 'zerotier' for virtual LAN and remote access
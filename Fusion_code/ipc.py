@@ -0,0 +1,132 @@
+"""
+#title           :ipc.py
+#description     :framed, schema-versioned binary protocol between main__Fusion and the local consumers (display)
+#author          :Nicholas Putra Rihandoko, Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Energy Monitoring System, main__Fusion.py -> main__display.py, snapshot.py, hub.py
+#notes           :keep the copies in display_code and modbus_code identical, only uses the standard library
+#python_version  :3.9.2
+#==============================================================================
+"""
+
+import json
+import math
+import struct
+
+# Frame header: magic, protocol version, frame type, payload length (network byte order)
+MAGIC = 0xA5
+VERSION = 1
+HEADER = struct.Struct('!BBBI')
+SCHEMA, DATA, SUBSCRIBE = 1, 2, 3  # frame types
+MAX_PAYLOAD = 1 << 20           # a longer frame means the stream is out of sync
+"""
+SCHEMA  : JSON {"id": schema id, "title": [names], "kinds": "dqs..."}, sent before the first row and when the layout changes
+DATA    : schema id (H), numeric values ('d' float, 'q' integer) packed in one block, then each text value as length (H) + UTF-8
+SUBSCRIBE : empty, first frame of a subscriber of the pub/sub hub (hub.py), a producer starts with SCHEMA
+kinds   : 'd' float (None is sent as NaN), 'q' integer (and bool), 's' text
+"""
+
+def get_kind(value):
+    if isinstance(value, str): return 's'
+    if isinstance(value, (bool, int)): return 'q'
+    return 'd'
+
+def frame(kind,payload):
+    return HEADER.pack(MAGIC, VERSION, kind, len(payload)) + payload
+
+class layout:
+    # Compiled schema, shared by the encoder and the decoder
+    def __init__(self,schema_id,title,kinds):
+        self.id = schema_id
+        self.title = list(title)
+        self.kinds = kinds
+        self.numbers = [i for i, k in enumerate(kinds) if k != 's']
+        self.texts = [i for i, k in enumerate(kinds) if k == 's']
+        self.block = struct.Struct('!H' + ''.join(kinds[i] for i in self.numbers))
+
+    def pack(self,data):
+        # Payload of a DATA frame: schema id and numbers in one block, then the texts
+        numbers = [float('nan') if data[i] is None else data[i] for i in self.numbers]
+        payload = [self.block.pack(self.id, *numbers)]
+        for i in self.texts:
+            text = data[i].encode('utf-8')
+            payload.append(struct.pack('!H', len(text)) + text)
+        return b''.join(payload)
+
+    def unpack(self,payload):
+        # Values of a DATA payload, in the order of the title
+        values = [None]*len(self.kinds)
+        numbers = self.block.unpack_from(payload)
+        for i, value in zip(self.numbers, numbers[1:]):
+            values[i] = None if isinstance(value, float) and math.isnan(value) else value
+        offset = self.block.size
+        for i in self.texts:
+            size, = struct.unpack_from('!H', payload, offset)
+            values[i] = payload[offset+2:offset+2+size].decode('utf-8')
+            offset += 2 + size
+        return values
+
+    def to_json(self):
+        return json.dumps({"id": self.id, "title": self.title, "kinds": self.kinds}).encode('utf-8')
+
+def from_json(payload):
+    schema = json.loads(payload.decode('utf-8'))
+    return layout(schema["id"], schema["title"], schema["kinds"])
+
+class encoder:
+    def __init__(self):
+        # Use a new encoder for each connection, the schema is sent again to the new reader
+        self._layout = None
+        self._schema_id = 0
+
+    def encode(self,title,data):
+        # Bytes of one row, preceded by a SCHEMA frame when the title or the kind of a value has changed
+        schema, data = self.encode_frames(title, data)
+        return schema + data if schema else data
+
+    def encode_frames(self,title,data):
+        # (SCHEMA frame or None if unchanged, DATA frame) of one row
+        kinds = ''.join(get_kind(v) for v in data)
+        schema = None
+        current = self._layout
+        if current is None or current.kinds != kinds or current.title != title:
+            self._schema_id = (self._schema_id + 1) & 0xFFFF
+            current = self._layout = layout(self._schema_id, title, kinds)
+            schema = frame(SCHEMA, current.to_json())
+        return schema, frame(DATA, current.pack(data))
+
+class decoder:
+    def __init__(self):
+        self._buffer = bytearray()
+        self._layouts = {}
+        self.title = None           # title of the latest decoded row
+
+    def feed(self,data):
+        # Add received bytes, return the complete rows (list of values in the order of the title)
+        self._buffer += data
+        rows = []
+        while len(self._buffer) >= HEADER.size:
+            magic, version, kind, length = HEADER.unpack_from(self._buffer)
+            if magic != MAGIC or version != VERSION or length > MAX_PAYLOAD:
+                raise ValueError("invalid IPC frame header (magic {}, version {})".format(magic, version))
+            end = HEADER.size + length
+            if len(self._buffer) < end: break
+            payload = bytes(self._buffer[HEADER.size:end])
+            del self._buffer[:end]
+            if kind == SCHEMA:
+                current = from_json(payload)
+                self._layouts[current.id] = current
+            elif kind == DATA:
+                row = self.decode(payload)
+                if row is not None: rows.append(row)
+        return rows
+
+    def decode(self,payload):
+        schema_id, = struct.unpack_from('!H', payload)
+        current = self._layouts.get(schema_id)
+        if current is None: return None     # row of an unknown schema (joined in the middle), skip it
+        self.title = current.title
+        return current.unpack(payload)
+
+### END OF FILE ###
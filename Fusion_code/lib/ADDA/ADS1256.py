@@ -10,8 +10,14 @@
 #==============================================================================
 """
 import time
-import spidev
-import RPi.GPIO as GPIO
+import threading
+try:
+    import spidev
+    import RPi.GPIO as GPIO
+except ImportError:
+    # Not a Raspberry Pi, only the simulated backend can be used (see simulator.py)
+    spidev, GPIO = None, None
+from . import ring_buffer
 
 ScanMode = 0
 
@@ -77,44 +83,56 @@ CMD = {'CMD_WAKEUP' : 0x00,     # Completes SYNC and Exits Standby Mode 0000  00
       }
 
 class ADS1256:
-    def __init__(self,name,bus=0,device=1,rst=18,drdy=17,cs_adc=22):
+    def __init__(self,name,bus=0,device=1,rst=18,drdy=17,cs_adc=22,spi_speed=20000,backend=None):
         self._name = name
         self._rst_pin = rst
         self._drdy_pin = drdy
         self._cs_adc_pin = cs_adc
-        self._SPI = spidev.SpiDev(bus, device)
+        self._spi_speed = spi_speed # SPI clock (in Hz), the ADS1256 allows up to 1.92 MHz (fCLKIN/4)
+        # SPI and GPIO of the Raspberry Pi, or of a simulated backend (simulator.backend)
+        self._GPIO = backend.GPIO if backend else GPIO
+        self._SPI = (backend.SpiDev if backend else spidev.SpiDev)(bus, device)
+        self._lock = threading.Lock()
+        self._acquiring = False     # continuous acquisition, see ADS1256_StartAcquisition()
+        self._scan = []             # scanned channels
+        self._scan_index = 0        # position (in the scanned channels) of the running conversion
+        self._row = []              # raw values of the scan in progress
+        self._buffer = None         # complete scans with their monotonic time (ring_buffer)
+        self._samples = 0           # number of conversions since the acquisition is started
+        self._pipelined = True      # the next conversion runs while the current result is read
+        self._drate = ADS1256_DRATE_E['ADS1256_30000SPS']
         self.ADS1256_init()
         self.Value = self.ADS1256_GetAll()
 
     # Hardware reset
     def ADS1256_reset(self):
-        GPIO.output(self._rst_pin, GPIO.HIGH)
+        self._GPIO.output(self._rst_pin, self._GPIO.HIGH)
         time.sleep(200 // 1000.0)
-        GPIO.output(self._rst_pin, GPIO.LOW)
+        self._GPIO.output(self._rst_pin, self._GPIO.LOW)
         time.sleep(200 // 1000.0)
-        GPIO.output(self._rst_pin, GPIO.HIGH)
+        self._GPIO.output(self._rst_pin, self._GPIO.HIGH)
     
     def ADS1256_WriteCmd(self, reg):
-        GPIO.output(self._cs_adc_pin, GPIO.LOW)#cs  0
+        self._GPIO.output(self._cs_adc_pin, self._GPIO.LOW)#cs  0
         self._SPI.writebytes([reg])
-        GPIO.output(self._cs_adc_pin, GPIO.HIGH)#cs 1
+        self._GPIO.output(self._cs_adc_pin, self._GPIO.HIGH)#cs 1
     
     def ADS1256_WriteReg(self, reg, data):
-        GPIO.output(self._cs_adc_pin, GPIO.LOW)#cs  0
+        self._GPIO.output(self._cs_adc_pin, self._GPIO.LOW)#cs  0
         self._SPI.writebytes([CMD['CMD_WREG'] | reg, 0x00, data])
-        GPIO.output(self._cs_adc_pin, GPIO.HIGH)#cs 1
+        self._GPIO.output(self._cs_adc_pin, self._GPIO.HIGH)#cs 1
         
     def ADS1256_Read_data(self, reg):
-        GPIO.output(self._cs_adc_pin, GPIO.LOW)#cs  0
+        self._GPIO.output(self._cs_adc_pin, self._GPIO.LOW)#cs  0
         self._SPI.writebytes([CMD['CMD_RREG'] | reg, 0x00])
         data = self._SPI.readbytes(1)
-        GPIO.output(self._cs_adc_pin, GPIO.HIGH)#cs 1
+        self._GPIO.output(self._cs_adc_pin, self._GPIO.HIGH)#cs 1
 
         return data
         
     def ADS1256_WaitDRDY(self):
         for i in range(0,400000,1):
-            if(GPIO.input(self._drdy_pin) == 0):
+            if(self._GPIO.input(self._drdy_pin) == 0):
                 break
         if(i >= 400000):
             print ("Time Out ...\r\n")
@@ -135,14 +153,21 @@ class ADS1256:
         buf[1] = 0x08
         buf[2] = (0<<5) | (0<<3) | (gain<<0)
         buf[3] = drate
+        self._drate = drate
         
-        GPIO.output(self._cs_adc_pin, GPIO.LOW)#cs  0
+        self._GPIO.output(self._cs_adc_pin, self._GPIO.LOW)#cs  0
         self._SPI.writebytes([CMD['CMD_WREG'] | 0, 0x03])
         self._SPI.writebytes(buf)
         
-        GPIO.output(self._cs_adc_pin, GPIO.HIGH)#cs 1
+        self._GPIO.output(self._cs_adc_pin, self._GPIO.HIGH)#cs 1
         time.sleep(1 // 1000.0)
 
+    def ADS1256_GetMux(self, Channel):
+        # Value of the MUX register for the channel
+        if(ScanMode == 0):
+            return (Channel<<4) | (1<<3)
+        return ((2*Channel) << 4) | (2*Channel + 1)
+
     def ADS1256_SetChannal(self, Channal):
         if Channal > 7:
             return 0
@@ -176,12 +201,15 @@ class ADS1256:
         
     def ADS1256_Read_ADC_Data(self):
         self.ADS1256_WaitDRDY()
-        GPIO.output(self._cs_adc_pin, GPIO.LOW)#cs  0
+        self._GPIO.output(self._cs_adc_pin, self._GPIO.LOW)#cs  0
         self._SPI.writebytes([CMD['CMD_RDATA']])
         #time.sleep(10 // 1000.0)
 
         buf = self._SPI.readbytes(3)
-        GPIO.output(self._cs_adc_pin, GPIO.HIGH)#cs 1
+        self._GPIO.output(self._cs_adc_pin, self._GPIO.HIGH)#cs 1
+        return self.ADS1256_ConvertData(buf)
+
+    def ADS1256_ConvertData(self, buf):
         read = (buf[0]<<16) & 0xff0000
         read |= (buf[1]<<8) & 0xff00
         read |= (buf[2]) & 0xff
@@ -216,15 +244,86 @@ class ADS1256:
             ADC_Value[i] = self.ADS1256_GetChannalValue(i)
         return ADC_Value
     
+    # Continuous acquisition
+    # The ADC keeps converting and every DRDY falling edge calls ADS1256_HandleDRDY(), which writes the MUX of
+    # the next channel, restarts the conversion, then reads the result of the current channel (datasheet: cycling
+    # through the inputs). So the next conversion runs while the current one is read and stored.
+    def ADS1256_StartAcquisition(self, channels=None, buffer=30000):
+        if self._acquiring:
+            return
+        self._scan = list(channels) if channels is not None else list(range(8 if ScanMode == 0 else 4))
+        self._scan_index = 0
+        self._row = [0]*len(self._scan)
+        self._buffer = ring_buffer.ring_buffer(len(self._scan), buffer)
+        # Statistics of each channel over a communication cycle (set by the main program)
+        self.Mean, self.Min, self.Max, self.RMS = [[0]*len(self._scan) for _ in range(4)]
+        # The next conversion can only run during the read (RDATA and 3 bytes) if the read ends well before the
+        # settling time (about one data period + 0.18 ms), otherwise the next result replaces the current one
+        sps = [float(k[8:-3].replace('d','.')) for k, v in ADS1256_DRATE_E.items() if v == self._drate][0]
+        self._pipelined = 32 / self._spi_speed < (1/sps + 0.00018) / 2
+        self._acquiring = True
+        # Detect the DRDY edge before the first conversion is started, so its edge is not missed
+        self._GPIO.add_event_detect(self._drdy_pin, self._GPIO.FALLING, callback=self.ADS1256_HandleDRDY)
+        with self._lock:
+            self.ADS1256_WriteReg(REG_E['REG_MUX'], self.ADS1256_GetMux(self._scan[0]))
+            self.ADS1256_WriteCmd(CMD['CMD_SYNC'])
+            self.ADS1256_WriteCmd(CMD['CMD_WAKEUP'])
+
+    def ADS1256_StopAcquisition(self):
+        if not self._acquiring:
+            return
+        # Under the lock of ADS1256_HandleDRDY, a conversion being read is finished before the acquisition stops
+        with self._lock:
+            self._acquiring = False
+        self._GPIO.remove_event_detect(self._drdy_pin)
+
+    def ADS1256_HandleDRDY(self, pin):
+        # Called from the GPIO event thread when a conversion is ready
+        if not self._acquiring:
+            return
+        with self._lock:
+            if not self._acquiring:
+                return
+            current = self._scan_index
+            following = (current + 1) % len(self._scan)
+            self._GPIO.output(self._cs_adc_pin, self._GPIO.LOW)#cs  0
+            self._SPI.writebytes([CMD['CMD_WREG'] | REG_E['REG_MUX'], 0x00, self.ADS1256_GetMux(self._scan[following])])
+            self._SPI.writebytes([CMD['CMD_SYNC']])
+            late = False
+            if self._pipelined:
+                self._SPI.writebytes([CMD['CMD_WAKEUP']])
+                # If the read is delayed until the next conversion ends, the result belongs to the next channel
+                late = self._GPIO.input(self._drdy_pin) == 0
+            self._SPI.writebytes([CMD['CMD_RDATA']])
+            buf = self._SPI.readbytes(3)
+            if not self._pipelined:
+                # Slow SPI clock, start the next conversion after the read
+                self._SPI.writebytes([CMD['CMD_WAKEUP']])
+            self._GPIO.output(self._cs_adc_pin, self._GPIO.HIGH)#cs 1
+            self._scan_index = following
+            self._row[following if late else current] = self.ADS1256_ConvertData(buf)
+            self._samples += 1
+            if following == 0:
+                self._buffer.append(time.monotonic(), self._row)
+
+    def ADS1256_GetSamples(self):
+        # Take the complete scans since the previous call: (time array, raw value array with one column per channel)
+        return self._buffer.read()
+
+    def ADS1256_GetLatest(self):
+        # Latest complete scan, [raw value of each scanned channel]
+        latest = self._buffer.latest() if self._buffer is not None else None
+        return latest.tolist() if latest is not None else None
+
     def module_init(self):
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        GPIO.setup(self._rst_pin, GPIO.OUT)
-        #GPIO.setup(self._cs_dac_pin, GPIO.OUT)
-        GPIO.setup(self._cs_adc_pin, GPIO.OUT)
-        #GPIO.setup(self._drdy_pin, GPIO.IN)
-        GPIO.setup(self._drdy_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        self._SPI.max_speed_hz = 20000
+        self._GPIO.setmode(self._GPIO.BCM)
+        self._GPIO.setwarnings(False)
+        self._GPIO.setup(self._rst_pin, self._GPIO.OUT)
+        #self._GPIO.setup(self._cs_dac_pin, self._GPIO.OUT)
+        self._GPIO.setup(self._cs_adc_pin, self._GPIO.OUT)
+        #self._GPIO.setup(self._drdy_pin, self._GPIO.IN)
+        self._GPIO.setup(self._drdy_pin, self._GPIO.IN, pull_up_down=self._GPIO.PUD_UP)
+        self._SPI.max_speed_hz = self._spi_speed
         self._SPI.mode = 0b01
         return 0;
 
@@ -10,14 +10,20 @@
 #==============================================================================
 """
 import time
-import spidev
-import RPi.GPIO as GPIO
+try:
+    import spidev
+    import RPi.GPIO as GPIO
+except ImportError:
+    # Not a Raspberry Pi, only the simulated backend can be used (see simulator.py)
+    spidev, GPIO = None, None
 
 class DAC8532:
-    def __init__(self,name,bus=0,device=1,cs_dac=23,A=0x30,B=0x34,DAC_MAX=65535,DAC_VREF=3.3):
+    def __init__(self,name,bus=0,device=1,cs_dac=23,A=0x30,B=0x34,DAC_MAX=65535,DAC_VREF=3.3,backend=None):
         self._name = name
         self._cs_dac_pin = cs_dac
-        self._SPI = spidev.SpiDev(bus, device)
+        # SPI and GPIO of the Raspberry Pi, or of a simulated backend (simulator.backend)
+        self._GPIO = backend.GPIO if backend else GPIO
+        self._SPI = (backend.SpiDev if backend else spidev.SpiDev)(bus, device)
         self._channel_A = A
         self._channel_B = B
         self.Value = [0, 0]
@@ -26,9 +32,9 @@ class DAC8532:
         self.module_init()
     
     def DAC8532_Write_Data(self, Channel, Data):
-        GPIO.output(self._cs_dac_pin, GPIO.LOW)#cs  0
+        self._GPIO.output(self._cs_dac_pin, self._GPIO.LOW)#cs  0
         self._SPI.writebytes([Channel, Data >> 8, Data & 0xff])
-        GPIO.output(self._cs_dac_pin, GPIO.HIGH)#cs  0
+        self._GPIO.output(self._cs_dac_pin, self._GPIO.HIGH)#cs  0
         
     def DAC8532_Out_Voltage(self, Channel, Voltage):
         if((Voltage <= self._DAC_VREF) and (Voltage >= 0)):
@@ -36,13 +42,13 @@ class DAC8532:
             self.DAC8532_Write_Data(Channel, temp)
             
     def module_init(self):
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        #GPIO.setup(self._rst_pin, GPIO.OUT)
-        GPIO.setup(self._cs_dac_pin, GPIO.OUT)
-        #GPIO.setup(self._cs_adc_pin, GPIO.OUT)
-        #GPIO.setup(self._drdy_pin, GPIO.IN)
-        #GPIO.setup(self._drdy_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        self._GPIO.setmode(self._GPIO.BCM)
+        self._GPIO.setwarnings(False)
+        #self._GPIO.setup(self._rst_pin, self._GPIO.OUT)
+        self._GPIO.setup(self._cs_dac_pin, self._GPIO.OUT)
+        #self._GPIO.setup(self._cs_adc_pin, self._GPIO.OUT)
+        #self._GPIO.setup(self._drdy_pin, self._GPIO.IN)
+        #self._GPIO.setup(self._drdy_pin, self._GPIO.IN, pull_up_down=self._GPIO.PUD_UP)
         self._SPI.max_speed_hz = 20000
         self._SPI.mode = 0b01
         return 0;
@@ -0,0 +1,52 @@
+"""
+#title           :calibration.py
+#description     :per-channel linear calibration (gain/offset) of the ADDA channels, applied with NumPy
+#author          :Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Signal Processing
+#notes           :the calibration file is JSON, {"ADC1": {"limit": [[raw_min, raw_max, eng_min, eng_max], ...], "round": [...]}},
+#                 see calibration.example.json (MicroHydro sensors)
+#python_version  :3.11.2
+#==============================================================================
+"""
+import json
+import logging
+import numpy as np
+
+class calibration:
+    def __init__(self,limit,rounded=None):
+        # limit: [[raw_min, raw_max, eng_min, eng_max], ...] of each channel, same as the old remap() arguments
+        limit = np.array(limit, dtype=float).reshape(-1, 4)
+        raw_min, raw_max, eng_min, eng_max = limit.T
+        self._limit = limit
+        self._gain = (eng_max - eng_min) / (raw_max - raw_min)
+        self._offset = eng_min - raw_min * self._gain
+        self._digits = np.array(rounded if rounded is not None else [6]*len(limit), dtype=int)
+        self._scale = 10.0 ** self._digits
+
+    def apply(self,raw):
+        # Convert raw values into engineering values, raw is a sample (1 row) or a block (1 row per sample)
+        raw = np.asarray(raw, dtype=float)
+        n = raw.shape[-1]
+        return raw * self._gain[:n] + self._offset[:n]
+
+    def round(self,value):
+        # Round each channel to its number of decimals, -0.0 becomes 0.0 (same as round_digits)
+        value = np.asarray(value, dtype=float)
+        n = value.shape[-1]
+        return np.round(value * self._scale[:n]) / self._scale[:n] + 0.0
+
+def load_calibration(filename,default=None):
+    # Read the calibration of every ADDA module: {name: calibration}, modules missing from the file use the default
+    calibrations = dict(default or {})
+    try:
+        with open(filename, 'r') as file: config = json.load(file)
+    except FileNotFoundError:
+        logging.warning("(ADDA) calibration file '%s' is not found, using the full range of each channel", filename)
+        return calibrations
+    for name, value in config.items():
+        calibrations[name] = calibration(value["limit"], value.get("round"))
+    return calibrations
+
+### END OF FILE ###
@@ -0,0 +1,56 @@
+"""
+#title           :ring_buffer.py
+#description     :preallocated NumPy ring buffer for high-rate multichannel samples
+#author          :Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Signal Processing
+#notes           :one writer (e.g. the DRDY callback of ADS1256) and one reader (the communication loop)
+#python_version  :3.11.2
+#==============================================================================
+"""
+import threading
+import numpy as np
+
+class ring_buffer:
+    def __init__(self,channels,size):
+        self._size = size
+        self._data = np.zeros((size, channels))    # samples, one row per scan of all channels
+        self._time = np.zeros(size)                # monotonic time of each row (in seconds)
+        self._head = 0                              # total number of written rows
+        self._tail = 0                              # total number of read rows
+        self._lock = threading.Lock()
+        self.dropped = 0                            # rows overwritten before being read
+
+    def append(self,stamp,row):
+        with self._lock:
+            i = self._head % self._size
+            self._data[i] = row
+            self._time[i] = stamp
+            self._head += 1
+
+    def read(self):
+        # Take the rows written since the previous read (oldest first): (time array, sample array)
+        with self._lock:
+            tail = max(self._tail, self._head - self._size)
+            self.dropped += tail - self._tail
+            index = np.arange(tail, self._head) % self._size
+            self._tail = self._head
+            return self._time[index], self._data[index]
+
+    def latest(self):
+        # Latest row, or None if nothing has been written
+        with self._lock:
+            if self._head == 0: return None
+            return self._data[(self._head - 1) % self._size].copy()
+
+def aggregate(values):
+    # Statistics of each channel (column) over the samples (rows), computed for all channels at once
+    if len(values) == 0: return None
+    return {"mean": values.mean(axis=0),
+            "min": values.min(axis=0),
+            "max": values.max(axis=0),
+            "rms": np.sqrt(np.mean(np.square(values), axis=0)),
+            "last": values[-1]}
+
+### END OF FILE ###
@@ -0,0 +1,283 @@
+"""
+#title           :simulator.py
+#description     :simulated SPI and GPIO backend of the ADS1256 and DAC8532 libraries
+#author          :Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Signal Processing, testing and benchmarking without the ADDA board
+#notes           :ADS1256(..., backend=simulator.backend()), models the commands, registers, conversion time and DRDY
+#python_version  :3.11.2
+#==============================================================================
+"""
+import heapq
+import math
+import threading
+import time
+
+# Data rate of each DRATE register value (in samples per second)
+DRATE_SPS = {0xF0:30000, 0xE0:15000, 0xD0:7500, 0xC0:3750, 0xB0:2000, 0xA1:1000, 0x92:500, 0x82:100,
+             0x72:60, 0x63:50, 0x53:30, 0x43:25, 0x33:15, 0x20:10, 0x13:5, 0x03:2.5}
+
+# Input voltage of each ADC channel used when no values are given (MicroHydro sensors, see calibration.example.json)
+# key: channel (AIN0-AIN7), value: voltage or function of elapsed time (in seconds)
+PROFILE = {0: 2.64,                                         # water pressure, 4-20 mA into 220 ohm
+           1: 3.08,                                         # flow rate
+           5: lambda t: 2.5 + 1.0*math.sin(2*math.pi*t),    # generator power
+           6: lambda t: 2.5 + 0.5*math.sin(2*math.pi*5*t),  # rpm
+           7: lambda t: 2.5 + 0.8*math.sin(2*math.pi*5*t)}  # turbine torque
+
+class gpio:
+    # Stand-in of the RPi.GPIO module
+    BCM, BOARD = 11, 10
+    IN, OUT = 1, 0
+    LOW, HIGH = 0, 1
+    PUD_OFF, PUD_DOWN, PUD_UP = 20, 21, 22
+    RISING, FALLING, BOTH = 31, 32, 33
+
+    def __init__(self):
+        self._output    = {}            # level of each output pin
+        self._inputs    = {}            # function giving the level of each input pin (driven by a device)
+        self._listeners = {}            # devices notified when an output pin changes
+        self._callbacks = {}            # event detection of each pin: (edge, callback)
+        self._events    = []            # scheduled edges: (time, sequence, pin, edge)
+        self._sequence  = 0
+        self._condition = threading.Condition()
+        self._thread    = None
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        if direction == self.OUT: self._output.setdefault(pin, self.HIGH if initial is None else initial)
+
+    def output(self, pin, value):
+        self._output[pin] = value
+        for listener in self._listeners.get(pin, []): listener(pin, value)
+
+    def input(self, pin):
+        if pin in self._inputs: return self._inputs[pin]()
+        return self._output.get(pin, self.HIGH)
+
+    def attach(self, pin, listener=None, source=None):
+        # Connect a simulated device: listener of an output pin (e.g. CS), or source of an input pin (e.g. DRDY)
+        if listener: self._listeners.setdefault(pin, []).append(listener)
+        if source: self._inputs[pin] = source
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self._callbacks[pin] = (edge, callback)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def remove_event_detect(self, pin):
+        self._callbacks.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        self._callbacks.clear()
+
+    def schedule(self, pin, edge, when):
+        # Signal an edge of an input pin at the given monotonic time, only if the pin has event detection
+        if pin not in self._callbacks: return
+        with self._condition:
+            self._sequence += 1
+            heapq.heappush(self._events, (when, self._sequence, pin, edge))
+            self._condition.notify()
+
+    def run(self):
+        # Event thread, calls the callback of each edge in time order (like the RPi.GPIO event thread)
+        while True:
+            with self._condition:
+                while not self._events or self._events[0][0] > time.monotonic():
+                    self._condition.wait(self._events[0][0] - time.monotonic() if self._events else None)
+                when, _, pin, edge = heapq.heappop(self._events)
+            detect = self._callbacks.get(pin)
+            if detect and detect[0] in (edge, self.BOTH) and detect[1]: detect[1](pin)
+
+class ads1256:
+    # ADS1256 model: registers, commands, conversion time, and DRDY pin
+    def __init__(self,gpio,cs=22,drdy=17,rst=18,values=None,vref=5,realtime=True):
+        self._gpio      = gpio
+        self._cs_pin    = cs
+        self._drdy_pin  = drdy
+        self._vref      = vref
+        self._realtime  = realtime      # False: conversions are ready immediately
+        self._values    = dict(PROFILE) if values is None else dict(values)
+        self._start     = time.monotonic()
+        self._stats     = {"conversions":0, "reads":0}
+        self.reset()
+        gpio.attach(cs, listener=self.handle_select)
+        gpio.attach(rst, listener=self.handle_reset)
+        gpio.attach(drdy, source=self.handle_drdy)
+
+    def reset(self):
+        # Power-up values of the registers: STATUS (ID 3, buffer off), MUX (AIN0-AINCOM), ADCON, DRATE (30000 SPS)
+        self._registers = [0x30, 0x01, 0x20, 0xF0, 0xE0, 0, 0, 0, 0, 0, 0]
+        self._selected  = False
+        self._command   = []            # bytes of the command in progress
+        self._output    = []            # bytes waiting to be read
+        self._data      = 0             # data register, result of the latest completed conversion
+        self._fresh     = False         # the data register has not been read yet (DRDY low)
+        self._pending   = None          # conversion in progress: (completion time, MUX register)
+        self.start_conversion()
+
+    def set_value(self,channel,value):
+        # Input voltage of the channel, or a function of elapsed time (in seconds)
+        self._values[channel] = value
+
+    def get_voltage(self,channel):
+        # Input voltage of AIN0-AIN7, 8 is AINCOM (ground)
+        if channel >= 8: return 0
+        value = self._values.get(channel, 0)
+        return value(time.monotonic() - self._start) if callable(value) else value
+
+    def handle_select(self,pin,value):
+        self._selected = (value == self._gpio.LOW)
+        if self._selected: self._command = []
+
+    def handle_reset(self,pin,value):
+        if value == self._gpio.LOW: self.reset()
+
+    def handle_drdy(self):
+        # DRDY is low while a new conversion result is waiting to be read
+        self.update()
+        return self._gpio.LOW if self._fresh else self._gpio.HIGH
+
+    def update(self):
+        # Move the result of the conversion into the data register once its time has passed
+        if self._pending and time.monotonic() >= self._pending[0]:
+            self._data = self.convert(self._pending[1])
+            self._pending = None
+            self._fresh = True
+
+    def start_conversion(self):
+        # The MUX is taken at the start, so the data register keeps the previous channel until the conversion ends
+        # Settling time of the first conversion after SYNC/WAKEUP, about one data period plus the filter delay
+        self.update()
+        sps = DRATE_SPS.get(self._registers[3], 30000)
+        ready = time.monotonic() + (1/sps + 0.00018 if self._realtime else 0)
+        self._pending = (ready, self._registers[1])
+        self._fresh = False
+        self._gpio.schedule(self._drdy_pin, self._gpio.FALLING, ready)
+
+    def convert(self,mux):
+        # 24-bit result of the channels selected by MUX (positive, negative input), vref is the full-scale voltage
+        self._stats["conversions"] += 1
+        gain = 1 << (self._registers[2] & 0x07)
+        voltage = self.get_voltage(mux >> 4) - self.get_voltage(mux & 0x0F)
+        code = int(round(voltage * gain / self._vref * 0x7FFFFF))
+        return max(-0x800000, min(0x7FFFFF, code)) & 0xFFFFFF
+
+    def write(self,data):
+        if not self._selected: return
+        for byte in data:
+            self._command.append(byte)
+            self.handle_command()
+
+    def handle_command(self):
+        command = self._command
+        op = command[0]
+        if op & 0xF0 == 0x50:       # WREG
+            if len(command) >= 2 and len(command) == 3 + command[1]:
+                reg = op & 0x0F
+                for i, value in enumerate(command[2:]):
+                    if reg + i < len(self._registers): self._registers[reg + i] = value
+                self._command = []
+            return
+        if op & 0xF0 == 0x10:       # RREG
+            if len(command) == 2:
+                reg = op & 0x0F
+                self._output = [self._registers[r] if r < len(self._registers) else 0 for r in range(reg, reg + command[1] + 1)]
+                self._command = []
+            return
+        if op == 0x01:              # RDATA
+            self.update()
+            self._output = [(self._data >> 16) & 0xFF, (self._data >> 8) & 0xFF, self._data & 0xFF]
+            self._fresh = False     # DRDY goes high until the next conversion
+            self._stats["reads"] += 1
+        elif op == 0x00 or op == 0xFF:  # WAKEUP
+            self.start_conversion()
+        elif op == 0xFE:            # RESET
+            self.reset()
+        elif op in (0xF0, 0xF1, 0xF2, 0xF3, 0xF4):  # calibration, takes one conversion
+            self.start_conversion()
+        self._command = []          # SYNC, STANDBY, RDATAC, and SDATAC only change the timing
+
+    def read(self,count):
+        if not self._selected: return [0]*count
+        data, self._output = self._output[:count], self._output[count:]
+        return data + [0]*(count - len(data))
+
+class dac8532:
+    # DAC8532 model: 24-bit frame of control byte and 16-bit data
+    def __init__(self,gpio,cs=23,vref=5):
+        self._gpio      = gpio
+        self._vref      = vref
+        self._selected  = False
+        self._frame     = []
+        self.code       = {0:0, 1:0}    # latest code of channel A (0) and B (1)
+        gpio.attach(cs, listener=self.handle_select)
+
+    def handle_select(self,pin,value):
+        self._selected = (value == self._gpio.LOW)
+        self._frame = []
+
+    def get_voltage(self,channel):
+        return self.code[channel] / 0xFFFF * self._vref
+
+    def write(self,data):
+        if not self._selected: return
+        self._frame.extend(data)
+        while len(self._frame) >= 3:
+            control, high, low = self._frame[:3]
+            self._frame = self._frame[3:]
+            self.code[(control >> 2) & 0x01] = ((high << 8) | low) & 0xFFFF
+
+    def read(self,count):
+        return [0]*count
+
+class spi_device:
+    # Stand-in of spidev.SpiDev, the bytes go to the simulated devices whose chip select is low
+    def __init__(self,backend,bus=0,device=0):
+        self._backend       = backend
+        self.max_speed_hz   = 500000
+        self.mode           = 0
+
+    def handle_timing(self,count):
+        # Transmission time of the bytes on the SPI clock
+        if self._backend._realtime and self.max_speed_hz: time.sleep(8*count / self.max_speed_hz)
+
+    def writebytes(self,data):
+        data = list(data)
+        self.handle_timing(len(data))
+        for device in self._backend._devices: device.write(data)
+
+    def readbytes(self,count):
+        self.handle_timing(count)
+        result = [0]*count
+        for device in self._backend._devices:
+            if device._selected: result = device.read(count)
+        return result
+
+    def xfer2(self,data):
+        self.writebytes(data)
+        return [0]*len(data)
+
+    def close(self):
+        pass
+
+class backend:
+    # Simulated ADDA board (ADS1256 and DAC8532 on the same SPI bus), pass it as the backend of the libraries
+    def __init__(self,values=None,vref=5,realtime=True,adc_pins=(22,17,18),dac_pin=23):
+        self._realtime  = realtime      # False: no SPI transfer or conversion time (as fast as possible)
+        self.GPIO       = gpio()
+        self.adc        = ads1256(self.GPIO, *adc_pins, values=values, vref=vref, realtime=realtime)
+        self.dac        = dac8532(self.GPIO, dac_pin, vref=vref)
+        self._devices   = [self.adc, self.dac]
+
+    def SpiDev(self,bus=0,device=0):
+        return spi_device(self, bus, device)
+
+### END OF FILE ###
@@ -0,0 +1,84 @@
+"""
+#title           :recorder.py
+#description     :CANbus frame recorder and replayer for testing and benchmarking without the CANbus devices
+#author          :Nicholas Putra Rihandoko
+#date            :2024/03/11
+#version         :1.0
+#usage           :Energy Monitoring System, testing and benchmarking without CANbus devices
+#notes           :the log format follows the file extension: .blf (binary), .log (candump -l), .asc, .csv
+#python_version  :3.9.2
+#==============================================================================
+"""
+import time
+import threading
+import can
+
+class recorder:
+    def __init__(self,client,filename):
+        self._client    = client
+        self._filename  = filename
+        self._writer    = None
+        self._notifier  = None
+        self.count      = 0
+
+    def start(self):
+        # Write every received message with its timestamp in a background thread (can.Notifier)
+        self._writer = can.Logger(self._filename)
+        self._notifier = can.Notifier(self._client, [self._writer, self.handle_count])
+
+    def handle_count(self,message):
+        self.count += 1
+
+    def stop(self):
+        if self._notifier is not None: self._notifier.stop()
+        if self._writer is not None: self._writer.stop()
+        self._notifier, self._writer = None, None
+
+class replayer:
+    def __init__(self,filename,channel='vcan0',speed=1,repeat=False,bustype='socketcan'):
+        self._filename  = filename
+        self._speed     = speed         # 1 = recorded timing, 2 = twice as fast, 0 = as fast as possible
+        self._repeat    = repeat        # start over at the end of the log
+        self._stop      = threading.Event()
+        self._thread    = None
+        # Other processes (e.g. main__canbus.py) receive the messages on a SocketCAN interface (vcan0) or a
+        # 'udp_multicast' group, a 'virtual' bus only reaches the buses of the same process (replay.py benchmark --bus)
+        self._client    = can.interface.Bus(bustype=bustype, channel=channel)
+        self.count      = 0
+
+    def read_log(self):
+        # Recorded messages, with the timestamp relative to the first message (in seconds)
+        start = None
+        for message in can.LogReader(self._filename):
+            if start is None: start = message.timestamp
+            yield message.timestamp - start, message
+
+    def run(self):
+        while not self._stop.is_set():
+            begin = time.monotonic()
+            for stamp, message in self.read_log():
+                if self._stop.is_set(): break
+                if self._speed > 0:
+                    wait = begin + stamp/self._speed - time.monotonic()
+                    if wait > 0 and self._stop.wait(wait): break
+                # The receiver gets a fresh timestamp, as if the message is sent now
+                self._client.send(can.Message(arbitration_id=message.arbitration_id, data=message.data,
+                                              is_extended_id=message.is_extended_id))
+                self.count += 1
+            if not self._repeat: break
+
+    def start(self):
+        # Replay the log in a background thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def join(self,timeout=None):
+        if self._thread is not None: self._thread.join(timeout)
+
+    def stop(self):
+        self._stop.set()
+        self.join()
+        self._client.shutdown()
+
+### END OF FILE ###
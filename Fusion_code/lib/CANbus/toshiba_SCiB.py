@@ -10,13 +10,21 @@
 #==============================================================================
 """
 import time
+import threading
 import can
+from . import dbc as can_db
 
 class node:
-    def __init__(self,name,client,timeout=1):
+    def __init__(self,name,client,timeout=1,filtering=True,max_age=5,dbc=None):
         self._name      = name
         self._client    = client
         self._timeout   = timeout       # maximum time to wait for CANbus message (in seconds)
+        self._filtering = filtering     # let the kernel (SocketCAN) drop messages that are not requested
+        self._filter_id = None          # arbitration IDs of the installed filter
+        self._max_age   = max_age       # maximum age of a cached signal before it is considered stale (in seconds)
+        self._notifier  = None          # background listener, see start_listener()
+        self._latest    = {}            # latest decoded value of each signal, {name: (value, timestamp)}
+        self._lock      = threading.Lock()
         # Library of CANbus Arbitration ID
         self._can_id = {
             "Power_On_Time_1"   :{"id":0x050, "start":1, "end":4, "scale":0.1, "bias":0, "round":1}, # in seconds
@@ -64,6 +72,16 @@ class node:
             "Module_Voltage_1"  :{"id":0x056, "start":3, "end":4, "scale":4.8832/1000, "bias":0, "round":2}, # in Volts
             "Module_Voltage_2"  :{"id":0x076, "start":3, "end":4, "scale":4.8832/1000, "bias":0, "round":2} # in Volts
             }
+        # The library can also be read from a DBC file (e.g. 'lib/CANbus/toshiba_SCiB.dbc'), which allows
+        # bit-level, signed, little-endian (Intel) and multiplexed signals
+        if dbc: self._can_id = can_db.load_dbc(dbc)
+        # Index of the precompiled signal decoders by arbitration ID, and by lowercase name: (arbitration ID, decoder)
+        self._id_index = {}
+        self._key_index = {}
+        for key, value in self._can_id.items():
+            decoder = self.compile_decoder(key, value)
+            self._id_index.setdefault(value["id"], []).append(decoder)
+            self._key_index[key.lower()] = (value["id"], decoder)
 
     def reset_rec_attr(self):
         # Reset (and/or initiate) object's attributes
@@ -81,66 +99,138 @@ class node:
                     break
         return mapped_addr
 
-    def save_read(self,message,address,save):
-        # Save responses to object's attributes
-        index_to_remove = []
-        for s, a in enumerate(address):
-            if a == message.arbitration_id:
-                if save[s].startswith('Hx'):
-                    val=message.data
-                else:
-                    # Converting HEX Data from CANbus into decimal
-                    sorted_data, raw_data, i, n = [], 0x0, 0, (self._can_id[save[s]]["end"] - self._can_id[save[s]]["start"])
-                    for b in range(self._can_id[save[s]]["start"],self._can_id[save[s]]["end"]+1):
-                        sorted_data[i] = (message.data[b] << 8*n); i+=1; n-=1
-                    for x in sorted_data: raw_data = raw_data | x
-                    val = round((raw_data - self._can_id[save[s]]["bias"]) * self._can_id[save[s]]["scale"], self._can_id[save[s]]["round"])
-                setattr(self, save[s], val)
-                index_to_remove.append(s)
-        
-        # Remove read address (id) that has been read
-        for r in reversed(index_to_remove): address.pop(r); save.pop(r)
-        return address, save
+    def compile_bits(self,value):
+        # Locate the signal in the frame, read as an integer: (byte order, shift, mask, sign bit, frame size)
+        if "bit" not in value:
+            # Byte range of the _can_id library, the bytes are in big-endian order
+            return (0, (7-value["end"])*8, (1 << 8*(value["end"]-value["start"]+1)) - 1, 0, 8)
+        length = value["length"]
+        sign = 1 << (length-1) if value["signed"] else 0
+        if value["order"] == 'little': return (1, value["bit"], (1 << length) - 1, sign, value["size"])
+        # The start bit of a big-endian (Motorola) signal is its most significant bit
+        msb = (value["size"]-1-value["bit"]//8)*8 + value["bit"]%8
+        return (0, msb-length+1, (1 << length) - 1, sign, value["size"])
+
+    def compile_decoder(self,key,value):
+        # Precompile the signal decoder: (attribute name, start byte, bits, scale, bias, round, multiplexer)
+        mux = None
+        if value.get("mux") in self._can_id:
+            order, shift, mask = self.compile_bits(self._can_id[value["mux"]])[:3]
+            mux = (order, shift, mask, value["mux_value"])
+        return (key, value["start"], self.compile_bits(value), value["scale"], value["bias"], value["round"], mux)
+
+    def decode(self,message,decoders):
+        # Decode the signals of the message, the frame is converted into an integer only once
+        data = bytes(message.data)
+        frame = None
+        result = []
+        for key, byte, bits, scale, bias, rnd, mux in decoders:
+            if byte is None:
+                result.append((key, data)); continue
+            if frame is None:
+                padded = data[:bits[4]].ljust(bits[4], b'\0')
+                frame = (int.from_bytes(padded, 'big'), int.from_bytes(padded, 'little'))
+            # Multiplexed signals are only present with their multiplexer value
+            if mux and (frame[mux[0]] >> mux[1]) & mux[2] != mux[3]: continue
+            order, shift, mask, sign = bits[:4]
+            raw = (frame[order] >> shift) & mask
+            if raw & sign: raw -= sign << 1
+            result.append((key, round((raw - bias) * scale, rnd)))
+        return result
+
+    def save_read(self,message,decoders):
+        # Decode every requested signal of the message in one pass and save it to object's attributes
+        for key, value in self.decode(message, decoders): setattr(self, key, value)
 
     def count_address(self,raw_address):
-        # Configure the message id (addr) and the attribute name where the value is saved (save)
-        addr, save, raw = [], [], [True]*len(raw_address)
+        # Group the requested signals by message id, {arbitration ID: [decoder, ...]}
+        request = {}
+        for a in raw_address:
+            if isinstance(a,list):
+                decoders = [d for d in self._id_index.get(a[0], []) if d[1] == a[1]]
+                arb_id = a[0]
+            elif isinstance(a,str):
+                arb_id, decoder = self._key_index.get(a, (None, None))
+                decoders = [decoder] if decoder else []
+            else:
+                decoders = self._id_index.get(a, [])
+                arb_id = a
+                # If the address is not available in the library, then use it as is
+                if not decoders:
+                    decoders = [('Hx'+hex(a)[2:].zfill(3).upper(), None, None, 1, 0, 0, None)]
+                    print(" -- address '{}' may gives raw data, use with discretion --".format(decoders[0][0]))
+            if not decoders:
+                print(" -- unrecognized arbitration ID for '{}' --".format(a)); continue
+            saved = request.setdefault(arb_id, [])
+            for d in decoders:
+                if d[0] not in [s[0] for s in saved]: saved.append(d)
+        return request
 
-        # Match the address with the information in self._can_id library
-        for key, value in self._can_id.items():
-            for i, a in enumerate(raw_address):
-                if isinstance(a,list):
-                    if (a[0] == value["id"] and a[1] == value["start"]) and key not in save:
-                        addr.append(value["id"]); save.append(key)
-                        raw[i] = False; break
-                else:
-                    if (a == key.lower() or a == value["id"]) and key not in save:
-                        addr.append(value["id"]); save.append(key)
-                        raw[i] = False; break
-
-        # If the address is not available in the library, then use it as is
-        for i, r in enumerate(raw):
-            if r and (raw_address[i] not in addr) and (raw_address[i] not in [s.lower() for s in save]):
-                if isinstance((raw_address[i]),str):
-                    print(" -- unrecognized arbitration ID for '{}' --".format(raw_address[i]))
-                else:
-                    addr.append(raw_address[i]); save.append('Hx'+hex(raw_address[i])[2:].zfill(3).upper())
-                    print(" -- address '{}' may gives raw data, use with discretion --".format(save[-1]))
-        addr, save = zip(*sorted(zip(addr, save)))
-        return list(addr), list(save)
+    def handle_filter(self,arb_id):
+        # Install CAN filters for the requested arbitration IDs, only when the requested IDs change
+        arb_id = frozenset(arb_id)
+        if not self._filtering or arb_id == self._filter_id: return
+        can_filters = [{"can_id":a, "can_mask":0x1FFFFFFF if a > 0x7FF else 0x7FF, "extended":a > 0x7FF} for a in sorted(arb_id)]
+        try:
+            self._client.set_filters(can_filters)
+            self._filter_id = arb_id
+        except Exception as e:
+            # Keep receiving every message (filtered in python) if the interface does not support filters
+            print(" -- CAN filter is not installed: {} --".format(e))
+            self._filtering = False
+
+    def start_listener(self):
+        # Decode every broadcast message continuously in a background thread (can.Notifier)
+        if self._notifier is not None: return
+        self.handle_filter(self._id_index.keys())
+        self._notifier = can.Notifier(self._client, [self.handle_message], timeout=self._timeout)
+
+    def stop_listener(self):
+        if self._notifier is None: return
+        self._notifier.stop()
+        self._notifier = None
+
+    def handle_message(self,message):
+        # Save the decoded signals of the message into the latest-value table, called by the listener thread
+        decoders = self._id_index.get(message.arbitration_id)
+        if decoders is None: decoders = [('Hx'+hex(message.arbitration_id)[2:].zfill(3).upper(), None, None, 1, 0, 0, None)]
+        result = self.decode(message, decoders)
+        with self._lock:
+            for key, value in result: self._latest[key] = (value, message.timestamp)
+
+    def get_snapshot(self):
+        # Copy of the latest-value table, {name: (value, timestamp)}
+        with self._lock: return dict(self._latest)
+
+    def snapshot_sequence(self,address):
+        # Read the requested signals from the latest-value table instead of waiting for the messages
+        request = self.count_address(address)
+        # The listener receives the library IDs, add any other requested ID to the filter
+        self.handle_filter(set(self._id_index) | set(request))
+        now = time.time()
+        stale = []
+        with self._lock:
+            for decoders in request.values():
+                for d in decoders:
+                    value = self._latest.get(d[0])
+                    if value is None or now - value[1] > self._max_age: stale.append(d[0])
+                    if value is not None: setattr(self, d[0], value[0])
+        if stale: print("-- no recent message for {} --".format(", ".join(stale)))
+        else: print("-- read completed --")
 
     def receive_sequence(self,address):
-        addr, save = self.count_address(address)
-        # read messages in CANbus port
-        while True:
-            if addr:
-                message = self._client.recv(self._timeout)
-                if message:
-                    # Decode message if it is in the read address list until all is read
-                    if message.arbitration_id in addr:
-                        addr, save = self.save_read(message,addr,save)
-                else: print("-- failed to detect bus activity --"); break
-            else: print("-- read completed --"); break
+        request = self.count_address(address)
+        self.handle_filter(request.keys())
+        deadline = time.monotonic() + self._timeout
+        # read messages in CANbus port until every requested arbitration ID is read
+        while request:
+            remaining = deadline - time.monotonic()
+            message = self._client.recv(remaining) if remaining > 0 else None
+            if message is None: print("-- failed to detect bus activity --"); break
+            # Decode message if it is in the read address list
+            decoders = request.pop(message.arbitration_id, None)
+            if decoders: self.save_read(message, decoders)
+        else: print("-- read completed --")
 
     def dump_sequence(self,param):
         pass
@@ -155,7 +245,8 @@ class node:
         # Send the command and read response with function_code 0x03 (3)
         if command == "receive":
             address = [a.lower() if isinstance(a,str) else a for a in address]
-            self.receive_sequence(address)
+            if self._notifier is not None: self.snapshot_sequence(address)
+            else: self.receive_sequence(address)
             #print("-- read is a success --")
         elif command == "dump":
             self.dump_sequence(param)
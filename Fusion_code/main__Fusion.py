@@ -17,35 +17,122 @@ import os
 import socket
 import threading
 import logging
-from queue import Queue
+import atexit
+from queue import Queue, Full, Empty
 import query
+import metrics
+import ipc
+import snapshot
+import hub
+import deadband
+try:
+    import mqtt_sink
+except ImportError:
+    mqtt_sink = None  # paho-mqtt is not installed, the MQTT uplink is not available
 # modbus libraries
-from pymodbus.client import ModbusSerialClient as ModbusClient
+try:
+    from pymodbus.client import ModbusSerialClient as ModbusClient
+except ImportError:
+    ModbusClient = None  # pymodbus is not installed, only the simulated Modbus slaves can be used (MOD_SIMULATE)
 from lib.MODbus import kyuden_battery_72kWh as battery
 from lib.MODbus import yaskawa_D1000 as converter
 from lib.MODbus import yaskawa_GA500 as inverter
 from lib.MODbus import tristar_MPPT as charger
+from lib.MODbus import simulator
 #from lib.MODbus import omron_KMN1FLK as kmn1
 #from lib.MODbus import omron_KM50C1FLK as km50c1
 #from lib.MODbus import msystem_M5XWTU113 as msystem
 
 # canbus libraries
-import can # code packet for CANbus communication
+try:
+    import can # code packet for CANbus communication
+except ImportError:
+    can = None  # python-can is not installed, the CANbus nodes are not available
 #from lib.CANbus import toshiba_SCiB as toshiba
 
 # ADDA libraries
-import RPi.GPIO as GPIO
-#from lib.ADDA import ADS1256
-#from lib.ADDA import DAC8532
+from lib.ADDA import ADS1256
+from lib.ADDA import DAC8532
+from lib.ADDA import simulator as ADDA_simulator
+from lib.ADDA import ring_buffer
+from lib.ADDA import calibration
 
 # Logging and debugging setup
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+REPORT = {"MODE":'print', "EVERY":1, "FILE":None}
+"""
+MODE    : 'off', 'print', or 'json' # report of the measurements in every loop
+            'off'   = no report of the measurements (logging still works)
+            'print' = print every attribute of every node (query.print_response)
+            'json'  = one JSON line per report, written by a background thread
+EVERY   : # report once every N loops (sampling)
+FILE    : None or path # JSON lines file, None writes to standard output
+"""
 #query.debugging()  # Monitor Modbus communication for debugging
 
 # Socket communication parameters
+SOCKET = {"ENABLE":False, "QUEUE":100}
+"""
+ENABLE  : True or False # send every row to main__display.py through the AF_UNIX socket (socket_client_thread)
+QUEUE   : # rows waiting for the socket, the oldest row is dropped when the display does not keep up
+"""
 UNIX_SOCKET_PATH = '/tmp/ipc_socket'   #AF_UNIX
 INET_SOCKET_PATH = ('127.0.0.1', 9000) #AF_INET
-QUEUE = Queue()
+QUEUE = Queue(maxsize=SOCKET["QUEUE"])
+
+# Shared-memory snapshot parameters (latest row for any number of local readers, see snapshot.py)
+SNAPSHOT = {"ENABLE":True, "NAME":'nepower_snapshot', "SIZE":65536}
+"""
+ENABLE  : True or False # publish every row into /dev/shm/<NAME>, the loop never waits for the readers
+NAME    : # name of the shared memory, given to snapshot.reader() by the readers (e.g. main__display.py)
+SIZE    : # size of the shared memory (in bytes), must hold the schema (title) and one row
+            a row that does not fit is dropped and counted (fusion_snapshot_dropped_total), the loop goes on
+"""
+
+# Publish/subscribe hub parameters (live rows for many local or remote subscribers, see hub.py)
+HUB = {"ENABLE":True, "PATH":'/tmp/nepower_hub', "TCP":None, "QUEUE":50}
+"""
+ENABLE  : True or False # run the hub in a background thread, subscribers never slow down the loop
+PATH    : # AF_UNIX socket of the hub, for subscribers (e.g. main__display.py) and other producers
+TCP     : None or (host, port) # also listen on TCP, e.g. ('0.0.0.0', 9001) for remote dashboards
+QUEUE   : # rows waiting for each subscriber, the oldest row is dropped when a subscriber does not keep up
+"""
+
+# MQTT uplink parameters (see mqtt_sink.py)
+MQTT = {"ENABLE":False, "HOST":'127.0.0.1', "PORT":1883, "USER":None, "PASSWORD":None,
+        "TOPIC":'nepower/NEPOWER_3', "CLIENT_ID":'nepower-NEPOWER_3', "QOS":1, "BATCH":10, "LIMIT":100000}
+"""
+ENABLE  : True or False # publish the rows to an MQTT broker, next to the MySQL/FTP upload
+HOST    : # broker address, e.g. a local Mosquitto bridged to the cloud, or the cloud broker itself
+TOPIC   : # <TOPIC>/schema (retained title) and <TOPIC>/data (rows)
+CLIENT_ID : # fixed, the broker keeps the session (and unacknowledged messages) of this client
+QOS     : 0 or 1 # 1 = a message leaves the on-disk queue only after the broker acknowledges it
+BATCH   : # rows per MQTT message
+LIMIT   : # messages kept in the on-disk queue during an outage, beyond this the oldest are dropped
+            (except the schemas and the messages waiting for their PUBACK)
+"""
+
+# Report-by-exception parameters of the uplinks (MySQL and MQTT, see deadband.py)
+DEADBAND = {"ENABLE":False, "DEFAULT":0, "SILENCE":300,
+            "CHANNELS":{"cpu_Temp":(2, None), "bat_Temp":(0.5, 900), "bat_soc":(1, 900),
+                        "bat_ttl_V":(0.5, None), "bat_avg_V":(0.01, None), "*_kWh":(0.1, None)}}
+"""
+ENABLE  : True or False # only send a row to the uplinks when a channel changed significantly, or as a heartbeat
+DEFAULT : None or # deadband of the channels that are not in CHANNELS, 0 = any change, None = never compared
+SILENCE : None or # heartbeat, a row is sent after this long (in seconds) without a significant change
+CHANNELS: {name or pattern: (deadband, silence)} # e.g. "ADC1_mean_*":(0.05, 600), silence None = SILENCE
+            the shortest silence of the row is used, the text values (e.g. the time) are never compared
+FILENAME_LOCAL keeps one row every DB_INTERVAL in the 'save' folder, whether the deadband sends it or not,
+            the file is only written when ENABLE is True
+"""
+
+# Instrumentation parameters (Prometheus-style text endpoint)
+METRICS = {"ENABLE":True, "HOST":'127.0.0.1', "PORT":9100}
+"""
+ENABLE  : True or False # serve cycle/stage timing, per-device latency, timeout counts, upload backlog and lag
+HOST    : '127.0.0.1' # only reachable from the gateway itself, use '0.0.0.0' to expose it on the network
+PORT    : # read the metrics with 'curl http://127.0.0.1:9100/metrics'
+"""
 
 # Data collecting parameters
 INTERVAL     = 0   # the period between each subsequent communication routine/loop (in seconds)
@@ -55,6 +142,7 @@ DB_TIMEOUT   = 3 # the maximum time this device will wait for completing MySQl q
 DB_INTERVAL  = 5 # the period between each subsequent update to database (in seconds)
 FILENAME_REALTIME   = 'data_realtime_log.csv'
 FILENAME_RECAP      = 'data_recap_log.csv'
+FILENAME_LOCAL      = 'data_local_log.csv'    # one file per day, the rows filtered out of the upload by DEADBAND are kept too
 
     # Database by SQL
 """
@@ -96,7 +184,7 @@ FTP_SERVER_RECAP    = {"host":"******",
 # Define Modbus communication parameters
 MOD_PORT0            = '/dev/ttyAMA0'    # for RS485/CAN Hat
 MOD_PORT_ID1        = 'Prolific_Technology_Inc' # for USB-to-RS232C adaptor
-MOD_PORT1           = os.popen('sudo bash {}/get_usb.bash {}'.format(os.path.dirname(os.path.abspath(__file__)), MOD_PORT_ID1)).read().strip()
+MOD_PORT1           = None  # found by get_usb_port() when main() starts
 MOD = {"METHOD":'rtu', "BYTESIZE":8, "STOPBITS":1, "PARITY":'N', "BAUDRATE":9600, "LATENCY":100, "TIMEOUT":1}
 #MOD = {"METHOD":'rtu', "BYTESIZE":8, "STOPBITS":1, "PARITY":'E', "BAUDRATE":9600, "LATENCY":100, "TIMEOUT":1}
 """
@@ -108,28 +196,56 @@ BAUDRATE: multiplication of 9600 # data/byte transmission speed (in bytes per se
 LATENCY : # the delay time master/client takes from receiving response to sending a new command/request (in milliseconds)
 TIMEOUT : # the maximum time the master/client will wait for response from slave/server (in seconds)
 """
+MOD_SIMULATE = False # True: replace the serial ports with simulated Modbus slaves (testing and benchmarking without devices)
 
 # Define Canbus communication parameters
-CAN = {"BUSTYPE":'socketcan', "CHANNEL":'can0', "BITRATE":250000, "RESTART":100, "TIMEOUT":2}
+CAN = {"BUSTYPE":'socketcan', "CHANNEL":'can0', "BITRATE":250000, "RESTART":100, "TIMEOUT":2, "LISTEN":True, "DBC":None}
 """
 BUSTYPE : 'socketcan' # CANbus interface for Waveshare RS485/CAN Hat module
 CHANNEL : 'can0' # location of channel used for CANbus Communication
 BITRATE : 250000 # Toshiba SCiB speed of CANbus = 250000
 RESTART : # the time it takes to restart CANbus communication if it fails (in milisecond)
 TIMEOUT : # the maximum time the master/client will wait for response from slave/server (in seconds)
+LISTEN  : True # decode broadcast messages continuously in the background, a read only takes the latest values
+DBC     : None # signal definitions of the node library, or a DBC file (e.g. 'lib/CANbus/toshiba_SCiB.dbc')
 """
 
 # Define ADDA parameters
-ADDA = {"VREF_AD":5, "VREF_DA":5, "DMAX_AD":0x7fffff, "DMAX_DA":0xffff}
+ADDA = {"VREF_AD":5, "VREF_DA":5, "DMAX_AD":0x7fffff, "DMAX_DA":0xffff, "SPI_HZ":1000000, "ACQUIRE":True, "BUFFER":30000,
+        "CALIBRATION":'calibration.json'}
 """
 VREF_AD : #either 3.3 or 5
+SPI_HZ  : # SPI clock of the ADC (in Hz), up to 1920000 for ADS1256 with 7.68 MHz clock
+ACQUIRE : True # keep the ADC converting in the background (DRDY interrupt) instead of reading each channel on request
+BUFFER  : # number of complete scans (of all channels) kept by the continuous acquisition
+CALIBRATION : # JSON file with the limit [raw_min, raw_max, eng_min, eng_max] and rounding of each channel, by module name
+              without the file, every channel uses the full range of the IC (copy and edit calibration.example.json)
+
+Limit for current output signal
+1. Check resistor value for the converting current to voltage
+2. current sensor oftenly have range (4-20mA), find the min and max voltage value of output
+3. after find the min and max voltage value, find the min and max digital value of output
+4. do remapping from digital value range to actual unit from data sensor
+example: pressure sensor 0-1 MPa has 4-20mA output & use 220 ohm resistor
+voltage output range: (0.88-4.4 V) & voltage input ADC: (0-5 V)
+digital output range: (0x16872B-0x70A3D6) & digital input ADC: (0x000000-0x7FFFFF)
+the limit will be [0x16872B,0x70A3D6,0,1]
 """
+CALIBRATION = {} # calibration of each ADDA module, loaded in setup_ADDA()
+ADDA_SIMULATE = False # True: use a simulated ADDA board (SPI, GPIO, and DRDY timing) instead of the device
+
+def get_usb_port(port_id):
+    # Device path (e.g. /dev/ttyUSB0) of the USB adaptor with this ID
+    return os.popen('sudo bash {}/get_usb.bash {}'.format(os.path.dirname(os.path.abspath(__file__)), port_id)).read().strip()
 
 def setup_modbus():
-    global MOD, MOD_PORT0, MOD_PORT1
+    global MOD, MOD_PORT0, MOD_PORT1, MOD_SIMULATE
     # Set each Modbus communication port specification
-    client0 = ModbusClient(port=MOD_PORT0, method=MOD["METHOD"], stopbits=MOD["STOPBITS"], bytesize=MOD["BYTESIZE"], parity=MOD["PARITY"], baudrate=MOD["BAUDRATE"], timeout=MOD["TIMEOUT"])
-    client1 = ModbusClient(port=MOD_PORT1, method=MOD["METHOD"], stopbits=MOD["STOPBITS"], bytesize=MOD["BYTESIZE"], parity=MOD["PARITY"], baudrate=MOD["BAUDRATE"], timeout=MOD["TIMEOUT"])
+    if not MOD_SIMULATE and ModbusClient is None:
+        raise ImportError("pymodbus is not installed (sudo apt install python3-pymodbus)")
+    Client = simulator.client if MOD_SIMULATE else ModbusClient
+    client0 = Client(port=MOD_PORT0, method=MOD["METHOD"], stopbits=MOD["STOPBITS"], bytesize=MOD["BYTESIZE"], parity=MOD["PARITY"], baudrate=MOD["BAUDRATE"], timeout=MOD["TIMEOUT"])
+    client1 = Client(port=MOD_PORT1, method=MOD["METHOD"], stopbits=MOD["STOPBITS"], bytesize=MOD["BYTESIZE"], parity=MOD["PARITY"], baudrate=MOD["BAUDRATE"], timeout=MOD["TIMEOUT"])
     # Connect to the Modbus serial
     client0.connect()
     client1.connect()
@@ -141,6 +257,9 @@ def setup_modbus():
     inv  = inverter.node(slave=3, name='INVERTER', client=client0, delay=MOD["STOPBITS"], max_count=20, increment=1, shift=0)
     crg  = charger.node(slave=4, name='SOLAR CHARGER', client=client0, delay=MOD["STOPBITS"])
     server = [conv, bat, inv, crg]
+    if MOD_SIMULATE:
+        # Serve each node's register map from a simulated slave on its port
+        for node in server: node._client.add_device(node)
     
     
     """
@@ -176,13 +295,11 @@ def read_modbus(server):
     
     for i in range(len(server)):
         try:
-            server[i].send_command(command="read",address=addr[i])
+            with metrics.timer("fusion_device_read_seconds", bus="modbus", device=server[i]._name):
+                server[i].send_command(command="read",address=addr[i])
         except Exception as e:
             # Print the error message
-            print("(modbus) problem with",server[i]._name,":")
-            print(e)
-            print("<===== ===== continuing ===== =====>")
-            print("")
+            logging.error("(modbus) problem with %s: %s", server[i]._name, e)
             
 def write_modbus(server): #,data):
     #return
@@ -191,10 +308,7 @@ def write_modbus(server): #,data):
             pass
         except Exception as e:
             # Print the error message
-            print("(modbus) problem with",server[i]._name,":")
-            print(e)
-            print("<===== ===== continuing ===== =====>")
-            print("")
+            logging.error("(modbus) problem with %s: %s", server[i]._name, e)
 
 def setup_canbus():
     global CAN
@@ -207,7 +321,8 @@ def setup_canbus():
     #client = can.interface.Bus(bustype=CAN["BUSTYPE"], channel=CAN["CHANNEL"], bitrate=CAN["BITRATE"])
     # Define the Modbus slave/server (nodes) objects
     # CANBUS TOSHIBA
-    #bat = toshiba.node(name='TOSHIBA BATTERY', client=client, timeout=CAN["TIMEOUT"])
+    #bat = toshiba.node(name='TOSHIBA BATTERY', client=client, timeout=CAN["TIMEOUT"], dbc=CAN["DBC"])
+    #if CAN["LISTEN"]: bat.start_listener()
     #server = [bat]
     server = []
     return server
@@ -226,10 +341,7 @@ def read_canbus(server):
             server[i].send_command(command="receive",address=addr)
         except Exception as e:
             # Print the error message
-            print("(canbus) problem with",server[i]._name,":")
-            print(e)
-            print("<===== ===== continuing ===== =====>")
-            print("")
+            logging.error("(canbus) problem with %s: %s", server[i]._name, e)
             
 def write_canbus(server): #,data):
     #return
@@ -238,100 +350,92 @@ def write_canbus(server): #,data):
             pass
         except Exception as e:
             # Print the error message
-            print("(canbus) problem with",server[i]._name,":")
-            print(e)
-            print("<===== ===== continuing ===== =====>")
-            print("")
+            logging.error("(canbus) problem with %s: %s", server[i]._name, e)
 
 def setup_ADDA():
-    global ADDA
-    #ADC = ADS1256.ADS1256(name='ADC1',bus=0,device=1,rst=18,drdy=17,cs_adc=22) # rst, drdy, and cs_adc are pin number input
+    global ADDA, CALIBRATION, ADDA_SIMULATE
+    # Calibration of each channel, modules missing from the calibration file use the full range of the IC
+    default = {"ADC1": calibration.calibration([[0x000000,ADDA["DMAX_AD"],0,ADDA["VREF_AD"]]]*8, [4]*8),
+               "DAC1": calibration.calibration([[0,ADDA["VREF_DA"],0x0000,ADDA["DMAX_DA"]]]*2, [0]*2)}
+    CALIBRATION = calibration.load_calibration(os.path.join(os.path.dirname(os.path.abspath(__file__)), ADDA["CALIBRATION"]), default)
+    #ADC = ADS1256.ADS1256(name='ADC1',bus=0,device=1,rst=18,drdy=17,cs_adc=22,spi_speed=ADDA["SPI_HZ"]) # rst, drdy, and cs_adc are pin number input
+    #if ADDA["ACQUIRE"]: ADC.ADS1256_StartAcquisition(buffer=ADDA["BUFFER"])
     #DAC = DAC8532.DAC8532(name='DAC1',bus=0,device=1,cs_dac=23,A=0x30,B=0x34,DAC_MAX=ADDA["DMAX_DA"],DAC_VREF=ADDA["VREF_DA"]) # cs_dac is pin number input
     #server_AD = [ADC]
     #server_DA = [DAC]
     server_AD = []
     server_DA = []
+    if ADDA_SIMULATE:
+        # The simulated board behaves like the ADDA Hat, including the conversion time of the ADC
+        board = ADDA_simulator.backend(vref=ADDA["VREF_AD"])
+        ADC = ADS1256.ADS1256(name='ADC1',bus=0,device=1,rst=18,drdy=17,cs_adc=22,spi_speed=ADDA["SPI_HZ"],backend=board)
+        if ADDA["ACQUIRE"]: ADC.ADS1256_StartAcquisition(buffer=ADDA["BUFFER"])
+        DAC = DAC8532.DAC8532(name='DAC1',bus=0,device=1,cs_dac=23,A=0x30,B=0x34,DAC_MAX=ADDA["DMAX_DA"],DAC_VREF=ADDA["VREF_DA"],backend=board)
+        server_AD = [ADC]
+        server_DA = [DAC]
     return server_AD, server_DA
 
 def read_ADDA(server):
-    global ADDA
-    #limit = [[[0x000000,ADDA["DMAX_AD"],0,ADDA["VREF_AD"]],[0x000000,ADDA["DMAX_AD"],0,ADDA["VREF_AD"]],[0x000000,ADDA["DMAX_AD"],0,ADDA["VREF_AD"]],[0x000000,ADDA["DMAX_AD"],0,ADDA["VREF_AD"]],
-    #          [0x000000,ADDA["DMAX_AD"],0,ADDA["VREF_AD"]],[0x000000,ADDA["DMAX_AD"],0,ADDA["VREF_AD"]],[0x000000,ADDA["DMAX_AD"],0,ADDA["VREF_AD"]],[0x000000,ADDA["DMAX_AD"],0,ADDA["VREF_AD"]]]
-    #        ]
-    
-    # Limit for current output signal
-    # 1. Check resistor value for the converting current to voltage
-    # 2. current sensor oftenly have range (4-20mA), find the min and max voltage value of output
-    # 3. after find the min and max voltage value, find the min and max digital value of output
-    # 4. do remapping from digital value range to actual unit from data sensor
-    #example: pressure sensor 0-1 MPa has 4-20mA output & use 220 ohm resistor
-    # voltage output range: (0.88-4.4 V) & voltage input ADC: (0-5 V)
-    # digital output range: (0x16872B-0x70A3D6) & digital input ADC: (0x000000-0x7FFFFF)
-    # the limit will be [0x16872B,0x70A3D6,0,1]
-    
-    # [0~1 MPa, 0~40 L/min, reserved, reserved, reserved, -4710~4710 W, 0~750 rpm, -60~60 Nm]
-    """
-    limit = [[[0x16872B,0x70A3D6,0,1],[0x16872B,0x70A3D6,0,40],[0x000000,0x7FFFFF,0,ADDA["VREF_AD"]],
-              [0x000000,0x7FFFFF,0,ADDA["VREF_AD"]],[0x000000,0x7FFFFF,0,ADDA["VREF_AD"]],[0x000000,0x7FFFFF,-4658.0,4762.0],
-              [0x000000,0x7FFFFF,-4.725,745.275],[0x000000,0x7FFFFF,-59.335,60.665]]
-            ]
-    rounded = [[3,2,2,2,2,0,0,2]]
-    """
-    limit = [[[]]]
-    rounded = [[]]
-    
+    global ADDA, CALIBRATION
+    # The raw value of each channel is converted with the gain/offset of CALIBRATION (see calibration.example.json)
     for i in range(len(server)):
         try:
-            for j in range(0,8,1):
-                float_val = remap(server[i].ADS1256_GetChannalValue(j),limit[i][j][0],limit[i][j][1],limit[i][j][2],limit[i][j][3])
-                server[i].Value[j] = round_digits(float_val,rounded[i][j])
+            cal = CALIBRATION[server[i]._name]
+            if server[i]._acquiring:
+                # Every scan of the continuous acquisition since the previous cycle, calibrated as one block
+                stamp, raw = server[i].ADS1256_GetSamples()
+                if len(raw) == 0:
+                    # No scan since the previous cycle, the statistics of the previous cycle must not be reported again
+                    for attr in ("Mean", "Min", "Max", "RMS"): setattr(server[i], attr, [None]*len(server[i].Value))
+                    continue
+                stats = ring_buffer.aggregate(cal.apply(raw))
+                # Value keeps the last sample, the others are the statistics over the cycle
+                for attr, stat in (("Value","last"), ("Mean","mean"), ("Min","min"), ("Max","max"), ("RMS","rms")):
+                    setattr(server[i], attr, cal.round(stats[stat]).tolist())
+                continue
+            raw = [server[i].ADS1256_GetChannalValue(j) for j in range(0,8,1)]
+            server[i].Value = cal.round(cal.apply(raw)).tolist()
         except Exception as e:
             # Print the error message
-            print("(ADDA) problem with",server[i]._name,":")
-            print(e)
-            print("<===== ===== continuing ===== =====>")
-            print("")
+            logging.error("(ADDA) problem with %s: %s", server[i]._name, e)
             
 def write_ADDA(server): #,data):
     # return
-    global ADDA
-    #limit = [[[0,ADDA["VREF_DA"],0x0000,ADDA["DMAX_DA"]],[0,ADDA["VREF_DA"],0x0000,ADDA["DMAX_DA"]]]
-    #        ]
-    limit = [[[]]]
+    global ADDA, CALIBRATION
     for i in range(len(server)):
         try:
-            val_A = int(remap(server[i].Value[0],limit[i][0][0],limit[i][0][1],limit[i][0][2],limit[i][0][3]))
-            val_B = int(remap(server[i].Value[1],limit[i][1][0],limit[i][1][1],limit[i][0][2],limit[i][0][3]))
+            # Output value of channel A and B into DAC codes
+            val_A, val_B = CALIBRATION[server[i]._name].apply(server[i].Value[:2]).astype(int).tolist()
             server[i].DAC8532_Write_Data(server[i]._channel_A, val_A)
             server[i].DAC8532_Write_Data(server[i]._channel_B, val_B)
         except Exception as e:
             # Print the error message
-            print("(ADDA) problem with",server[i]._name,":")
-            print(e)
-            print("<===== ===== continuing ===== =====>")
-            print("")
+            logging.error("(ADDA) problem with %s: %s", server[i]._name, e)
 
-def remap(value, old_min, old_max, new_min, new_max):
-    # Map the value from the old range to the new range
-    return ((value - old_min) / (old_max - old_min)) * (new_max - new_min) + new_min
-
-def round_digits(value, ndigits):
-    """
-    Round a value to a specified number of decimal places and return as a string
-    with the specified number of decimals. Ensures that if the value is effectively
-    zero after rounding, it is set to positive 0.0, maintaining the decimal places.
-
-    :param value: Float value to round.
-    :param ndigits: Number of decimal places to round to.
-    :return: String representing the rounded value with specified decimal places.
-    """
-    # Round the value and adjust for zero
-    adjusted_value = round(value, ndigits)
-    if adjusted_value == 0:
-        adjusted_value = 0.0
-    # Format the number as a string with the specified number of decimal places
-    #adjusted_value = f"{adjusted_value:.{ndigits}f}"
-    return adjusted_value
+def update_metrics(server, timer, live=None, uplink=None, filters=(), shared=None):
+    # Export the counters kept by the node libraries and the status of the data upload
+    for node in server:
+        for stat, value in getattr(node, "_stats", {}).items():
+            metrics.counter("fusion_device_{}_total".format(stat), value, device=node._name)
+        if hasattr(node, "_health"):
+            metrics.gauge("fusion_device_online", int(node._health["state"] == "online"), device=node._name)
+    metrics.gauge("fusion_queue_size", QUEUE.qsize())
+    if shared is not None:
+        metrics.counter("fusion_snapshot_dropped_total", shared.stats["dropped"])
+    if live is not None:
+        metrics.gauge("fusion_hub_subscribers", live.stats["subscribers"])
+        metrics.counter("fusion_hub_dropped_total", live.stats["dropped"])
+        metrics.counter("fusion_hub_slow_disconnected_total", live.stats["slow_disconnected"])
+    if uplink is not None:
+        metrics.gauge("fusion_mqtt_backlog_messages", uplink.stats["backlog"])
+        metrics.counter("fusion_mqtt_sent_total", uplink.stats["sent"])
+        metrics.counter("fusion_mqtt_dropped_total", uplink.stats["dropped"])
+    for name, rows in filters:
+        metrics.counter("fusion_uplink_reported_total", rows.stats["reported"], uplink=name)
+        metrics.counter("fusion_uplink_suppressed_total", rows.stats["suppressed"], uplink=name)
+    metrics.gauge("fusion_upload_backlog_rows", query.upload_status["backlog"])
+    if query.upload_status["last_success"]:
+        metrics.gauge("fusion_upload_lag_seconds", round((timer - query.upload_status["last_success"]).total_seconds(), 3))
 
 def data_processing(server, timer):
     cpu_temp = query.get_cpu_temperature()
@@ -407,26 +511,67 @@ def data_processing(server, timer):
     """
     return title, data
 
+def adda_statistics(server):
+    # ADDA continuous acquisition, statistics of each channel over the cycle (e.g. ADC1_mean_1, ADC1_rms_1, ...)
+    # Only sent to the local consumers (display socket, snapshot, hub), the MySQL table has no columns for them
+    title, data = [], []
+    for node in server:
+        if not getattr(node, "_acquiring", False): continue
+        for attr, stat in (("Value","last"), ("Mean","mean"), ("Min","min"), ("Max","max"), ("RMS","rms")):
+            values = getattr(node, attr)
+            title += ["{}_{}_{}".format(node._name, stat, j+1) for j in range(len(values))]
+            data += list(values)
+    return title, data
+
+def publish_row(name, publish, *args):
+    try:
+        publish(*args)
+    except Exception as e:
+        # Print the error message
+        logging.error("(%s) problem with publishing the row: %s", name, e)
+        metrics.inc("fusion_publish_errors_total", sink=name)
+
 ########################################################################
 def socket_client_thread(data_queue):
+    pending = None  # row taken from the queue but not sent yet, kept across reconnections
     while True:
         try:
             # Connect to the server
             with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
                 sock.connect(UNIX_SOCKET_PATH)
+                # New connection, the schema (title) is sent again before the first row
+                encoder = ipc.encoder()
                 while True:
                     # Wait for new data to be placed in the queue
-                    data_to_send = data_queue.get()
-                    # Send data
-                    sock.sendall(','.join(map(str, data_to_send)).encode('utf-8'))
-                    # Sleep for the interval
-                    time.sleep(INTERVAL)
+                    if pending is None: pending = data_queue.get()
+                    title, data = pending
+                    # Send data as framed binary rows
+                    sock.sendall(encoder.encode(title, data))
+                    pending = None
         except Exception as e:
             logging.error("Socket communication error: %s", e)
             # Sleep briefly before retrying
             time.sleep(1)
+def put_latest(data_queue, item):
+    # Never block the loop, drop the oldest row when the consumer does not keep up
+    while True:
+        try:
+            data_queue.put_nowait(item)
+            return
+        except Full:
+            try:
+                data_queue.get_nowait()
+                metrics.inc("fusion_queue_dropped_total")
+            except Empty:
+                pass
 ########################################################################
 def main():
+    global MOD_PORT1
+    # Find the USB-to-RS232C adaptor
+    MOD_PORT1 = get_usb_port(MOD_PORT_ID1)
+    # Move the console/file output off the communication loop
+    query.setup_logging()
+    query.setup_reporting(REPORT["MODE"], REPORT["EVERY"], REPORT["FILE"])
     init = True  # variable to check initialization
     # Checking the connection
     while init:
@@ -454,8 +599,48 @@ def main():
             time.sleep(3)
     
     # Start the socket communication thread
-    #client_thread = threading.Thread(target=socket_client_thread, args=(QUEUE,), daemon=True)
-    #client_thread.start()
+    if SOCKET["ENABLE"]:
+        client_thread = threading.Thread(target=socket_client_thread, args=(QUEUE,), daemon=True)
+        client_thread.start()
+
+    # Create the shared-memory snapshot, removed at exit
+    shared = None
+    if SNAPSHOT["ENABLE"]:
+        shared = snapshot.writer(SNAPSHOT["NAME"], SNAPSHOT["SIZE"])
+        atexit.register(shared.close)
+
+    # Start the publish/subscribe hub
+    live = None
+    if HUB["ENABLE"]:
+        live = hub.hub(HUB["PATH"], HUB["TCP"], HUB["QUEUE"])
+        live.start()
+
+    # Start the MQTT uplink
+    uplink = None
+    if MQTT["ENABLE"]:
+        if mqtt_sink is None:
+            logging.error("MQTT is enabled but paho-mqtt is not installed (sudo apt install python3-paho-mqtt)")
+        else:
+            uplink = mqtt_sink.sink(MQTT["HOST"], MQTT["PORT"], MQTT["TOPIC"], MQTT["CLIENT_ID"], MQTT["USER"], MQTT["PASSWORD"],
+                                    qos=MQTT["QOS"], batch=MQTT["BATCH"], limit=MQTT["LIMIT"])
+            uplink.start()
+            atexit.register(uplink.stop)
+
+    # Report-by-exception filters, one per uplink (each one remembers its own last reported row)
+    filter_sql, filter_mqtt, filters = None, None, []
+    if DEADBAND["ENABLE"]:
+        filter_sql = deadband.deadband(DEADBAND["CHANNELS"], DEADBAND["DEFAULT"], DEADBAND["SILENCE"])
+        filters.append(("mysql", filter_sql))
+        if uplink is not None:
+            filter_mqtt = deadband.deadband(DEADBAND["CHANNELS"], DEADBAND["DEFAULT"], DEADBAND["SILENCE"])
+            filters.append(("mqtt", filter_mqtt))
+    
+    # Start the metrics endpoint
+    if METRICS["ENABLE"]:
+        metrics.describe("fusion_cycle_seconds", "histogram", "Duration of a whole communication loop")
+        metrics.describe("fusion_stage_seconds", "histogram", "Duration of each stage in the communication loop")
+        metrics.describe("fusion_device_read_seconds", "histogram", "Duration of reading each device")
+        metrics.start_server(METRICS["HOST"], METRICS["PORT"])
     
     first = [True, True]
     # Reading messages and Upload to database sequence
@@ -473,30 +658,54 @@ def main():
                 write_ADDA(server_DA)
             
             # Send the command to read the measured value and do all other things
-            read_modbus(server_modbus)
-            read_canbus(server_canbus)
-            read_ADDA(server_AD)
+            cycle_start = time.monotonic()
+            with metrics.timer("fusion_stage_seconds", stage="read_modbus"):
+                read_modbus(server_modbus)
+            with metrics.timer("fusion_stage_seconds", stage="read_canbus"):
+                read_canbus(server_canbus)
+            with metrics.timer("fusion_stage_seconds", stage="read_ADDA"):
+                read_ADDA(server_AD)
             timer = datetime.datetime.now()
             server = server_modbus + server_canbus + server_AD + server_DA
-            query.print_response(server, timer)
-            title, data = data_processing(server, timer)
-            QUEUE.put(data)  # Put the processed data into the queue
+            with metrics.timer("fusion_stage_seconds", stage="report"):
+                query.report_response(server, timer)
+            with metrics.timer("fusion_stage_seconds", stage="data_processing"):
+                title, data = data_processing(server, timer)
+                stat_title, stat_data = adda_statistics(server)
+                live_title, live_data = title + stat_title, data + stat_data
+            with metrics.timer("fusion_stage_seconds", stage="publish"):
+                # Each consumer is published separately, a failing one never stops the others or the upload
+                if SOCKET["ENABLE"]:
+                    publish_row("socket", put_latest, QUEUE, (live_title, live_data))  # Put the processed data (and its schema) into the queue
+                if shared is not None:
+                    publish_row("snapshot", shared.publish, live_title, live_data)  # Replace the snapshot read by the local consumers
+                if live is not None:
+                    publish_row("hub", live.publish_threadsafe, live_title, live_data)  # Queue the row for every hub subscriber
+                if uplink is not None and (filter_mqtt is None or filter_mqtt.check(title, data, cycle_start)):
+                    publish_row("mqtt", uplink.publish, title, data)  # Queue the row in the on-disk MQTT outbox
 
             # Check elapsed time
             if (timer - start).total_seconds() > DB_INTERVAL or first[1] == True:
                 start = timer
                 first[1] = False
-                # Update/push data to database
-                query.update_SQL(title, data, timer, FILENAME_REALTIME, SQL_SERVER_REALTIME, real_time, 0, DB_TIMEOUT)
-                #query.update_SQL(title, data, timer, FILENAME_RECAP, SQL_SERVER_RECAP, recap_time, 43200, DB_TIMEOUT*144)
-                #query.update_FTP(title, data, timer, FILENAME_REALTIME, FTP_SERVER_REALTIME, real_time, 0, DB_TIMEOUT)
-                #query.update_FTP(title, data, timer, FILENAME_RECAP, FTP_SERVER_RECAP, recap_time, 43200, DB_TIMEOUT*144)
+                # With the deadband, keep the row locally before only pushing the significant ones to database
+                with metrics.timer("fusion_stage_seconds", stage="upload"):
+                    if DEADBAND["ENABLE"]: query.log_in_daily_csv(title, data, timer, FILENAME_LOCAL)
+                    # The rows waiting in the CSV file are retried every time, the deadband only filters the new row
+                    new_row = filter_sql is None or filter_sql.check(title, data, cycle_start)
+                    query.update_SQL(title, data, timer, FILENAME_REALTIME, SQL_SERVER_REALTIME, real_time, 0, DB_TIMEOUT, new_row)
+                    #query.update_SQL(title, data, timer, FILENAME_RECAP, SQL_SERVER_RECAP, recap_time, 43200, DB_TIMEOUT*144)
+                    #query.update_FTP(title, data, timer, FILENAME_REALTIME, FTP_SERVER_REALTIME, real_time, 0, DB_TIMEOUT)
+                    #query.update_FTP(title, data, timer, FILENAME_RECAP, FTP_SERVER_RECAP, recap_time, 43200, DB_TIMEOUT*144)
+            metrics.observe("fusion_cycle_seconds", time.monotonic() - cycle_start)
+            update_metrics(server, datetime.datetime.now(), live, uplink, filters, shared)
                 
             time.sleep(INTERVAL)
     
         except Exception as e:
             # Print the error message
             logging.error("Encountered an error: %s", e)
+            metrics.inc("fusion_cycle_errors_total")
             #print(e)
             #print("<===== ===== retrying ===== =====>")
             #print("")
@@ -508,3 +717,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logging.info("Shutting down client.")
         # Ensure resources are closed properly.
+        query.stop_logging()
@@ -0,0 +1,120 @@
+"""
+#title           :metrics.py
+#description     :lightweight timing/counter instrumentation with a Prometheus-style HTTP text endpoint
+#author          :Nicholas Putra Rihandoko, Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Energy Monitoring System, curl http://127.0.0.1:9100/metrics
+#notes           :only uses the standard library, safe to call from several threads
+#python_version  :3.9.2
+#==============================================================================
+"""
+
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the histogram buckets (in seconds)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Registered metrics, {name: {"type":..., "help":..., "values": {labels: value}}}
+_metrics = {}
+_lock = threading.Lock()
+
+def get_metric(name,kind):
+    # Get (and/or initiate) the metric
+    if name not in _metrics: _metrics[name] = {"type":kind, "help":"", "values":{}}
+    return _metrics[name]
+
+def describe(name,kind,text):
+    # Set the type and description shown in the endpoint
+    with _lock:
+        metric = get_metric(name, kind)
+        metric["type"], metric["help"] = kind, text
+
+def inc(name,value=1,**labels):
+    # Increase a counter
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        values = get_metric(name, "counter")["values"]
+        values[key] = values.get(key, 0) + value
+
+def counter(name,value,**labels):
+    # Set a counter to a cumulative value that is counted somewhere else (e.g. in the node libraries)
+    with _lock: get_metric(name, "counter")["values"][tuple(sorted(labels.items()))] = value
+
+def gauge(name,value,**labels):
+    # Set a gauge to its current value
+    with _lock: get_metric(name, "gauge")["values"][tuple(sorted(labels.items()))] = value
+
+def observe(name,value,**labels):
+    # Add a sample into a histogram
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        values = get_metric(name, "histogram")["values"]
+        if key not in values: values[key] = {"buckets":[0]*len(BUCKETS), "sum":0, "count":0}
+        hist = values[key]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound: hist["buckets"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+@contextmanager
+def timer(name,**labels):
+    # Measure the duration of the code block into a histogram (using the monotonic clock)
+    start = time.monotonic()
+    try: yield
+    finally: observe(name, time.monotonic() - start, **labels)
+
+def format_labels(labels,extra=()):
+    labels = list(labels) + list(extra)
+    if not labels: return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + "}"
+
+def render():
+    # Build the Prometheus text exposition of every metric
+    lines = []
+    with _lock:
+        for name, metric in sorted(_metrics.items()):
+            if metric["help"]: lines.append("# HELP {} {}".format(name, metric["help"]))
+            lines.append("# TYPE {} {}".format(name, metric["type"]))
+            for labels, value in sorted(metric["values"].items()):
+                if metric["type"] == "histogram":
+                    for i, bound in enumerate(BUCKETS):
+                        lines.append("{}_bucket{} {}".format(name, format_labels(labels, [("le", bound)]), value["buckets"][i]))
+                    lines.append("{}_bucket{} {}".format(name, format_labels(labels, [("le", "+Inf")]), value["count"]))
+                    lines.append("{}_sum{} {}".format(name, format_labels(labels), value["sum"]))
+                    lines.append("{}_count{} {}".format(name, format_labels(labels), value["count"]))
+                else:
+                    lines.append("{}{} {}".format(name, format_labels(labels), value))
+    return "\n".join(lines) + "\n"
+
+class metrics_handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the HTTP access log out of the console
+        pass
+
+def start_server(host='127.0.0.1',port=9100):
+    # Serve the metrics endpoint in a background (daemon) thread
+    try:
+        server = ThreadingHTTPServer((host, port), metrics_handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info("Metrics endpoint at http://%s:%s/metrics", host, port)
+        return server
+    except OSError as e:
+        logging.error("Problem with metrics endpoint: %s", e)
+        return None
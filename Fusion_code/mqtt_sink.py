@@ -0,0 +1,179 @@
+"""
+#title           :mqtt_sink.py
+#description     :MQTT uplink of the rows with QoS 1, persistent session, and an on-disk outbound queue
+#author          :Nicholas Putra Rihandoko, Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Energy Monitoring System, started by main__Fusion.py (MQTT parameters)
+#notes           :needs paho-mqtt (sudo apt install python3-paho-mqtt), the queue is a SQLite file in the 'save' folder
+#python_version  :3.9.2
+#==============================================================================
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from collections import deque
+import paho.mqtt.client as mqtt
+
+"""
+Topics and payloads (compact JSON, a consumer joins the rows with the retained schema):
+<topic>/schema  : {"id": schema id, "title": [names]}, retained, published again when the title changes
+<topic>/data    : {"s": schema id, "r": [[row], [row], ...]}, 'batch' rows per message
+"""
+
+class sink:
+    def __init__(self,host,port=1883,topic='nepower',client_id='nepower-gateway',username=None,password=None,
+                 qos=1,batch=1,window=20,limit=100000,filename='mqtt_queue.sqlite',keepalive=60):
+        self._topic = topic
+        self._qos = qos
+        self._batch = batch         # rows per message
+        self._window = window       # messages waiting for PUBACK at the same time
+        self._limit = limit         # messages kept on disk, the oldest are dropped beyond this
+        self._rows = []             # rows of the next message
+        self._schema_id = None
+        self._inflight = {}         # message id (mid) of paho: row id in the queue, only used by the sender thread
+        self._acked = deque()       # mids acknowledged by the broker, removed from the disk queue by the sender thread
+        self._last = 0              # row id of the latest published message
+        self._reserved = 0          # row id of the latest message taken by the sender thread, never trimmed up to it
+        self._connected = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"queued": 0, "sent": 0, "dropped": 0, "backlog": 0}
+
+        # On-disk outbound queue, survives a restart of the program or of the Raspberry Pi
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'save')
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, filename), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "topic TEXT, payload BLOB, retain INTEGER)")
+        self._db.commit()
+        self.stats["backlog"] = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+        # Persistent session (clean_session=False): the broker keeps the QoS 1 messages of this client_id
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id, clean_session=False)
+        else:
+            self._client = mqtt.Client(client_id=client_id, clean_session=False)
+        if username: self._client.username_pw_set(username, password)
+        self._client.max_inflight_messages_set(window)
+        self._client.reconnect_delay_set(1, 60)
+        self._client.on_connect = self.handle_connect
+        self._client.on_disconnect = self.handle_disconnect
+        self._client.on_publish = self.handle_publish
+        self._host, self._port, self._keepalive = host, port, keepalive
+
+    def start(self):
+        # Connect in the background (paho network thread), the queue is sent by another thread
+        self._client.connect_async(self._host, self._port, self._keepalive)
+        self._client.loop_start()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="mqtt", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.flush()
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None: self._thread.join(5)
+        self._client.disconnect()
+        self._client.loop_stop()
+        self.handle_acked()
+        with self._lock: self._db.close()
+
+    def publish(self,title,data):
+        # Add a row, a message is queued on disk every 'batch' rows, never waits for the network
+        schema_id = zlib.crc32(json.dumps(title).encode('utf-8'))
+        if schema_id != self._schema_id:
+            self.flush()
+            self._schema_id = schema_id
+            schema = json.dumps({"id": schema_id, "title": title}, separators=(',',':'))
+            self.enqueue(self._topic + '/schema', schema, retain=True)
+        self._rows.append(data)
+        if len(self._rows) >= self._batch: self.flush()
+
+    def flush(self):
+        # Queue the rows waiting for a full batch
+        if not self._rows: return
+        payload = json.dumps({"s": self._schema_id, "r": self._rows}, separators=(',',':'), default=float)
+        self._rows = []
+        self.enqueue(self._topic + '/data', payload)
+
+    def enqueue(self,topic,payload,retain=False):
+        with self._lock:
+            self._db.execute("INSERT INTO outbox (topic, payload, retain) VALUES (?, ?, ?)", (topic, payload.encode('utf-8'), int(retain)))
+            self.stats["queued"] += 1
+            self.stats["backlog"] += 1
+            if self.stats["backlog"] > self._limit:
+                # Outage longer than the queue, forget the oldest messages (the CSV file still has the rows)
+                # The messages given to paho (waiting for PUBACK) and the schemas (retained) are kept
+                excess = self.stats["backlog"] - self._limit
+                dropped = self._db.execute("DELETE FROM outbox WHERE id IN (SELECT id FROM outbox WHERE id > ? AND retain = 0 "
+                                           "ORDER BY id LIMIT ?)", (self._reserved, excess)).rowcount
+                self.stats["dropped"] += dropped
+                self.stats["backlog"] -= dropped
+            self._db.commit()
+        self._wake.set()
+
+    def run(self):
+        # Publish the queued messages in order, at most 'window' of them waiting for their PUBACK
+        while not self._stop.is_set():
+            self._wake.clear()
+            self.handle_acked()
+            if self._connected:
+                # Only the disk access is locked, paho takes its own locks in publish() and in the callbacks
+                with self._lock:
+                    free = self._window - len(self._inflight)
+                    rows = self._db.execute("SELECT id, topic, payload, retain FROM outbox WHERE id > ? ORDER BY id LIMIT ?",
+                                            (self._last, max(free, 0))).fetchall()
+                    # enqueue() must not trim the rows being given to paho
+                    if rows: self._reserved = rows[-1][0]
+                for row_id, topic, payload, retain in rows:
+                    info = self._client.publish(topic, payload, qos=self._qos, retain=bool(retain))
+                    if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN): break
+                    # Without connection, paho keeps a QoS 1 message and sends it after reconnecting
+                    self._inflight[info.mid] = row_id
+                    self._last = row_id
+                    if info.rc == mqtt.MQTT_ERR_NO_CONN: break
+                if rows:
+                    with self._lock: self._reserved = self._last
+            self._wake.wait(1)
+
+    def handle_acked(self):
+        # Remove the acknowledged messages from the disk queue (PUBACKs received since the previous call)
+        done = []
+        while self._acked:
+            row_id = self._inflight.pop(self._acked.popleft(), None)
+            if row_id is not None: done.append((row_id,))
+        if not done: return
+        with self._lock:
+            self._db.executemany("DELETE FROM outbox WHERE id = ?", done)
+            self._db.commit()
+            self.stats["sent"] += len(done)
+            self.stats["backlog"] -= len(done)
+
+    def handle_connect(self,client,userdata,flags,rc):
+        if rc != 0:
+            logging.error("(mqtt) connection refused: %s", mqtt.connack_string(rc))
+            return
+        logging.info("(mqtt) connected to %s:%s, session present: %s", self._host, self._port, flags.get("session present"))
+        self._connected = True
+        self._wake.set()
+
+    def handle_disconnect(self,client,userdata,rc):
+        # paho sends the messages without PUBACK again after reconnecting (same session), they stay in _inflight
+        self._connected = False
+        if rc != 0: logging.warning("(mqtt) disconnected (%s), reconnecting", mqtt.error_string(rc))
+
+    def handle_publish(self,client,userdata,mid):
+        # PUBACK received (network thread of paho, which holds its own locks), the sender thread removes the message
+        self._acked.append(mid)
+        self._wake.set()
+
+### END OF FILE ###
@@ -11,10 +11,17 @@
 """
 
 import logging
-import pymysql
+import logging.handlers
+try:
+    import pymysql
+except ImportError:
+    pymysql = None  # only needed for the upload to MySQL (connect_mysql)
 import signal
 import datetime
 import ftplib
+import queue
+import json
+import sys
 import csv
 import os
 
@@ -32,9 +39,12 @@ def handle_timeout(signum, frame):
 signal.signal(signal.SIGALRM, handle_timeout)
 
 def get_cpu_temperature():
-    # Read CPU temperature from file
-    with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
-        temp = round(float(f.read().strip())/1000,1)
+    # Read CPU temperature from file (not available off-device, e.g. when testing with the simulators)
+    try:
+        with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
+            temp = round(float(f.read().strip())/1000,1)
+    except FileNotFoundError:
+        temp = None
     return temp
 
 def print_response(server,timer):
@@ -58,6 +68,72 @@ def print_response(server,timer):
                             print(attr_name, i+1, "=", attr_value[i])
         print("")
 
+#################################################################################################################
+## Reporting the measurements in the communication loop
+
+# mode: 'off' (no report), 'print' (print_response), or 'json' (one JSON line per report, written in background)
+report_config = {"mode":'print', "every":1, "cycle":0}
+report_logger = logging.getLogger("report")
+log_listeners = []
+
+class json_formatter(logging.Formatter):
+    # Format the measurement snapshot as a single JSON line
+    def format(self, record):
+        return json.dumps(record.msg, default=str, separators=(',', ':'))
+
+class snapshot_handler(logging.handlers.QueueHandler):
+    # Put the snapshot into the queue as it is, the JSON encoding is done by the background writer
+    def prepare(self, record):
+        return record
+
+def setup_logging(level=logging.INFO):
+    # Write every log record in a background thread (QueueHandler), so the console I/O is off the communication loop
+    log_queue = queue.Queue(-1)
+    root = logging.getLogger()
+    handlers = root.handlers[:] or [logging.StreamHandler()]
+    for h in handlers: root.removeHandler(h)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    log_listeners.append(listener)
+
+def setup_reporting(mode='print', every=1, filename=None):
+    # Configure the report stage, the JSON lines go to the file (if given) or standard output
+    global report_config
+    report_config.update({"mode":mode, "every":max(int(every),1), "cycle":0})
+    if mode == 'json':
+        handler = logging.FileHandler(filename) if filename else logging.StreamHandler(sys.stdout)
+        handler.setFormatter(json_formatter())
+        report_queue = queue.Queue(-1)
+        report_logger.handlers = [snapshot_handler(report_queue)]
+        report_logger.setLevel(logging.INFO)
+        report_logger.propagate = False
+        listener = logging.handlers.QueueListener(report_queue, handler)
+        listener.start()
+        log_listeners.append(listener)
+
+def stop_logging():
+    # Flush the remaining log records before the program ends
+    while log_listeners: log_listeners.pop().stop()
+
+def get_snapshot(server,timer):
+    # Copy the object's attributes, so the background writer never reads values changed by the next cycle
+    nodes = {}
+    for node in server:
+        nodes[node._name] = {k: v for k, v in vars(node).items() if not k.startswith("_")}
+    return {"time": timer.strftime("%Y-%m-%d %H:%M:%S"), "cpu_temp": get_cpu_temperature(), "nodes": nodes}
+
+def report_response(server,timer):
+    # Report the measurements based on report_config (disabled, or sampled every N cycles)
+    report_config["cycle"] += 1
+    if report_config["mode"] == 'off' or (report_config["cycle"] - 1) % report_config["every"] != 0:
+        return
+    if report_config["mode"] == 'json':
+        report_logger.info(get_snapshot(server, timer))
+    else:
+        print_response(server, timer)
+
 #################################################################################################################
 ## Handle saving data to CSV
 
@@ -114,6 +190,24 @@ def log_in_csv(title,data,timer,filename):
         data = [strval(d) if isinstance(d,list) else d for d in data]
         line.writerow(data)
 
+def log_in_daily_csv(title,data,timer,filename):
+    # Local log of the rows checked by the deadband, one append-only file per day (e.g. data_local_log_2024-03-11.csv), kept for log_limit days
+    global log_directory, log_limit
+    name, extension = os.path.splitext(filename)
+    file_directory = os.path.join(log_directory, "{}_{}{}".format(name, timer.strftime("%Y-%m-%d"), extension))
+    new_file = not os.path.exists(file_directory)
+    with open(file_directory, mode='a', newline='') as file:
+        line = csv.writer(file, delimiter =',')
+        if new_file: line.writerow(title)
+        line.writerow([strval(d) if isinstance(d,list) else d for d in data])
+    if new_file:
+        # First row of the day, remove the files older than log_limit days
+        oldest = (timer - datetime.timedelta(days=log_limit)).strftime("%Y-%m-%d")
+        for old in os.listdir(log_directory):
+            stamp = old[len(name)+1:len(name)+11]
+            if old == "{}_{}{}".format(name, stamp, extension) and stamp < oldest:
+                delete_file(os.path.join(log_directory, old))
+
 #################################################################################################################
 ## Interacting with MySQL Database
 
@@ -154,8 +248,11 @@ def connect_mysql(mysql_server,mysql_query,data=None,timeout=2):
         print("")
         return False
 
+# Status of the upload to MySQL (rows waiting in the backup file and time of the last successful upload)
+upload_status = {"backlog":0, "last_success":None}
+
 def retry_mysql(mysql_server,mysql_query,filename,timeout=2):
-    global log_directory
+    global log_directory, upload_status
     #return
     file_directory = os.path.join(log_directory,filename)
     rows_to_delete = []
@@ -170,13 +267,15 @@ def retry_mysql(mysql_server,mysql_query,filename,timeout=2):
                 upload_succeed = connect_mysql(mysql_server,mysql_query,row_data,timeout)
                 if upload_succeed: rows_to_delete.append(row)
                 else: break
-    except FileNotFoundError: pass
+    except FileNotFoundError: csv_log = []
     # Write the updated contents to a new CSV file
     if rows_to_delete:
+        upload_status["last_success"] = datetime.datetime.now()
         csv_log = [row_data for row, row_data in enumerate(csv_log) if row not in rows_to_delete]
         with open(file_directory, 'w') as file:
             writer = csv.writer(file)
             writer.writerows(csv_log)
+    upload_status["backlog"] = max(len(csv_log)-1, 0)
 
 def limit_db_rows(mysql_server,row_limit,timeout=2):
     mysql_query = ("DELETE FROM {} WHERE id NOT IN ( SELECT id FROM ( "
@@ -292,13 +391,14 @@ def update_FTP(title, data, timer, filename, ftp_server, last_time, interval_upl
             delete_file(local_path)
             prepare_new_file(local_path, title)
 
-def update_SQL(title, data, timer, csv_file, sql_server, last_time, interval_upload=0, timeout=3):
+def update_SQL(title, data, timer, csv_file, sql_server, last_time, interval_upload=0, timeout=3, new_row=True):
     # Define MySQL queries and data which will be used in the program
     sql_query = ("INSERT INTO `{}` ({}) VALUES ({})".format(sql_server["table"],
                                                                 ",".join(title),
                                                                 ",".join(['%s' for _ in range(len(title))])))
 
-    log_in_csv(title ,data, timer, csv_file)
+    # new_row=False only retries the rows waiting in the CSV file (e.g. the row is filtered by the deadband)
+    if new_row: log_in_csv(title ,data, timer, csv_file)
     if (timer - last_time).total_seconds() > interval_upload:
         last_time = timer
         retry_mysql(sql_server, sql_query, csv_file, timeout)
@@ -0,0 +1,225 @@
+"""
+#title           :test_mqtt_sink.py
+#description     :test of the MQTT uplink (mqtt_sink.py) against a local broker, link outage, QoS 1 redelivery, queue limit
+#author          :Nicholas Putra Rihandoko, Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :python3 -m unittest test_mqtt_sink (or python3 -m pytest test_mqtt_sink.py), in the Fusion_code folder
+#notes           :needs paho-mqtt and the amqtt broker (pip install amqtt), the test is skipped without them
+#python_version  :3.9.2
+#==============================================================================
+"""
+
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    import paho.mqtt.client as mqtt
+    import mqtt_sink
+except ImportError:
+    mqtt = None
+
+BROKER = shutil.which("amqtt")  # broker stand-in
+TITLE = ["time", "value"]
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until(condition,timeout=20):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition(): return True
+        time.sleep(0.05)
+    return condition()
+
+class link:
+    # TCP relay between the sink and the broker, to cut the network or lose the PUBACKs on purpose
+    def __init__(self,port):
+        self._port = port
+        self._server = socket.create_server(('127.0.0.1', 0))
+        self.port = self._server.getsockname()[1]
+        self.up = True          # False: connections are refused and the open ones are closed
+        self.acks = True        # False: the bytes from the broker (PUBACKs) are lost
+        self._sockets = []
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try: client, _ = self._server.accept()
+            except OSError: return
+            if not self.up:
+                client.close()
+                continue
+            broker = socket.create_connection(('127.0.0.1', self._port))
+            self._sockets += [client, broker]
+            threading.Thread(target=self.relay, args=(client, broker, False), daemon=True).start()
+            threading.Thread(target=self.relay, args=(broker, client, True), daemon=True).start()
+
+    def relay(self,source,destination,from_broker):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data: break
+                if from_broker and not self.acks: continue
+                destination.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, destination): sock.close()
+
+    def cut(self):
+        self.up = False
+        for sock in self._sockets:
+            try: sock.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+        self._sockets = []
+
+    def restore(self):
+        self.acks = True
+        self.up = True
+
+    def close(self):
+        self.cut()
+        self._server.close()
+
+@unittest.skipIf(mqtt is None or BROKER is None, "paho-mqtt or the amqtt broker is not installed")
+class test_sink(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._directory = tempfile.mkdtemp()
+        cls._port = get_free_port()
+        config = os.path.join(cls._directory, 'broker.yaml')
+        with open(config, 'w') as file:
+            file.write("listeners:\n  default:\n    type: tcp\n    bind: 127.0.0.1:{}\n"
+                       "plugins:\n  amqtt.plugins.authentication.AnonymousAuthPlugin:\n    allow_anonymous: true\n".format(cls._port))
+        cls._broker = subprocess.Popen([BROKER, '-c', config], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not wait_until(lambda: cls.is_listening(cls._port), 15):
+            cls._broker.kill()
+            raise RuntimeError("the MQTT broker did not start")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._broker.terminate()
+        cls._broker.wait(10)
+        shutil.rmtree(cls._directory, ignore_errors=True)
+
+    @staticmethod
+    def is_listening(port):
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return True
+        except OSError:
+            return False
+
+    def setUp(self):
+        self.topic = 'test/' + self.id().rsplit('.', 1)[-1]
+        self.filename = os.path.join(self._directory, self.topic.replace('/', '_') + '.sqlite')
+        self.link = link(self._port)
+        # Subscriber connected straight to the broker for the whole test
+        self.received = []      # (topic, payload) of every message
+        subscribed = threading.Event()
+        self.subscriber = mqtt.Client(client_id='sub-' + self.topic.replace('/', '-'))
+        self.subscriber.on_connect = lambda client, userdata, flags, rc: client.subscribe(self.topic + '/#', qos=1)
+        self.subscriber.on_subscribe = lambda client, userdata, mid, qos: subscribed.set()
+        self.subscriber.on_message = lambda client, userdata, message: self.received.append(
+            (message.topic, json.loads(message.payload)))
+        self.subscriber.connect('127.0.0.1', self._port)
+        self.subscriber.loop_start()
+        self.assertTrue(subscribed.wait(10))
+        self.sinks = []
+
+    def tearDown(self):
+        for sink in self.sinks:
+            try: sink.stop()
+            except Exception: pass
+        self.subscriber.disconnect()
+        self.subscriber.loop_stop()
+        self.link.close()
+
+    def start_sink(self,**kwargs):
+        sink = mqtt_sink.sink('127.0.0.1', self.link.port, topic=self.topic, client_id='gw-' + self.topic.replace('/', '-'),
+                              filename=self.filename, **kwargs)
+        sink.start()
+        self.sinks.append(sink)
+        return sink
+
+    def get_rows(self):
+        return [row[0] for topic, payload in self.received if topic.endswith('/data') for row in payload["r"]]
+
+    def count_outbox(self):
+        with sqlite3.connect(self.filename) as db: return db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def test_queue_offline_and_drain(self):
+        # The rows are queued on disk while the link is down, and sent in order once it is back
+        self.link.up = False
+        sink = self.start_sink(batch=5)
+        for i in range(20): sink.publish(TITLE, [str(i), float(i)])
+        time.sleep(1.5)
+        self.assertEqual(sink.stats["sent"], 0)
+        self.assertEqual(sink.stats["backlog"], 5)     # schema and 4 messages of 5 rows
+        self.assertEqual(self.count_outbox(), 5)
+        self.link.restore()
+        self.assertTrue(wait_until(lambda: sink.stats["backlog"] == 0 and len(self.get_rows()) == 20))
+        self.assertEqual(self.get_rows(), [str(i) for i in range(20)])
+        self.assertEqual(sink.stats["sent"], 5)
+        self.assertEqual(self.count_outbox(), 0)
+
+    def test_redelivery_without_puback(self):
+        # The messages without PUBACK stay on disk and are sent again (QoS 1) when the link is back
+        sink = self.start_sink(batch=1)
+        sink.publish(TITLE, ["0", 0.0])
+        self.assertTrue(wait_until(lambda: sink.stats["backlog"] == 0))
+        self.link.acks = False
+        for i in range(1, 6): sink.publish(TITLE, [str(i), float(i)])
+        self.assertTrue(wait_until(lambda: len(self.get_rows()) == 6))     # delivered, but the PUBACKs are lost
+        time.sleep(0.5)
+        self.assertEqual(sink.stats["backlog"], 5)
+        self.assertEqual(self.count_outbox(), 5)
+        self.link.cut()
+        sink.publish(TITLE, ["6", 6.0])
+        self.link.restore()
+        self.assertTrue(wait_until(lambda: sink.stats["backlog"] == 0 and "6" in self.get_rows()))
+        rows = self.get_rows()
+        self.assertEqual(sorted(set(rows), key=int), [str(i) for i in range(7)])
+        # Rows 1-5 were sent again after reconnecting, so they arrived twice (at least once delivery)
+        self.assertEqual({row: rows.count(row) for row in set(rows)}, {"0": 1, "1": 2, "2": 2, "3": 2, "4": 2, "5": 2, "6": 1})
+        self.assertEqual(sink.stats["sent"], 8)     # schema and 7 rows
+        self.assertEqual(self.count_outbox(), 0)
+
+    def test_limit_keeps_inflight_and_schema(self):
+        # Beyond the limit, only messages not given to paho are dropped, and the accounting matches the disk queue
+        sink = self.start_sink(batch=1, window=3, limit=5)
+        self.assertTrue(wait_until(lambda: sink._connected))
+        self.link.acks = False
+        for i in range(2): sink.publish(TITLE, [str(i), float(i)])
+        self.assertTrue(wait_until(lambda: len(self.get_rows()) == 2))      # schema and 2 rows waiting for PUBACK
+        self.link.cut()
+        for i in range(2, 12): sink.publish(TITLE, [str(i), float(i)])
+        self.assertEqual(sink.stats["queued"], 13)
+        self.assertEqual(sink.stats["backlog"], 5)
+        self.assertEqual(sink.stats["dropped"], 8)
+        self.assertEqual(self.count_outbox(), sink.stats["backlog"])
+        with sqlite3.connect(self.filename) as db:
+            kept = [json.loads(payload) for payload, in db.execute("SELECT payload FROM outbox ORDER BY id")]
+        self.assertIn("title", kept[0])     # the schema is never dropped
+        self.assertEqual([payload["r"][0][0] for payload in kept[1:]], ["0", "1", "10", "11"])
+        self.link.restore()
+        self.assertTrue(wait_until(lambda: sink.stats["backlog"] == 0 and "11" in self.get_rows()))
+        self.assertEqual(sink.stats["sent"] + sink.stats["dropped"], sink.stats["queued"])
+        self.assertEqual(self.count_outbox(), 0)
+        self.assertEqual(sorted(set(self.get_rows()), key=int), ["0", "1", "10", "11"])
+
+if __name__ == "__main__":
+    unittest.main()
+
+### END OF FILE ###
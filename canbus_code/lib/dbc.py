@@ -0,0 +1,73 @@
+"""
+#title           :dbc.py
+#description     :minimal DBC file parser for the CANbus node libraries
+#author          :Nicholas Putra Rihandoko
+#date            :2024/03/11
+#version         :1.0
+#usage           :Energy Monitoring System, toshiba.node(name, client, dbc='lib/toshiba_SCiB.dbc')
+#notes           :only reads messages (BO_), signals (SG_), and the "Round" signal attribute (BA_), other sections (CM_, VAL_, ...) are skipped
+#python_version  :3.9.2
+#==============================================================================
+"""
+import re
+import math
+
+# BO_ <id> <name>: <size> <transmitter>
+MESSAGE = re.compile(r'^BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)')
+# SG_ <name> [M|m<value>] : <start>|<length>@<order><sign> (<scale>,<offset>) [<min>|<max>] "<unit>" <receivers>
+SIGNAL = re.compile(r'^SG_\s+(\w+)\s*(M|m\d+M?)?\s*:\s*(\d+)\|(\d+)@([01])([+-])\s*\(([^,]+),([^)]+)\)')
+# BA_ "Round" SG_ <id> <name> <decimals>; (decimals of the published value, instead of the ones inferred from the scale)
+ROUND = re.compile(r'^BA_\s+"Round"\s+SG_\s+(\d+)\s+(\w+)\s+(\d+)\s*;')
+
+def get_round(scale):
+    # Number of decimals that the scale can resolve
+    if float(scale).is_integer(): return 0
+    return max(1, math.ceil(-math.log10(abs(scale))))
+
+def get_id(arb_id):
+    # The extended (29-bit) ID is flagged with the most significant bit
+    return arb_id & 0x1FFFFFFF if arb_id & 0x80000000 else arb_id
+
+def load_dbc(filename):
+    # Read the signal definitions in the same form as the _can_id library of the node
+    # {name: {"id", "start", "bit", "length", "order", "signed", "size", "scale", "bias", "round", "mux", "mux_value"}}
+    can_id = {}
+    multiplexer = {}    # name of the multiplexer signal of each message, {arbitration ID: name}
+    names = {}          # name in can_id of each signal, {(arbitration ID, DBC name): name}
+    rounds = {}         # "Round" attribute of the signals, {(arbitration ID, DBC name): decimals}
+    message = None
+    with open(filename, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            line = line.strip()
+            found = MESSAGE.match(line)
+            if found:
+                message = {"id":get_id(int(found.group(1))), "name":found.group(2), "size":int(found.group(3))}
+                continue
+            found = ROUND.match(line)
+            if found:
+                rounds[(get_id(int(found.group(1))), found.group(2))] = int(found.group(3))
+                continue
+            found = SIGNAL.match(line)
+            if not found or message is None: continue
+            signal, mux, bit, length, order, sign, scale, offset = found.groups()
+            bit, length, scale, offset = int(bit), int(length), float(scale), float(offset)
+            # Signal names are only unique within a message
+            name = signal
+            if name in can_id and can_id[name]["id"] != message["id"]: name = message["name"] + '_' + name
+            names[(message["id"], signal)] = name
+            can_id[name] = {"id":message["id"], "start":bit//8, "bit":bit, "length":length,
+                            "order":'big' if order == '0' else 'little', "signed":sign == '-', "size":message["size"],
+                            "scale":scale, "bias":-offset/scale if scale else 0, "round":get_round(scale),
+                            "mux":None, "mux_value":None}
+            if mux == 'M': multiplexer[message["id"]] = name
+            # Nested multiplexing (m<value>M) is decoded by its value on the main multiplexer only
+            elif mux: can_id[name]["mux_value"] = int(mux[1:].rstrip('M'))
+    # The multiplexer may be defined after the multiplexed signals
+    for value in can_id.values():
+        if value["mux_value"] is not None: value["mux"] = multiplexer.get(value["id"])
+    # The attributes are defined after all messages
+    for key, decimals in rounds.items():
+        if key in names: can_id[names[key]]["round"] = decimals
+    return can_id
+
+### END OF FILE ###
@@ -23,11 +23,13 @@ import can # code packet for CANbus communication
 from lib import toshiba_SCiB as battery
 
 # Define CANbus communication parameters
-BUSTYPE         = 'socketcan' # CANbus interface for Waveshare RS485/CAN Hat module
-CHANNEL         = 'can0' # location of channel used for CANbus Communication
+BUSTYPE         = 'socketcan' # CANbus interface for Waveshare RS485/CAN Hat module, or 'udp_multicast' to read frames from replay.py
+CHANNEL         = 'can0' # location of channel used for CANbus Communication, 'vcan0' to read frames from replay.py
 BITRATE         = 250000 # Toshiba SCiB speed of CANbus = 250000
 RESTART         = 100 # the time it takes to restart CANbus communication if it fails (in milisecond)
 TIMEOUT         = 2 # the maximum time the master/client will wait for response from slave/server (in seconds)
+DBC             = None # signal definitions of the node library, or a DBC file (e.g. 'lib/toshiba_SCiB.dbc')
+LISTEN          = True # decode broadcast messages continuously in the background, a read only takes the latest values
 INTERVAL       = 30 # the period between each subsequent communication routine/loop (in seconds)
 
 # Define FTP database parameters
@@ -49,14 +51,21 @@ FILENAME = 'canbus_log.csv'
 #query.debugging()  # Monitor Modbus communication for debugging
 
 def setup_canbus():
-    global BUSTYPE, CHANNEL, BITRATE, RESTART, TIMEOUT
+    global BUSTYPE, CHANNEL, BITRATE, RESTART, TIMEOUT, DBC, LISTEN
     # Configure and bring up the SocketCAN network interface
-    os.system('sudo modprobe can && sudo modprobe can_raw') # load SocketCAN related kernel modules
-    os.system('sudo ip link set down {}'.format(CHANNEL)) # disable can0 before config to implement changes in bitrate settings
-    os.system('sudo ip link set {} type can bitrate {} restart-ms {}'.format(CHANNEL,BITRATE,RESTART)) # configure can0 & set to 250000 bit/s
-    os.system('sudo ip link set up {}'.format(CHANNEL)) # enable can0 so configuration take effects
+    if BUSTYPE == 'socketcan' and CHANNEL.startswith('vcan'):
+        # Virtual SocketCAN interface (e.g. frames of replay.py), it has no bitrate
+        os.system('sudo modprobe vcan') # load the virtual CAN kernel module
+        os.system('sudo ip link add dev {} type vcan'.format(CHANNEL)) # fails harmlessly if the interface already exists
+        os.system('sudo ip link set up {}'.format(CHANNEL))
+    elif BUSTYPE == 'socketcan':
+        os.system('sudo modprobe can && sudo modprobe can_raw') # load SocketCAN related kernel modules
+        os.system('sudo ip link set down {}'.format(CHANNEL)) # disable can0 before config to implement changes in bitrate settings
+        os.system('sudo ip link set {} type can bitrate {} restart-ms {}'.format(CHANNEL,BITRATE,RESTART)) # configure can0 & set to 250000 bit/s
+        os.system('sudo ip link set up {}'.format(CHANNEL)) # enable can0 so configuration take effects
     client = can.interface.Bus(bustype=BUSTYPE, channel=CHANNEL, bitrate=BITRATE)
-    bat = battery.node(name='TOSHIBA BATTERY', client=client, timeout=TIMEOUT)
+    bat = battery.node(name='TOSHIBA BATTERY', client=client, timeout=TIMEOUT, dbc=DBC)
+    if LISTEN: bat.start_listener()
     server = [bat]
     return server
 
@@ -0,0 +1,112 @@
+"""
+#title           :replay.py
+#description     :Record, replay, and benchmark CANbus frames of the SCiB Battery
+#author          :Nicholas Putra Rihandoko
+#date            :2024/03/11
+#version         :1.0
+#usage           :python3 replay.py record save/scib.blf [--channel can0] [--duration s]
+#                 python3 replay.py replay save/scib.blf [--bustype socketcan] [--channel vcan0] [--speed 1] [--repeat]
+#                 python3 replay.py benchmark save/scib.blf [--dbc lib/toshiba_SCiB.dbc] [--bus] [--output result.json]
+#notes           :set CHANNEL = 'vcan0' in main__canbus.py to read the replayed frames (it creates the vcan0 interface),
+#                 or BUSTYPE = 'udp_multicast' and CHANNEL = '239.74.163.2' in both when SocketCAN is not available
+#python_version  :3.9.2
+#==============================================================================
+"""
+
+# Import library
+import argparse
+import datetime
+import json
+import platform
+import time
+import can # code packet for CANbus communication
+from lib import toshiba_SCiB as battery
+from lib import recorder
+
+def run_record(args):
+    client = can.interface.Bus(bustype=args.bustype, channel=args.channel)
+    rec = recorder.recorder(client, args.file)
+    rec.start()
+    print("<===== Recording {} into {} =====>".format(args.channel, args.file))
+    try:
+        if args.duration: time.sleep(args.duration)
+        else:
+            while True: time.sleep(1)
+    except KeyboardInterrupt: pass
+    finally:
+        rec.stop()
+        client.shutdown()
+    print("-- {} messages recorded --".format(rec.count))
+
+def run_replay(args):
+    rep = recorder.replayer(args.file, args.channel, args.speed, args.repeat, args.bustype)
+    print("<===== Replaying {} into {} channel '{}' =====>".format(args.file, args.bustype, args.channel))
+    rep.start()
+    try: rep.join()
+    except KeyboardInterrupt: pass
+    finally: rep.stop()
+    print("-- {} messages replayed --".format(rep.count))
+
+def run_benchmark(args):
+    bat = battery.node(name='TOSHIBA BATTERY', client=None, dbc=args.dbc)
+    messages = list(can.LogReader(args.file))
+    # Decoder throughput, every message of the log is decoded into the node's attributes
+    unknown = set()
+    start = time.perf_counter()
+    for message in messages:
+        decoders = bat._id_index.get(message.arbitration_id)
+        if decoders: bat.save_read(message, decoders)
+        else: unknown.add(message.arbitration_id)
+    period = time.perf_counter() - start
+    result = {"meta": {"timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                       "host": platform.node(), "machine": platform.machine(),
+                       "python": platform.python_version(), "file": args.file, "dbc": args.dbc},
+              "decode": {"messages": len(messages), "total_s": round(period, 6),
+                         "messages_per_s": round(len(messages)/period, 1) if period else None,
+                         "unknown_id": [hex(a) for a in sorted(unknown)]},
+              "values": {key: getattr(bat, key) for key in bat._can_id if hasattr(bat, key)}}
+    if args.bus:
+        # End-to-end throughput, the log is replayed at full speed into the background listener of the node
+        rep = recorder.replayer(args.file, args.channel, speed=0, bustype='virtual')
+        bat._client = can.interface.Bus(bustype='virtual', channel=args.channel)
+        bat.start_listener()
+        start = time.perf_counter()
+        rep.start()
+        rep.join()
+        period = time.perf_counter() - start
+        time.sleep(bat._timeout)
+        bat.stop_listener()
+        rep.stop()
+        bat._client.shutdown()
+        result["bus"] = {"messages": rep.count, "total_s": round(period, 6),
+                         "messages_per_s": round(rep.count/period, 1) if period else None,
+                         "signals": len(bat.get_snapshot())}
+    if args.output:
+        with open(args.output, 'w') as file: json.dump(result, file, indent=2)
+    print(json.dumps(result, indent=2))
+
+def main():
+    parser = argparse.ArgumentParser(description="Record, replay, and benchmark CANbus frames of the SCiB Battery")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="capture the frames of a CANbus channel into a log file")
+    record.add_argument("file", help="log file, the format follows the extension (.blf, .log, .asc, .csv)")
+    record.add_argument("--bustype", default='socketcan')
+    record.add_argument("--channel", default='can0')
+    record.add_argument("--duration", type=float, default=0, help="recording time (in seconds), 0 = until Ctrl+C")
+    replay = commands.add_parser("replay", help="send the frames of a log file into a CANbus channel of another process")
+    replay.add_argument("file")
+    replay.add_argument("--bustype", default='socketcan', help="'socketcan' or 'udp_multicast', same as BUSTYPE of main__canbus.py")
+    replay.add_argument("--channel", default='vcan0', help="channel read by main__canbus.py, a vcan interface or a multicast group")
+    replay.add_argument("--speed", type=float, default=1, help="1 = recorded timing, 0 = as fast as possible")
+    replay.add_argument("--repeat", action="store_true", help="start over at the end of the log")
+    benchmark = commands.add_parser("benchmark", help="measure the decoding throughput of a log file")
+    benchmark.add_argument("file")
+    benchmark.add_argument("--dbc", default=None, help="read the signal definitions from a DBC file")
+    benchmark.add_argument("--bus", action="store_true", help="also replay through a virtual bus into the background listener")
+    benchmark.add_argument("--channel", default='benchmark', help="in-process virtual channel of --bus")
+    benchmark.add_argument("--output", default=None, help="save the JSON result to this file")
+    args = parser.parse_args()
+    {"record": run_record, "replay": run_replay, "benchmark": run_benchmark}[args.command](args)
+
+if __name__ == "__main__":
+    main()
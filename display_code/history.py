@@ -0,0 +1,55 @@
+"""
+#title           :history.py
+#description     :bounded history of a displayed parameter, decimated into min/max columns for the trend charts
+#author          :Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Energy Monitoring System, TrendChart of main__display.py
+#notes           :memory does not grow with the sample rate, one column holds the min/max of 'seconds/columns' seconds
+#python_version  :3.11.5
+#==============================================================================
+"""
+from collections import deque
+
+class history:
+    def __init__(self, seconds=600, columns=300):
+        self.seconds = seconds
+        self.size = columns
+        self.span = seconds / columns               # seconds per column
+        self.columns = deque()                      # [column index, min, max, last], oldest first
+
+    def append(self, stamp, value):
+        # Add a sample (monotonic time in seconds), return 'update' (latest column changed), 'new' (column added), or None
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None                             # e.g. "none" before the first data
+        if value != value:
+            return None                             # NaN
+        index = int(stamp // self.span)
+        columns = self.columns
+        if columns and columns[-1][0] == index:
+            column = columns[-1]
+            column[1] = min(column[1], value)
+            column[2] = max(column[2], value)
+            column[3] = value
+            return 'update'
+        columns.append([index, value, value, value])
+        self.trim()
+        return 'new'
+
+    def trim(self):
+        # Forget the columns that are older than the time window
+        columns = self.columns
+        while columns and columns[0][0] <= columns[-1][0] - self.size:
+            columns.popleft()
+
+    def bounds(self):
+        # (lowest, highest) value of the window, None if empty
+        if not self.columns: return None
+        return min(c[1] for c in self.columns), max(c[2] for c in self.columns)
+
+    def latest(self):
+        return self.columns[-1] if self.columns else None
+
+### END OF FILE ###
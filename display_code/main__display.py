@@ -11,10 +11,15 @@
 """
 import os
 import socket
+from collections import deque
 import threading
+import time
 import tkinter as tk
 from tkinter import ttk, font
 from queue import Queue
+import ipc
+import snapshot
+import history
 
 # Constants
 THEME_DIR_PATH = os.path.dirname(os.path.realpath(__file__))
@@ -23,10 +28,83 @@ UNIX_SOCKET_PATH = '/tmp/ipc_socket'
 INET_SOCKET_PATH = ('localhost', 9000)
 QUEUE = 5
 INTERVAL = 15  # in seconds for the socket timeout
-BUFFER_SIZE = 1024
+BUFFER_SIZE = 65536
 DEFAULT_DATA = ["none" for _ in range(19)]
+POLL_INTERVAL = 50  # in milliseconds, only used when the platform has no Tk file handler
+HUB_SOCKET_PATH = '/tmp/nepower_hub'  # publish/subscribe hub of main__Fusion.py, None to not subscribe
+HUB_RETRY = 3  # in seconds between two attempts to subscribe to the hub
+SNAPSHOT_NAME = None  # e.g. 'nepower_snapshot', poll the shared memory of main__Fusion.py instead of the hub
+SNAPSHOT_INTERVAL = 50  # in milliseconds between two checks of the snapshot sequence
+SNAPSHOT_TIMEOUT = 5  # in seconds without a new snapshot before attaching again (e.g. main__Fusion.py restarted)
+HISTORY_SECONDS = 600  # time window of the trend charts (in seconds)
+HISTORY_COLUMNS = 300  # min/max columns kept per parameter, each one covers HISTORY_SECONDS/HISTORY_COLUMNS seconds
 QUEUE = Queue()
 
+class TrendChart(tk.Canvas):
+    def __init__(self, master, trend, color='#d90429', text_color='white', **kwargs):
+        super().__init__(master, highlightthickness=0, **kwargs)
+        self.trend = trend
+        self.color = color
+        self.text_color = text_color
+        self.bars = deque()  # canvas item of each column of the history, same order
+        self.range = None  # (lowest, highest) value of the current y-axis
+        self.added = 0  # columns added since the last full redraw
+        self.bind('<Configure>', lambda event: self.redraw())
+
+    def add(self, stamp, value):
+        # Add a sample and only redraw what changed: the latest bar, or a shift by the new columns
+        previous = self.trend.latest()
+        result = self.trend.append(stamp, value)
+        if result is None or self.winfo_width() <= 1:
+            return
+        column = self.trend.latest()
+        if self.range is None or not (self.range[0] <= column[1] and column[2] <= self.range[1]):
+            self.redraw()  # out of the y-axis, rescale everything
+            return
+        if result == 'update':
+            self.coords(self.bars[-1], *self.get_bar(column, column[0]))
+            return
+        shift = column[0] - previous[0] if previous else 0
+        self.move('bar', -shift*self.get_step(), 0)
+        while len(self.bars) > len(self.trend.columns) - 1:
+            self.delete(self.bars.popleft())
+        self.bars.append(self.create_line(*self.get_bar(column, column[0]), fill=self.color, width=max(1, int(self.get_step())), tags='bar'))
+        self.added += 1
+        if self.added >= self.trend.size:
+            self.redraw()  # shrink the y-axis once the old extremes are gone
+
+    def get_step(self):
+        return self.winfo_width() / self.trend.size
+
+    def get_bar(self, column, latest):
+        # Vertical line from the min to the max of the column, the latest column is at the right edge
+        width, height = self.winfo_width(), self.winfo_height()
+        low, high = self.range
+        scale = (height - 4) / (high - low)
+        x = width - (latest - column[0] + 0.5) * self.get_step()
+        y_min = height - 2 - (column[1] - low) * scale
+        y_max = height - 2 - (column[2] - low) * scale
+        return x, y_min + 0.5, x, y_max - 0.5
+
+    def redraw(self):
+        # Draw every column again (resize, new y-axis)
+        self.delete('all')
+        self.bars.clear()
+        self.added = 0
+        bounds = self.trend.bounds()
+        if bounds is None or self.winfo_width() <= 1:
+            self.range = None
+            return
+        low, high = bounds
+        margin = (high - low) * 0.1 or abs(high) * 0.1 or 1
+        self.range = (low - margin, high + margin)
+        latest = self.trend.latest()[0]
+        width = max(1, int(self.get_step()))
+        for column in self.trend.columns:
+            self.bars.append(self.create_line(*self.get_bar(column, latest), fill=self.color, width=width, tags='bar'))
+        self.create_text(2, 2, text=f"{high:g}", anchor='nw', fill=self.text_color, font=('Helvetica', 7))
+        self.create_text(2, self.winfo_height() - 2, text=f"{low:g}", anchor='sw', fill=self.text_color, font=('Helvetica', 7))
+
 class StorageFrame(ttk.Frame):
     def __init__(self, master, data, frame_type='Default'): # If there are other arguments: (self, master, arg5, arg6)
         super().__init__(master)
@@ -45,6 +123,8 @@ class StorageFrame(ttk.Frame):
         self.time_vars = tk.StringVar()
         self.com_vars = []
         self.label_texts = []
+        self.rendered = {}  # text currently shown by each variable, only the changed ones are set again
+        self.trends = []  # (data index, TrendChart) of each displayed parameter
 
         #______________________________________________
 
@@ -111,6 +191,9 @@ class StorageFrame(ttk.Frame):
                     column_value = 0
             self.com_vars.append(vars)
 
+        # Trend chart of each displayed parameter, under the values
+        self.create_trends(default_font_fg)
+
         # Update the text of the labels with the provided data
         self.update_frame_data(data)
 
@@ -123,18 +206,45 @@ class StorageFrame(ttk.Frame):
         
             # Directly set the main component name to com_vars
             if len(self.com_vars[i]) > 0:
-                self.com_vars[i][0].set(f"{component} Parameter")
+                self.set_var(self.com_vars[i][0], f"{component} Parameter")
         
             # Set the parameter names and values
             for idx, (name, value) in enumerate(parameters):
                 if (2*idx + 1) < len(self.com_vars[i]):
-                    self.com_vars[i][2*idx + 1].set(name)
-                    self.com_vars[i][2*idx + 2].set(f"{data[value]}")
+                    self.set_var(self.com_vars[i][2*idx + 1], name)
+                    self.set_var(self.com_vars[i][2*idx + 2], f"{data[value]}")
                 else:
                     print(f"Warning: com_vars[{i}] does not have a position for indices {2*idx + 1} and {2*idx + 2}.")
 
         # Store the update Layout
-        self.time_vars.set(time_label_text)
+        self.set_var(self.time_vars, time_label_text)
+
+        # Add the values to the trend charts
+        stamp = time.monotonic()
+        for value, chart in self.trends:
+            chart.add(stamp, data[value])
+
+    def create_trends(self, text_color):
+        trend_frame = ttk.Frame(self)
+        trend_frame.grid(row=11, column=0, columnspan=5, pady=10, sticky='news')
+        self.grid_rowconfigure(11, weight=1)
+        position = 0
+        for component, details in self.configuration[f'{self.frame_type}']['components'].items():
+            for name, value in details['parameters']:
+                row, column = 2 * (position // 5), position % 5
+                tk.Label(trend_frame, text=f"{component} {name}", font=('Helvetica', 8), anchor='w').grid(row=row, column=column, sticky='ew')
+                chart = TrendChart(trend_frame, history.history(HISTORY_SECONDS, HISTORY_COLUMNS), text_color=text_color, height=50)
+                chart.grid(row=row+1, column=column, padx=4, pady=(0, 6), sticky='news')
+                trend_frame.grid_columnconfigure(column, weight=1)
+                self.trends.append((value, chart))
+                position += 1
+
+    def set_var(self, var, text):
+        # Only touch the widget when its text has changed since the previous update
+        name = str(var)
+        if self.rendered.get(name) != text:
+            self.rendered[name] = text
+            var.set(text)
 
     def frame_configuration(self):
         self.configuration = {
@@ -173,7 +283,7 @@ class StorageFrame(ttk.Frame):
             }
         }
 
-def socket_server_thread(data_queue):
+def socket_server_thread(data_queue, wake=None):
     # Only for AF_UNIX step
     if os.path.exists(UNIX_SOCKET_PATH):
         os.remove(UNIX_SOCKET_PATH)
@@ -189,23 +299,107 @@ def socket_server_thread(data_queue):
         while True:
             conn, _ = server_socket.accept()
             with conn:
+                # Each connection starts a new stream of frames, the schema (title) comes first
+                decoder = ipc.decoder()
                 while True:
-                    data = conn.recv(BUFFER_SIZE).decode('utf-8')
+                    data = conn.recv(BUFFER_SIZE)
                     if not data:
                         break
-                    data_list = data.split(',')
-                    data_queue.put(data_list)
+                    try:
+                        rows = decoder.feed(data)
+                    except ValueError as e:
+                        print(f"Error: invalid data from the socket, reconnecting. {e}")
+                        break
+                    for data_list in rows:
+                        data_queue.put(data_list)
+                    if rows:
+                        notify(wake)
     except socket.error as e:
         print(f"Error: socket setup failed. {e}")
         exit(1)  # Exit with an error code
     return server_socket
 
+def notify(wake):
+    # Wake the Tk main loop up, the write end is non-blocking so a busy display never stops the socket thread
+    if wake is None:
+        return
+    try:
+        os.write(wake, b'\x01')
+    except BlockingIOError:
+        pass  # the pipe is already full, the display is going to wake up anyway
+
 def update_frame_from_queue(data_queue, content_frame):
+    # Coalesce to the latest row, the older ones would be overwritten before being seen anyway
+    data_list = None
     while not data_queue.empty():
         data_list = data_queue.get_nowait()
-        # Assuming you have a method in StorageFrame to update data
+    if data_list is not None:
         content_frame.update_frame_data(data_list)
-    content_frame.after(1000, lambda: update_frame_from_queue(data_queue, content_frame))
+
+def watch_queue(data_queue, content_frame):
+    # Update the frame as soon as the socket thread signals a new row (within one Tk event)
+    wake_read, wake_write = os.pipe()
+    os.set_blocking(wake_write, False)
+
+    def handle_wake(fd, mask):
+        os.read(fd, BUFFER_SIZE)
+        update_frame_from_queue(data_queue, content_frame)
+
+    try:
+        content_frame.tk.createfilehandler(wake_read, tk.READABLE, handle_wake)
+    except (AttributeError, tk.TclError):
+        # No file handler on this platform (e.g. Windows), poll the queue instead
+        os.close(wake_read)
+        os.close(wake_write)
+        def poll():
+            update_frame_from_queue(data_queue, content_frame)
+            content_frame.after(POLL_INTERVAL, poll)
+        poll()
+        return None
+    return wake_write
+
+def hub_client_thread(data_queue, wake=None):
+    # Subscribe to the hub, the rows are pushed as soon as main__Fusion.py publishes them
+    while True:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(HUB_SOCKET_PATH)
+                sock.sendall(ipc.frame(ipc.SUBSCRIBE, b''))
+                decoder = ipc.decoder()
+                while True:
+                    data = sock.recv(BUFFER_SIZE)
+                    if not data:
+                        break
+                    rows = decoder.feed(data)
+                    for data_list in rows:
+                        data_queue.put(data_list)
+                    if rows:
+                        notify(wake)
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass  # the hub is not running (yet)
+        except (OSError, ValueError) as e:
+            print(f"Error: hub subscription failed, retrying. {e}")
+        time.sleep(HUB_RETRY)
+
+def watch_snapshot(name, content_frame, shared=None, stamp=None):
+    # Check the snapshot sequence (one header read) and render only what main__Fusion.py has published since
+    now = time.monotonic()
+    try:
+        if shared is None:
+            shared = snapshot.reader(name)
+            stamp = now
+        data_list = shared.read_if_changed()
+        if data_list is not None:
+            stamp = now
+            content_frame.update_frame_data(data_list)
+        elif now - stamp > SNAPSHOT_TIMEOUT:
+            # The writer may have created a new shared memory, attach again
+            shared.close()
+            shared = None
+    except FileNotFoundError:
+        shared = None  # main__Fusion.py is not running (yet)
+    interval = SNAPSHOT_INTERVAL if shared is not None else SNAPSHOT_TIMEOUT*1000
+    content_frame.after(interval, lambda: watch_snapshot(name, content_frame, shared, stamp))
 
 def main(root):
     content = StorageFrame(root, DEFAULT_DATA)
@@ -213,20 +407,26 @@ def main(root):
     root.grid_columnconfigure(0, weight=1)
     root.grid_rowconfigure(0, weight=1)
 
+    # Wake the GUI up from the socket thread for each received row
+    wake = watch_queue(QUEUE, content)
+
     # Start the socket communication thread
-    server_thread = threading.Thread(target=socket_server_thread, args=(QUEUE,), daemon=True)
+    server_thread = threading.Thread(target=socket_server_thread, args=(QUEUE, wake), daemon=True)
     server_thread.start()
 
-    # Schedule the first GUI update from the queue
-    update_frame_from_queue(QUEUE, content)
+    # Also subscribe to the hub and/or follow the shared-memory snapshot, whichever producer is running
+    if HUB_SOCKET_PATH:
+        hub_thread = threading.Thread(target=hub_client_thread, args=(QUEUE, wake), daemon=True)
+        hub_thread.start()
+    if SNAPSHOT_NAME:
+        watch_snapshot(SNAPSHOT_NAME, content)
 
     try:
         root.mainloop()
     finally:
         # Cleanup will happen here when mainloop exits
-        server_sock.close()
-        if os.path.exists(SOCKET_PATH):
-            os.remove(SOCKET_PATH)
+        if os.path.exists(UNIX_SOCKET_PATH):
+            os.remove(UNIX_SOCKET_PATH)
 
 if __name__ == "__main__":
     root = tk.Tk()
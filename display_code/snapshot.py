@@ -0,0 +1,134 @@
+"""
+#title           :snapshot.py
+#description     :latest measurement snapshot in shared memory, one writer and any number of lock-free readers
+#author          :Nicholas Putra Rihandoko, Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Energy Monitoring System, main__Fusion.py (writer) -> main__display.py and other local readers
+#notes           :keep the copy in display_code identical, the values are packed with the schema of ipc.py
+#python_version  :3.9.2
+#==============================================================================
+"""
+
+import logging
+import struct
+import time
+from multiprocessing import shared_memory, resource_tracker
+import ipc
+
+NAME = 'nepower_snapshot'
+SIZE = 1 << 16                  # size of the shared memory (in bytes)
+SCHEMA_SIZE = 1 << 14           # part of it reserved for the schema (title and kinds as JSON)
+RETRY = 100                     # attempts of a reader while the writer is updating the snapshot
+# Header: sequence (odd while the writer is updating), schema generation, schema length, data length
+HEADER = struct.Struct('=QQII')
+SEQUENCE = struct.Struct('=Q')
+"""
+Seqlock: the writer makes the sequence odd, writes the schema and data, then makes it even again.
+A reader copies the bytes between two reads of the sequence and retries if it was odd or has changed,
+so the writer never waits for the readers and a reader never sees half of an update.
+"""
+
+class writer:
+    def __init__(self,name=NAME,size=SIZE):
+        try:
+            # Leftover of a previous run that did not exit cleanly
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+        except FileNotFoundError:
+            pass
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._buffer = self._shm.buf
+        self._layout = None
+        self._generation = 0
+        self._sequence = 0
+        self._dropping = False      # the previous row was too long, only the first one of a series is logged
+        self.stats = {"published": 0, "dropped": 0}
+        HEADER.pack_into(self._buffer, 0, 0, 0, 0, 0)
+
+    def publish(self,title,data):
+        # Replace the snapshot by this row (title from data_processing), never blocks
+        # A row that does not fit is dropped (the readers keep the previous one), returns False
+        kinds = ''.join(ipc.get_kind(v) for v in data)
+        schema = None
+        current = self._layout
+        if current is None or current.kinds != kinds or current.title != title:
+            current = ipc.layout((self._generation + 1) & 0xFFFF, title, kinds)
+            schema = current.to_json()
+            if HEADER.size + len(schema) > SCHEMA_SIZE: return self.drop("schema", len(schema))
+        payload = current.pack(data)
+        if HEADER.size + SCHEMA_SIZE + len(payload) > len(self._buffer): return self.drop("data", len(payload))
+        if schema is not None:
+            self._generation += 1
+            self._layout = current
+        buffer = self._buffer
+        self._sequence += 1
+        SEQUENCE.pack_into(buffer, 0, self._sequence)
+        if schema is not None:
+            buffer[HEADER.size:HEADER.size+len(schema)] = schema
+            struct.pack_into('=QI', buffer, 8, self._generation, len(schema))
+        buffer[HEADER.size+SCHEMA_SIZE:HEADER.size+SCHEMA_SIZE+len(payload)] = payload
+        struct.pack_into('=I', buffer, 20, len(payload))
+        self._sequence += 1
+        SEQUENCE.pack_into(buffer, 0, self._sequence)
+        self._dropping = False
+        self.stats["published"] += 1
+        return True
+
+    def drop(self,part,size):
+        self.stats["dropped"] += 1
+        if not self._dropping:
+            logging.warning("(snapshot) row dropped, its %s (%d bytes) does not fit in the shared memory, increase its size", part, size)
+        self._dropping = True
+        return False
+
+    def close(self):
+        self._buffer = None
+        self._shm.close()
+        self._shm.unlink()
+
+class reader:
+    def __init__(self,name=NAME):
+        # Raise FileNotFoundError if the writer has not started yet
+        self._shm = shared_memory.SharedMemory(name=name)
+        # Only the writer owns the shared memory, a reader must not remove it at exit (Python < 3.13)
+        try: resource_tracker.unregister(self._shm._name, 'shared_memory')
+        except Exception: pass
+        self._buffer = self._shm.buf
+        self._layout = None
+        self._generation = None
+        self.sequence = 0           # sequence of the latest read snapshot
+        self.title = None
+
+    def read(self):
+        # Latest snapshot as a list of values (order of self.title), None if nothing is published yet
+        buffer = self._buffer
+        for _ in range(RETRY):
+            sequence, generation, schema_size, data_size = HEADER.unpack_from(buffer, 0)
+            if sequence & 1:
+                time.sleep(0)       # the writer is updating, let it finish
+                continue
+            if sequence == 0: return None
+            current = self._layout
+            if generation != self._generation:
+                schema = bytes(buffer[HEADER.size:HEADER.size+schema_size])
+            payload = bytes(buffer[HEADER.size+SCHEMA_SIZE:HEADER.size+SCHEMA_SIZE+data_size])
+            if SEQUENCE.unpack_from(buffer, 0)[0] != sequence: continue
+            if generation != self._generation:
+                current = ipc.from_json(schema)
+                self._layout, self._generation, self.title = current, generation, current.title
+            self.sequence = sequence
+            return current.unpack(payload)
+        return None
+
+    def read_if_changed(self):
+        # Only read when the writer has published since the previous read, checking costs one header read
+        if SEQUENCE.unpack_from(self._buffer, 0)[0] == self.sequence: return None
+        return self.read()
+
+    def close(self):
+        self._buffer = None
+        self._shm.close()
+
+### END OF FILE ###
@@ -62,6 +62,22 @@ io.on("connection", (socket) => {
          // Send received location data in "location-next" event in order to be received by angular app client
       io.emit("gps-then",payload)
 
+      });
+      // Listen to the fixes buffered by the raspberry pi client while it was disconnected
+      // payload: {id, vehicleName, t, lat, lon}, first value then differences, position in 1e-7 degree
+      socket.on("gps-track", (data, ack) => {
+        payload = JSON.parse(data)
+        let t = 0, lat = 0, lon = 0
+        const points = payload.t.map((dt, i) => {
+          t += dt
+          lat += payload.lat[i]
+          lon += payload.lon[i]
+          return {time: t, latitude: lat / 1e7, longitude: lon / 1e7}
+        })
+        console.log("car id : " + payload.id + ", " + points.length + " buffered points")
+        io.emit("gps-track-then", {id: payload.id, vehicleName: payload.vehicleName, points: points})
+        // Acknowledge the batch, the client removes it from its buffer
+        if (typeof ack === "function") ack(points.length)
       });
       socket.on("dellist", payload => {
 
@@ -3,7 +3,7 @@
 #description     :AT command for GNSS configuration script
 #author          :Nicholas Putra Rihandoko
 #date            :2023/06/21
-#version         :1.2
+#version         :1.3
 #usage           :Iot Gateway
 #notes           :
 #python_version  :3.7.3
@@ -32,6 +32,11 @@ def send_at(command,expect,wait):
     else:
         print(rec_buff.decode())
 
+# Unsolicited NMEA output of the SIM7600
+nmea_config = 31    # GGA, RMC, GSV, GSA, and VTG
+nmea_rate   = 0     # 0 = 1 Hz, 1 = 10 Hz
+nmea_period = 1     # period of the AT+CGPSINFOCFG report (in seconds)
+
 if sys.argv[1] == "SIM7600":
     # Connect through serial communication to the SIM Card
     port_id = 'SimTech__Incorporated_SimTech__Incorporated_0123456789ABCDEF-if02' # for SIM7600G-H module
@@ -40,6 +45,12 @@ if sys.argv[1] == "SIM7600":
 
     # Access GPS session
     send_at('AT+CGPS=0','OK',5)
+
+    # NMEA sentences on the NMEA port (bit 0 GGA, 1 RMC, 2 GSV, 3 GSA, 4 VTG), read by the streaming reader of main__gps.py
+    send_at('AT+CGPSNMEA={}'.format(nmea_config),'OK',1)
+
+    # NMEA output rate, 0 = 1 Hz, 1 = 10 Hz (only accepted while the GPS session is stopped)
+    send_at('AT+CGPSNMEARATE={}'.format(nmea_rate),'OK',1)
     
     # Start GPS session
     send_at('AT+CGPS=1','OK',1)
@@ -53,6 +64,9 @@ if sys.argv[1] == "SIM7600":
     # Download XTRA assistant file automatically
     send_at('AT+CGPSXDAUTO=1','OK',1)
 
+    # Report the NMEA sentences by itself every 'nmea_period' seconds, no AT request is needed for each fix
+    send_at('AT+CGPSINFOCFG={},{}'.format(nmea_period,nmea_config),'OK',1)
+
     sim.close()
     
 else:
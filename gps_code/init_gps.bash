@@ -56,6 +56,7 @@ sudo apt install python3-pip -y
 # Install the necessary python library
 sudo apt install python3-socketio -y
 sudo apt install python3-websocket -y
+sudo apt install python3-aiohttp -y
 sudo apt install python3-pymysql -y
 # 'zerotier' for virtual LAN and remote access
 sudo apt install curl nmap -y
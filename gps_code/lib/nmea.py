@@ -0,0 +1,181 @@
+"""
+#title           :nmea.py
+#description     :Streaming NMEA 0183 parser and serial reader thread of the GNSS modules
+#author          :Nicholas Putra Rihandoko
+#date            :2024/03/11
+#version         :1.0
+#usage           :Iot Gateway
+#notes           :handles GGA, RMC, VTG, and GSA of every talker (GP, GN, GL, GA, BD), other sentences are counted and skipped
+#python_version  :3.7.3
+#==============================================================================
+"""
+
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import datetime
+import threading
+import time
+
+MAX_LINE = 256  # longer lines are noise on the serial port (an NMEA sentence is at most 82 characters)
+
+def checksum(body):
+    # XOR of every character between '$' and '*'
+    value = 0
+    for byte in body: value ^= byte
+    return value
+
+def to_degree(value,hemisphere):
+    # Convert (d)ddmm.mmmm and N/S/E/W into signed decimal degrees
+    if not value: return None
+    dot = value.index('.') if '.' in value else len(value)
+    degree = float(value[:dot-2]) + float(value[dot-2:])/60
+    return round(-degree if hemisphere in ('S','W') else degree, 7)
+
+def to_time(value):
+    # Convert hhmmss(.ss) into a time object
+    if len(value) < 6: return None
+    return datetime.time(int(value[0:2]), int(value[2:4]), int(value[4:6]))
+
+def to_float(value):
+    return float(value) if value else None
+
+class parser:
+    def __init__(self):
+        self._buffer = bytearray()
+        self._date = None           # date of the latest RMC, GGA only has the time
+        self.fix = {"latitude": None, "longitude": None, "altitude": None, "time": None,
+                    "quality": 0, "satellites": 0, "hdop": None, "pdop": None, "vdop": None,
+                    "mode": 1, "valid": False, "speed": None, "course": None, "stamp": None}
+        self.count = {"sentences": 0, "errors": 0, "skipped": 0}
+        self._handlers = {"GGA": self.parse_gga, "RMC": self.parse_rmc, "VTG": self.parse_vtg, "GSA": self.parse_gsa}
+
+    def feed(self,data):
+        # Add the received bytes, every complete line is parsed right away, the rest waits for the next bytes
+        self._buffer += data
+        lines = self._buffer.split(b'\n')
+        self._buffer = lines.pop()
+        if len(self._buffer) > MAX_LINE: self._buffer = bytearray()
+        for line in lines: self.parse_line(line.strip())
+
+    def parse_line(self,line):
+        # Verify and decode one line, return the sentence type or None
+        start = line.find(b'$')
+        if start < 0: return None
+        line = line[start+1:]
+        star = line.rfind(b'*')
+        if star < 0 or len(line) < star + 3:
+            self.count["errors"] += 1
+            return None
+        body = line[:star]
+        try: valid = int(line[star+1:star+3], 16) == checksum(body)
+        except ValueError: valid = False
+        if not valid:
+            self.count["errors"] += 1
+            return None
+        fields = body.decode('ascii', errors='replace').split(',')
+        # Talker ID is 2 characters (GP, GN, ...) followed by the sentence type
+        kind = fields[0][2:]
+        handler = self._handlers.get(kind)
+        if handler is None:
+            self.count["skipped"] += 1
+            return None
+        try: handler(fields)
+        except (ValueError, IndexError):
+            self.count["errors"] += 1
+            return None
+        self.count["sentences"] += 1
+        self.fix["stamp"] = time.monotonic()
+        return kind
+
+    def set_time(self,value):
+        # The time is only kept as a full datetime, so it stays None until an RMC has given the date
+        clock = to_time(value)
+        if clock is None or self._date is None: return
+        self.fix["time"] = datetime.datetime.combine(self._date, clock)
+
+    def parse_gga(self,fields):
+        # $xxGGA,time,lat,N/S,lon,E/W,quality,satellites,HDOP,altitude,M,geoid,M,age,station*cs
+        fix = self.fix
+        fix["quality"] = int(fields[6] or 0)
+        fix["satellites"] = int(fields[7] or 0)
+        fix["hdop"] = to_float(fields[8])
+        self.set_time(fields[1])
+        if fix["quality"] == 0:
+            fix["valid"] = False
+            return
+        fix["latitude"] = to_degree(fields[2], fields[3])
+        fix["longitude"] = to_degree(fields[4], fields[5])
+        fix["altitude"] = to_float(fields[9])
+        fix["valid"] = fix["latitude"] is not None and fix["longitude"] is not None
+
+    def parse_rmc(self,fields):
+        # $xxRMC,time,A/V,lat,N/S,lon,E/W,speed(knot),course,ddmmyy,variation,E/W,mode*cs
+        fix = self.fix
+        if fields[9]: self._date = datetime.datetime.strptime(fields[9], '%d%m%y').date()
+        self.set_time(fields[1])
+        if fields[2] != 'A':
+            fix["valid"] = False
+            return
+        fix["latitude"] = to_degree(fields[3], fields[4])
+        fix["longitude"] = to_degree(fields[5], fields[6])
+        if fields[7]: fix["speed"] = round(float(fields[7])*1.852, 3)
+        if fields[8]: fix["course"] = float(fields[8])
+        fix["valid"] = fix["latitude"] is not None and fix["longitude"] is not None
+
+    def parse_vtg(self,fields):
+        # $xxVTG,course,T,course(magnetic),M,speed(knot),N,speed(km/h),K,mode*cs
+        if fields[1]: self.fix["course"] = float(fields[1])
+        if fields[7]: self.fix["speed"] = float(fields[7])
+
+    def parse_gsa(self,fields):
+        # $xxGSA,A/M,mode(1 = no fix, 2 = 2D, 3 = 3D),12 satellite IDs,PDOP,HDOP,VDOP(,system ID)*cs
+        self.fix["mode"] = int(fields[2] or 1)
+        self.fix["pdop"] = to_float(fields[15])
+        self.fix["hdop"] = to_float(fields[16])
+        self.fix["vdop"] = to_float(fields[17])
+
+class reader:
+    def __init__(self,ser,parser,name='GNSS'):
+        self._ser = ser
+        self._parser = parser
+        self._name = name
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # Read the serial port in a background thread, the latest fix is kept by the parser
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None: self._thread.join(2)
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                # Block for the first byte (up to the serial timeout), then take everything already received
+                data = self._ser.read(1)
+                if data: data += self._ser.read(self._ser.in_waiting)
+            except Exception as e:
+                print("problem with GPS serial port :")
+                print(e)
+                print("<===== ===== retrying ===== =====>")
+                print("")
+                self._stop.wait(3)
+                try:
+                    self._ser.close()
+                    self._ser.open()
+                except Exception: pass
+                continue
+            if data:
+                with self._lock: self._parser.feed(data)
+
+    def get_fix(self):
+        # Copy of the latest fix, does not wait for the serial port
+        with self._lock: return dict(self._parser.fix)
+
+### END OF FILE ###
@@ -0,0 +1,102 @@
+"""
+#title           :track.py
+#description     :GPS track buffer with thinning and compact batches for Socket.IO
+#author          :Nicholas Putra Rihandoko
+#date            :2024/03/11
+#version         :1.0
+#usage           :Iot Gateway
+#notes           :the fixes are kept while the Socket.IO server cannot be reached, then sent in batches
+#python_version  :3.7.3
+#==============================================================================
+"""
+
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import collections
+import math
+
+EARTH_RADIUS = 6371000  # in meter
+
+def distance(a,b):
+    # Distance between two points (latitude, longitude) in meter, equirectangular approximation (enough for a few km)
+    x = math.radians(b[1] - a[1]) * math.cos(math.radians((a[0] + b[0])/2))
+    y = math.radians(b[0] - a[0])
+    return EARTH_RADIUS * math.hypot(x, y)
+
+def simplify(points,tolerance):
+    # Douglas-Peucker: keep the points further than the tolerance (in meter) from the line of their neighbours
+    # points: [(time, latitude, longitude), ...], return the kept points in the same order
+    if len(points) < 3 or tolerance <= 0: return list(points)
+    # Project into meters around the first point
+    scale = math.cos(math.radians(points[0][1]))
+    xy = [(math.radians(p[2])*scale*EARTH_RADIUS, math.radians(p[1])*EARTH_RADIUS) for p in points]
+    keep = [False]*len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = xy[first], xy[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        index, farthest = None, tolerance
+        for i in range(first + 1, last):
+            x, y = xy[i]
+            if length: d = abs(dy*(x - x1) - dx*(y - y1)) / length
+            else: d = math.hypot(x - x1, y - y1)
+            if d > farthest: index, farthest = i, d
+        if index is not None:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+class track:
+    def __init__(self,min_distance=5,max_interval=60,tolerance=5,limit=86400):
+        self._min_distance = min_distance   # a fix closer than this (in meter) to the previous one is skipped,
+        self._max_interval = max_interval   # unless the previous one is older than this (in seconds)
+        self._tolerance = tolerance         # Douglas-Peucker tolerance of a batch (in meter)
+        self._points = collections.deque(maxlen=limit)  # oldest fixes are dropped after 'limit' points
+        self._last = None
+        self.count = {"received": 0, "kept": 0, "sent": 0}
+
+    def __len__(self):
+        return len(self._points)
+
+    def append(self,stamp,latitude,longitude):
+        # Keep a fix (time in seconds, position in degrees) if it moved enough or enough time has passed
+        self.count["received"] += 1
+        if latitude is None or longitude is None: return False
+        point = (int(stamp), latitude, longitude)
+        last = self._last
+        if last is not None and point[0] - last[0] < self._max_interval \
+                and distance(last[1:], point[1:]) < self._min_distance:
+            return False
+        self._points.append(point)
+        self._last = point
+        self.count["kept"] += 1
+        return True
+
+    def peek(self,size=500):
+        # Oldest buffered points, simplified, as a batch: (number of buffered points it covers, points)
+        count = min(size, len(self._points))
+        points = [self._points[i] for i in range(count)]
+        return count, simplify(points, self._tolerance)
+
+    def remove(self,count):
+        # Forget the points of a batch once the server has received it
+        for _ in range(count): self._points.popleft()
+        self.count["sent"] += count
+
+def encode(points,**header):
+    # Compact batch: first value then differences, position in 1e-7 degree (same precision as the decoder)
+    payload = dict(header)
+    t = [p[0] for p in points]
+    lat = [int(round(p[1]*1e7)) for p in points]
+    lon = [int(round(p[2]*1e7)) for p in points]
+    payload["t"] = t[:1] + [b - a for a, b in zip(t, t[1:])]
+    payload["lat"] = lat[:1] + [b - a for a, b in zip(lat, lat[1:])]
+    payload["lon"] = lon[:1] + [b - a for a, b in zip(lon, lon[1:])]
+    return payload
+
+### END OF FILE ###
@@ -3,7 +3,7 @@
 #description     :
 #author          :Nicholas Putra Rihandoko
 #date            :2023/05/08
-#version         :0.1
+#version         :0.2
 #usage           :
 #notes           :
 #python_version  :3.7.3
@@ -11,18 +11,21 @@
 """
 
 # Import library
+import asyncio
 import datetime
+import random
 import time
 import query
 import socketio
 import json
 import os
 import sys
+from lib import track
 
 # Define GPS port
 if sys.argv[1] == "SIM7600":
     from lib import SIM7600_GNSS as gnss
-    port_id = 'SimTech__Incorporated_SimTech__Incorporated_0123456789ABCDEF-if02' # for SIM7600 GPS module
+    port_id = 'SimTech__Incorporated_SimTech__Incorporated_0123456789ABCDEF-if01' # NMEA port of the SIM7600 GPS module (configured by gnss_config.py)
 elif sys.argv[1] == "SE100":
     from lib import SE100_GNSS as gnss
     port_id = '/dev/ttyAMA0' # for SE100 GPS module using RaspberryPi's RX-TX (UART) pinout
@@ -46,24 +49,105 @@ sio_payload = {"id": 1,
                     "vehicleName": "Car A"
                 }}
 
+# Define the track buffer, the fixes are kept while the Socket.IO server cannot be reached
+gps_track = track.track(min_distance=5, max_interval=60, tolerance=5)
+track_batch = 500   # maximum number of fixes of each "gps-track" event, one batch is sent each loop
+track_timeout = 5   # waiting time for the server to acknowledge a batch (in seconds)
+backoff = [1, 60]   # first and longest waiting time between the reconnection attempts (in seconds)
+
 #debug.debugging()
 init = True  # variable to check modbus & mysql initialization
-sio = socketio.Client()
+# The reconnection is done by maintain_connection(), so it never waits on the GNSS reading
+sio = socketio.AsyncClient(reconnection=False)
+gps = None
+latest = {"payload": None, "fix": None}    # latest live fix, waiting for send_gps()
 
 @sio.event
-def connect():
-    sio.emit("init","Connection Established")
+async def connect():
+    await sio.emit("init","Connection Established")
     print("Connection Established")
 
 @sio.event
-def disconnect():
+async def disconnect():
     print("Disconnected")
 
+async def maintain_connection():
+    # Connect, wait until the connection ends, then retry with an exponential backoff (with jitter)
+    wait = backoff[0]
+    while True:
+        try:
+            await sio.connect(sio_server)
+            wait = backoff[0]
+            await sio.wait()
+            # Reset the client state before the next attempt
+            await sio.disconnect()
+        except Exception as e:
+            await sio.disconnect()
+            print(f'Error connecting to Socket.IO server: {e}')
+            print("<===== ===== retrying in {:.1f} s ===== =====>".format(wait))
+            print("")
+            await asyncio.sleep(wait * random.uniform(0.8, 1.2))
+            wait = min(wait*2, backoff[1])
+
+async def read_gnss(ready):
+    # Take the latest fix every interval, the GNSS module is read by a background thread
+    while True:
+        try:
+            timer = datetime.datetime.now()
+            gps.read_gps()
+            fresh = gps.Status in ("Good GPS Accuracy", "Poor GPS Accuracy")
+            # The previous fix is not sent yet (slow server), keep it in the track
+            if ready.is_set() and latest["fix"]: gps_track.append(*latest["fix"])
+            sio_payload["data"]["latitude"] = gps.Latitude
+            sio_payload["data"]["longitude"] = gps.Longitude
+            sio_payload["data"]["status"] = gps.Status
+            latest["payload"] = json.dumps(sio_payload)
+            latest["fix"] = (time.time(), gps.Latitude, gps.Longitude) if fresh else None
+            ready.set()
+        except Exception as e:
+            # Print the error message
+            print(e)
+            print("<===== ===== retrying ===== =====>")
+            print("")
+        await asyncio.sleep(interval)
+
+async def send_gps(ready):
+    # Send the latest fix to the Socket.IO server, or keep it in the track until the connection is back
+    while True:
+        await ready.wait()
+        ready.clear()
+        payload, fix = latest["payload"], latest["fix"]
+        if not sio.connected:
+            if fix: gps_track.append(*fix)
+            continue
+        try:
+            await sio.emit("gps",payload)
+        except Exception as e:
+            print(f'Error connecting to Socket.IO server: {e}')
+            if fix: gps_track.append(*fix)
+
+async def send_track():
+    # Send the oldest buffered fixes as compact batches, they are removed only once the server acknowledges it
+    while True:
+        if sio.connected and len(gps_track):
+            count, points = gps_track.peek(track_batch)
+            payload = track.encode(points, id=sio_payload["id"], vehicleName=sio_payload["data"]["vehicleName"])
+            try:
+                await sio.call("gps-track", json.dumps(payload, separators=(',',':')), timeout=track_timeout)
+                gps_track.remove(count)
+                print("-- {} buffered fixes sent in {} points, {} left --".format(count, len(points), len(gps_track)))
+            except Exception as e:
+                print(f'Error sending the GPS track: {e}')
+        await asyncio.sleep(interval)
+
+async def main():
+    ready = asyncio.Event()
+    await asyncio.gather(maintain_connection(), read_gnss(ready), send_gps(ready), send_track())
+
 # Checking the GPS connection
 while init:
     try:
         gps = gnss.node(gps_port, sio_payload["data"]["vehicleName"])
-        sio.connect(sio_server)
         print("<===== GPS Initialized =====>")
         print("")
         init = False
@@ -75,29 +159,6 @@ while init:
         print("")
         time.sleep(3)
 
-# Main loop
+# Main loop, reading the GNSS, sending the fixes, and reconnecting run concurrently
 start = datetime.datetime.now() # time counter
-while not init:
-    try:
-        # Send the command to read the measured value
-        timer = datetime.datetime.now()
-        gps.read_gps()
-
-        # Send to the Socket.IO server
-        try:
-            sio_payload["data"]["latitude"] = gps.Latitude
-            sio_payload["data"]["longitude"] = gps.Longitude
-            sio_payload["data"]["status"] = gps.Status
-            sio.emit("gps",json.dumps(sio_payload))
-        except Exception as e:
-            # Handle incoming events or perform other operations
-            print(f'Error connecting to Socket.IO server: {e}')
-
-        time.sleep(interval)
-
-    except Exception as e:
-        # Print the error message
-        print(e)
-        print("<===== ===== retrying ===== =====>")
-        print("")
-        time.sleep(3)
+asyncio.run(main())
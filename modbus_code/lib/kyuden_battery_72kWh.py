@@ -10,6 +10,14 @@
 #==============================================================================
 """
 import time
+import logging
+try:
+    from pymodbus.exceptions import ModbusException
+except ImportError:
+    ModbusException = OSError   # pymodbus is not installed, e.g. with the simulated client (simulator.py)
+
+# Warnings of the reading sequence go through logging, so the main program decides where (and whether) they are written
+logger = logging.getLogger(__name__)
 
 # FUNCTION CODE PYMODBUS SYNTAX
 # 0x03 (3) = read_holding_registers
@@ -20,7 +28,7 @@ import time
 # the memory addresses are in 1 hex increment
 
 class node:
-    def __init__(self,slave,name,client,delay=200,max_count=20,increment=1,shift=0):
+    def __init__(self,slave,name,client,delay=200,max_count=20,increment=1,shift=0,max_failure=3,backoff=5,max_backoff=300):
         self._name                      = name
         self._slave                     = slave
         self._client                    = client
@@ -28,6 +36,13 @@ class node:
         self._max_count                 = max_count     # maximum read/write address count in a single command
         self._shift                     = shift         # address shift
         self._inc                       = increment     # address increment
+        self._max_failure               = max_failure   # consecutive failed commands before the node is considered offline
+        self._backoff                   = backoff       # first waiting time before probing an offline node (in seconds)
+        self._max_backoff               = max_backoff   # longest waiting time before probing an offline node (in seconds)
+        # Communication health state of the node, used to avoid stalling the port with an offline node
+        self._health = {"state":"online", "failures":0, "last_success":None, "backoff":0, "next_probe":0}
+        # Cumulative communication counters of the node (read by the instrumentation in main program)
+        self._stats = {"commands":0, "failures":0, "skipped":0}
         # Commands and memory address that are available/configured, add if needed
         self._memory_dict = {
             ## Read Status (bit Type) (Don't have "scale", "bias", and "round")
@@ -517,10 +532,10 @@ class node:
         # If the address is not available in the library, then use it as is
         for a in raw_address:
             if isinstance(a,str):
-                print(" -- unrecognized address for '{}' --".format(a))
+                logger.warning(" -- unrecognized address for '%s' --", a)
             else:
                 address.append(a); save.append('Hx'+hex(a)[2:].zfill(4).upper())
-                print(" -- address '{}' may gives raw data, use with discretion --".format(save[-1]))
+                logger.warning(" -- address '%s' may gives raw data, use with discretion --", save[-1])
 
         # Divide the address to be read into several command based on max_count
         address, save = zip(*sorted(zip(address, save)))
@@ -537,28 +552,67 @@ class node:
         if temp_addr: final_addr.append(temp_addr); final_save.append(temp_save)
         return fcr, final_addr, final_save
 
+    def check_health(self):
+        # Check whether a command can be sent to the node (probe an offline node once its backoff is over)
+        if self._health["state"] == "online": return True
+        if self._health["state"] == "offline" and time.monotonic() >= self._health["next_probe"]:
+            self._health["state"] = "probing"
+            return True
+        return False
+
+    def handle_health(self,succeed):
+        # Update the communication health state based on the result of the last command
+        self._stats["commands"] += 1
+        if succeed:
+            if self._health["state"] != "online":
+                logger.info(" -- %s is back online --", self._name)
+            self._health.update({"state":"online", "failures":0, "last_success":time.time(), "backoff":0})
+        else:
+            self._stats["failures"] += 1
+            self._health["failures"] += 1
+            if self._health["state"] == "probing" or self._health["failures"] >= self._max_failure:
+                # Double the waiting time for every failed probe (exponential backoff)
+                backoff = min(self._health["backoff"]*2 if self._health["backoff"] else self._backoff, self._max_backoff)
+                self._health.update({"state":"offline", "backoff":backoff, "next_probe":time.monotonic()+backoff})
+                logger.warning(" -- %s is not responding, next probe in %s seconds --", self._name, backoff)
+
+    def handle_response(self,response,address,save):
+        # Save the read registers, or dummy data when the slave did not answer or answered with an exception
+        if response is not None and not response.isError():
+            self.save_read(self.handle_sign(response.registers), save)
+            self.handle_health(True)
+            return
+        dummy_registers = [None]*(address[-1]-address[0]+self._inc)
+        self.save_read(self.handle_sign(dummy_registers), save)
+        # An exception response (e.g. illegal address) comes from a responsive slave, only a missing response is a failure
+        self.handle_health(getattr(response, "exception_code", None) is not None)
+
     def reading_sequence(self,fcr,address):
         response = None
         fcr, addr, save = self.count_address(fcr,address)            
         # Send the command and read response with function_code 0x03 (3) or 0x04 (4)
         for i, a in enumerate(addr):
+            if not self.check_health():
+                # Skip the bus while the node is offline, fill the values with dummy data
+                self._stats["skipped"] += 1
+                dummy_registers = [None]*(a[-1]-a[0]+self._inc)
+                self.save_read(self.handle_sign(dummy_registers), save[i])
+                continue
             if fcr == 0x03:
                 try:
                     response = self._client.read_holding_registers(address=a[0], count=a[-1]-a[0]+self._inc, slave=self._slave)
-                    self.save_read(self.handle_sign(response.registers),save[i])
-                except: # For avoid error because of None data
-                    dummy_registers = [None]*(a[-1]-a[0]+self._inc) #len(addr)
-                    self.save_read(self.handle_sign(dummy_registers), save[i])
+                except (ModbusException, OSError): # No response, or problem with the serial port
+                    response = None
+                self.handle_response(response, a, save[i])
                 time.sleep(self._client_transmission_delay)
             elif fcr == 0x04:
                 try:
                     response = self._client.read_input_registers(address=a[0], count=a[-1]-a[0]+self._inc, slave=self._slave)
-                    self.save_read(self.handle_sign(response.registers),save[i])
-                except: # For avoid error because of None data
-                    dummy_registers = [None]*(a[-1]-a[0]+self._inc) #len(addr)
-                    self.save_read(self.handle_sign(dummy_registers), save[i])
+                except (ModbusException, OSError): # No response, or problem with the serial port
+                    response = None
+                self.handle_response(response, a, save[i])
                 time.sleep(self._client_transmission_delay)
-            else: print(" -- function code needs to be declared for this list of read address --")
+            else: logger.warning(" -- function code needs to be declared for this list of read address --")
         self.handle_extra_calculation()
         return response
             
@@ -0,0 +1,172 @@
+"""
+#title           :simulator.py
+#description     :in-process Modbus RTU slave simulator for the Modbus node libraries
+#author          :Nicholas Putra Rihandoko, Nauval Chantika
+#date            :2024/03/11
+#version         :1.0
+#usage           :Energy Monitoring System, testing and benchmarking without Modbus devices
+#notes           :replaces pymodbus ModbusSerialClient, serves the _memory_dict of each node
+#python_version  :3.9.2
+#==============================================================================
+"""
+import time
+import random
+import threading
+
+# FUNCTION CODE PYMODBUS SYNTAX (served by the simulator)
+# 0x03 (3) = read_holding_registers
+# 0x04 (4) = read_input_registers
+# 0x06 (6) = write_register
+# 0x10 (16) = write_registers
+
+# Realistic values of the parameters read by main__Fusion and main__modbus, used when no values are given
+# key: name of the node library module, value: {parameter name: engineering value or function of elapsed time}
+PROFILE = {
+    "kyuden_battery_72kWh": {"SOC":80, "Total_Voltage":441.6, "Cell_Voltage_avg":2.3, "Temperature_avg":25},
+    "yaskawa_D1000":        {"DC_Voltage_Command":350, "AC_Voltage":200, "AC_Current":12.5, "DC_Power":4.2, "AC_Frequency":60,
+                             "Power_Factor":0.98, "AC_Power":4.3, "Consumed_Power_kWh":1200, "Produced_Power_kWh":3400},
+    "yaskawa_GA500":        {"Output_Frequency":50, "Output_Current":10.5, "Output_Voltage":200, "DC_Bus_Voltage":300},
+    "tristar_MPPT":         {"V_PU_hi":180, "V_PU_lo":0, "I_PU_hi":80, "I_PU_lo":0},
+    "omron_KMN1FLK":        {"Voltage_1":200, "Current_1":5, "Active_Power":1000, "Generated_Active_Energy_kWh":150},
+    "omron_KM50C1FLK":      {"Voltage_1":200, "Current_1":5, "Active_Power":1000}
+    }
+
+class register_response:
+    # Successful read/write response, follows the attributes of pymodbus responses
+    def __init__(self,function_code,address,registers):
+        self.function_code  = function_code
+        self.address        = address
+        self.registers      = registers
+
+    def isError(self):
+        return False
+
+    def __str__(self):
+        return "SimulatedResponse (fc={}, address={}, count={})".format(self.function_code, self.address, len(self.registers))
+
+class error_response:
+    # Exception or missing response, has no registers so the node libraries handle it as a failed command
+    def __init__(self,function_code,message,exception_code=None):
+        self.function_code  = function_code
+        self.exception_code = exception_code
+        self.message        = message
+
+    def isError(self):
+        return True
+
+    def __str__(self):
+        return "SimulatedError (fc={}): {}".format(self.function_code, self.message)
+
+class device:
+    def __init__(self,node,values=None,latency=5,fault=None,seed=None):
+        self._name      = node._name
+        self._slave     = node._slave
+        self._inc       = node._inc                 # register count of each parameter
+        self._latency   = latency/1000              # processing time of the slave before replying (in seconds)
+        self._fault     = {"timeout":0, "exception":0}
+        self._fault.update(fault or {})             # probability of each fault for every request
+        self._random    = random.Random(seed)
+        self._start     = time.monotonic()
+        self.offline    = False                     # set to True to simulate a disconnected slave
+        # Copy the register map of the node library, the address already includes the address shift
+        self._memory_dict = {key: dict(value) for key, value in node._memory_dict.items() if value.get("address") is not None}
+        self._address_dict = {value["address"]: key for key, value in self._memory_dict.items()}
+        self._registers = {}                        # raw register values (address: 16-bit word)
+        profile = PROFILE.get(type(node).__module__.split('.')[-1], {})
+        self._values = dict(profile) if values is None else dict(values)
+        for key in self._memory_dict: self.set_value(key, self._values.get(key, 0))
+
+    def encode(self,key,value):
+        # Convert engineering value into raw register words (reverse of save_read and handle_sign)
+        param = self._memory_dict[key]
+        scale, bias = param.get("scale", 1), param.get("bias", 0)
+        raw = int(round((value - bias) / scale)) if scale else int(value)
+        raw &= (1 << (16*self._inc)) - 1    # 2's complement for negative values
+        return [(raw >> (16*w)) & 0xFFFF for w in range(self._inc-1,-1,-1)]
+
+    def set_value(self,key,value):
+        # Store the value of the parameter, a function of elapsed time (in seconds) is evaluated on every read
+        self._values[key] = value
+        if not callable(value): self.write_raw(self._memory_dict[key]["address"], self.encode(key, value))
+
+    def write_raw(self,address,words):
+        for i, w in enumerate(words): self._registers[address+i] = w & 0xFFFF
+
+    def read_raw(self,address,count):
+        # Refresh the time-dependent parameters in the requested range before reading
+        elapsed = time.monotonic() - self._start
+        for a in range(address, address+count):
+            key = self._address_dict.get(a)
+            if key is not None and callable(self._values.get(key)):
+                self.write_raw(a, self.encode(key, self._values[key](elapsed)))
+        return [self._registers.get(a, 0) for a in range(address, address+count)]
+
+    def handle_fault(self):
+        # Pick the fault of the current request (None, "timeout", or "exception")
+        if self.offline: return "timeout"
+        roll = self._random.random()
+        if roll < self._fault["timeout"]: return "timeout"
+        if roll < self._fault["timeout"] + self._fault["exception"]: return "exception"
+        return None
+
+class client:
+    def __init__(self,port='sim',method='rtu',stopbits=1,bytesize=8,parity='N',baudrate=9600,timeout=1,realtime=True):
+        self._port      = port
+        self._timeout   = timeout                   # the maximum time the master waits for a response (in seconds)
+        self._realtime  = realtime                  # False: do not sleep, only count the modelled bus time
+        # Transmission time of a single character on the serial line (start bit + data + parity + stop bits)
+        self._char_time = (1 + bytesize + (0 if parity == 'N' else 1) + stopbits) / baudrate
+        self._devices   = {}
+        self._lock      = threading.Lock()          # one request at a time on a serial port
+        self._stats     = {"requests":0, "timeouts":0, "exceptions":0, "bus_time":0}
+        self.connected  = False
+
+    def add_device(self,node,values=None,latency=5,fault=None,seed=None):
+        # Attach a simulated slave that serves the register map of the node library
+        self._devices[node._slave] = device(node, values, latency, fault, seed)
+        return self._devices[node._slave]
+
+    def connect(self):
+        self.connected = True
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def handle_timing(self,period):
+        # Count the modelled bus time and wait for it in realtime mode
+        self._stats["bus_time"] += period
+        if self._realtime and period > 0: time.sleep(period)
+
+    def transaction(self,slave,function_code,address,request_len,response_len,process):
+        # Simulate one RTU request/response cycle including 3.5 character silent interval of each frame
+        with self._lock:
+            self._stats["requests"] += 1
+            node = self._devices.get(slave)
+            fault = node.handle_fault() if node else "timeout"
+            self.handle_timing((request_len + 3.5) * self._char_time)
+            if fault == "timeout":
+                self._stats["timeouts"] += 1
+                self.handle_timing(self._timeout)
+                return error_response(function_code, "No response received from slave {}".format(slave))
+            if fault == "exception":
+                self._stats["exceptions"] += 1
+                self.handle_timing(node._latency + (5 + 3.5) * self._char_time)
+                return error_response(function_code | 0x80, "Exception response from slave {}".format(slave), 0x04)
+            registers = process(node)
+            self.handle_timing(node._latency + (response_len + 3.5) * self._char_time)
+            return register_response(function_code, address, registers)
+
+    def read_holding_registers(self,address,count=1,slave=1):
+        return self.transaction(slave, 0x03, address, 8, 5 + 2*count, lambda node: node.read_raw(address, count))
+
+    def read_input_registers(self,address,count=1,slave=1):
+        return self.transaction(slave, 0x04, address, 8, 5 + 2*count, lambda node: node.read_raw(address, count))
+
+    def write_register(self,address,value,slave=1):
+        return self.transaction(slave, 0x06, address, 8, 8, lambda node: (node.write_raw(address, [int(value)]), [int(value) & 0xFFFF])[1])
+
+    def write_registers(self,address,values,slave=1):
+        return self.transaction(slave, 0x10, address, 9 + 2*len(values), 8, lambda node: (node.write_raw(address, values), list(values))[1])
+
+### END OF FILE ###
@@ -19,11 +19,13 @@ import threading
 import logging
 from queue import Queue
 import query
+import ipc
 from pymodbus.client import ModbusSerialClient as ModbusClient
 from lib import kyuden_battery_72kWh as battery
 from lib import yaskawa_D1000 as converter
 from lib import yaskawa_GA500 as inverter
 from lib import tristar_MPPT as charger
+from lib import simulator
 
 # Logging setup
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -41,6 +43,7 @@ BAUDRATE        = 9600   # data/byte transmission speed (in bytes per second)
 CLIENT_LATENCY  = 100   # the delay time master/client takes from receiving response to sending a new command/request (in milliseconds)
 TIMEOUT         = 1   # the maximum time the master/client will wait for response from slave/server (in seconds)
 INTERVAL        = 3   # the period between each subsequent communication routine/loop (in seconds)
+SIMULATE        = False # True: replace the serial ports with simulated Modbus slaves (testing and benchmarking without devices)
 
 # Define FTP database parameters
 FTP_SERVER = {"host":"*HOST*",
@@ -72,10 +75,11 @@ INET_SOCKET_PATH = ('127.0.0.1', 9000) #AF_INET
 QUEUE = Queue()
 
 def setup_modbus():
-    global PORT0, PORT1, METHOD, BYTESIZE, STOPBITS, PARITY, BAUDRATE, CLIENT_LATENCY, TIMEOUT
+    global PORT0, PORT1, METHOD, BYTESIZE, STOPBITS, PARITY, BAUDRATE, CLIENT_LATENCY, TIMEOUT, SIMULATE
     # Set each Modbus communication port specification
-    client0 = ModbusClient(port=PORT0, method=METHOD, stopbits=STOPBITS1, bytesize=BYTESIZE, parity=PARITY, baudrate=BAUDRATE, timeout=TIMEOUT)
-    client1 = ModbusClient(port=PORT1, method=METHOD, stopbits=STOPBITS1, bytesize=BYTESIZE, parity=PARITY, baudrate=BAUDRATE, timeout=TIMEOUT)
+    Client = simulator.client if SIMULATE else ModbusClient
+    client0 = Client(port=PORT0, method=METHOD, stopbits=STOPBITS1, bytesize=BYTESIZE, parity=PARITY, baudrate=BAUDRATE, timeout=TIMEOUT)
+    client1 = Client(port=PORT1, method=METHOD, stopbits=STOPBITS1, bytesize=BYTESIZE, parity=PARITY, baudrate=BAUDRATE, timeout=TIMEOUT)
     # Connect to the Modbus serial
     client0.connect()
     client1.connect()
@@ -85,6 +89,9 @@ def setup_modbus():
     inv  = inverter.node(slave=3, name='INVERTER', client=client0, delay=CLIENT_LATENCY, max_count=20, increment=1, shift=0)
     crg  = charger.node(slave=4, name='SOLAR CHARGER', client=client0, delay=CLIENT_LATENCY)
     server = [conv, bat, inv, crg]
+    if SIMULATE:
+        # Serve each node's register map from a simulated slave on its port
+        for node in server: node._client.add_device(node)
     return server
 
 def read_modbus(server):
@@ -147,18 +154,21 @@ def update_SQL(title, data, timer, csv_file, sql_server, last_time, interval_upl
         query.retry_mysql(sql_server, sql_query, csv_file, timeout)
 ########################################################################
 def socket_client_thread(data_queue):
+    pending = None  # row taken from the queue but not sent yet, kept across reconnections
     while True:
         try:
             # Connect to the server
             with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
                 sock.connect(UNIX_SOCKET_PATH)
+                # New connection, the schema (title) is sent again before the first row
+                encoder = ipc.encoder()
                 while True:
                     # Wait for new data to be placed in the queue
-                    data_to_send = data_queue.get()
-                    # Send data
-                    sock.sendall(','.join(map(str, data_to_send)).encode('utf-8'))
-                    # Sleep for the interval
-                    time.sleep(INTERVAL)
+                    if pending is None: pending = data_queue.get()
+                    title, data = pending
+                    # Send data as framed binary rows
+                    sock.sendall(encoder.encode(title, data))
+                    pending = None
         except Exception as e:
             logging.error("Socket communication error: %s", e)
             # Sleep briefly before retrying
@@ -203,7 +213,7 @@ def main():
             timer = datetime.datetime.now()
             query.print_response(server, timer)
             title, data = data_processing(server, timer)
-            QUEUE.put(data)  # Put the processed data into the queue
+            QUEUE.put((title, data))  # Put the processed data (and its schema) into the queue
 
             # Check elapsed time
             if (timer - start).total_seconds() > SQL_INTERVAL or first[1] == True:
@@ -19,6 +19,7 @@ import threading
 import logging
 from queue import Queue
 import query
+import ipc
 from pymodbus.client import ModbusSerialClient as ModbusClient
 from lib import omron_KMN1FLK as kmn1
 #from lib import omron_KM50C1FLK as km50c1
@@ -166,18 +167,21 @@ def update_SQL(title, data, timer, csv_file, sql_server, last_time, interval_upl
         query.retry_mysql(sql_server, sql_query, csv_file, timeout)
 ########################################################################
 def socket_client_thread(data_queue):
+    pending = None  # row taken from the queue but not sent yet, kept across reconnections
     while True:
         try:
             # Connect to the server
             with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
                 sock.connect(UNIX_SOCKET_PATH)
+                # New connection, the schema (title) is sent again before the first row
+                encoder = ipc.encoder()
                 while True:
                     # Wait for new data to be placed in the queue
-                    data_to_send = data_queue.get()
-                    # Send data
-                    sock.sendall(','.join(map(str, data_to_send)).encode('utf-8'))
-                    # Sleep for the interval
-                    time.sleep(INTERVAL)
+                    if pending is None: pending = data_queue.get()
+                    title, data = pending
+                    # Send data as framed binary rows
+                    sock.sendall(encoder.encode(title, data))
+                    pending = None
         except Exception as e:
             logging.error("Socket communication error: %s", e)
             # Sleep briefly before retrying
@@ -223,7 +227,7 @@ def main():
             timer = datetime.datetime.now()
             query.print_response(server, timer)
             title, data = data_processing(server, timer)
-            QUEUE.put(data)  # Put the processed data into the queue
+            QUEUE.put((title, data))  # Put the processed data (and its schema) into the queue
 
             # Check elapsed time
             if (timer - start).total_seconds() > SQL_INTERVAL or first[1] == True:
@@ -20,6 +20,7 @@ import logging
 from pymodbus.client import ModbusSerialClient as ModbusClient
 from queue import Queue
 import query
+import ipc
 from lib import kyuden_battery_72kWh as battery
 from lib import yaskawa_D1000 as converter
 from lib import yaskawa_GA500 as inverter
@@ -139,18 +140,21 @@ def update_database(title, data, timer):
     query.retry_mysql(SQL_SERVER, sql_query, FILENAME, SQL_TIMEOUT)
 ########################################################################
 def socket_client_thread(data_queue):
+    pending = None  # row taken from the queue but not sent yet, kept across reconnections
     while True:
         try:
             # Connect to the server
             with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
                 sock.connect(UNIX_SOCKET_PATH)
+                # New connection, the schema (title) is sent again before the first row
+                encoder = ipc.encoder()
                 while True:
                     # Wait for new data to be placed in the queue
-                    data_to_send = data_queue.get()
-                    # Send data
-                    sock.sendall(','.join(map(str, data_to_send)).encode('utf-8'))
-                    # Sleep for the interval
-                    time.sleep(INTERVAL)
+                    if pending is None: pending = data_queue.get()
+                    title, data = pending
+                    # Send data as framed binary rows
+                    sock.sendall(encoder.encode(title, data))
+                    pending = None
         except Exception as e:
             logging.error("Socket communication error: %s", e)
             # Sleep briefly before retrying
@@ -194,7 +198,7 @@ def main():
             timer = datetime.datetime.now()
             query.print_response(server, timer)
             title, data = data_processing(server, timer)
-            QUEUE.put(data)  # Put the processed data into the queue
+            QUEUE.put((title, data))  # Put the processed data (and its schema) into the queue
 
             # Check elapsed time
             if (timer - start).total_seconds() > SQL_INTERVAL or first[1] == True: